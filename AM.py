@@ -1,165 +1,196 @@
-import time
-import random
-import requests
-import re
-import json
+import asyncio
+import logging
 import os
-import ssl
-import urllib3
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+import httpx
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 from dotenv import load_dotenv
-from utils import USER_AGENTS, KEYWORDS, EXCLUDED_KEYWORDS, EXCLUDED_URLS
+import http_client
+import metrics
+import parse_pool
+from amazon_extract import extract_category_links
+from database import initialize_database, register_urls, fetch_crawl_state, save_crawl_state
+from rules import get_rules
+from throttle import CHALLENGES, HostUnavailable
+from utils import normalize_product_url
 load_dotenv()
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Force TLS 1.2+ for Amazon SSL issues
-session = requests.Session()
-adapter = requests.adapters.HTTPAdapter()
-context = ssl.create_default_context()
-context.set_ciphers('DEFAULT@SECLEVEL=1')  # Adjust security level if needed
-context.check_hostname = False  # ✅ Disable check_hostname when verify=False
-context.verify_mode = ssl.CERT_NONE  # ✅ Ensure no certificate verification
-adapter.init_poolmanager(connections=10, maxsize=10, block=True, ssl_context=context)
-session.mount("https://", adapter)
-
-# Referral tag from environment variables
-REFERRAL_TAG = os.getenv("REFERRAL_TAG")
-if REFERRAL_TAG is None:
-    raise ValueError("REFERRAL_TAG environment variable is not set. Please check your .env file.")
+logger = logging.getLogger(__name__)
 
 AMAZON_CATEGORY_URL = os.getenv("AMAZON_CATEGORY_URL")
 AMAZON_NEWEST_URL = os.getenv("AMAZON_NEWEST_URL")
 AMAZON_POKEMON_URL = os.getenv("AMAZON_POKEMON_URL")
 
-# Path to product URLs file
-PRODUCT_URLS_FILE = "product_urls.py"
-
-def clean_amazon_url(url):
-    """Extract and clean the Amazon product URL, keeping only the base /dp/ link."""
-    parsed_url = urlparse(url)
-    match = re.search(r'(/dp/[^/?]+)', parsed_url.path)
-    if match:
-        return f"https://www.amazon.it{match.group(1)}"
-    return None  # Return None if the URL is not a valid product page
-
-def add_referral(url):
-    """Ensure only the referral tag is appended to a clean Amazon product URL."""
-    if url is None:
-        return None
-    return f"{url}?tag={REFERRAL_TAG.replace('?tag=', '')}"
-
-def fetch_amazon_product_links(category_url, retries=5):
-    """Fetch and extract unique product links from an Amazon category page."""
+CRAWL_MAX_PAGES = int(os.getenv("AMAZON_CRAWL_MAX_PAGES", 10))  # Page budget per category per crawl
+CRAWL_CONCURRENCY = int(os.getenv("AMAZON_CRAWL_CONCURRENCY", 3))  # Pages of one category fetched at once
+
+async def fetch_amazon_product_links(category_url, retries=5):
+    """Fetch and extract unique product links from an Amazon category page.
+
+    Links keep their slug path (the keyword filter matches on it); duplicates of one ASIN are dropped.
+    Returns None if the page could not be fetched (an empty list means the listing has no products).
+    Retries are paced by the shared per-host throttle, which also rotates the User-Agent.
+    """
     for attempt in range(retries):
         try:
             headers = {
-                "User-Agent": random.choice(USER_AGENTS),
                 "Accept-Language": "en-US,en;q=0.9",
-                "Accept-Encoding": "gzip, deflate, br",
                 "DNT": "1",
-                "Connection": "keep-alive",
                 "Upgrade-Insecure-Requests": "1",
             }
 
-            response = session.get(category_url, headers=headers, timeout=15, verify=False)  # ✅ SSL verify disabled
+            # Shared connection pool with the tracker (keep-alive and compression are handled by the client)
+            response = await http_client.get(category_url, headers=headers, timeout=15)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            seen_links = set()
-            product_links = []
+            # A challenge page has no product links; it must not end the crawl as an empty listing
+            if response.extensions["throttle_outcome"] in CHALLENGES:
+                outcome = response.extensions["throttle_outcome"]
+                logger.warning("%s response for %s, retrying...", outcome.capitalize(), category_url,
+                               extra={"sample": outcome})
+                continue
 
-            for link in soup.find_all("a", href=True):
-                url = link["href"]
-                if "/dp/" in url:
-                    full_url = urljoin("https://www.amazon.it", url.split("?")[0])  # Remove tracking params
-                    cleaned_url = clean_amazon_url(full_url)
+            # Listing pages are large; with PARSE_WORKERS the soup is built in a worker process
+            with metrics.timer("parse", "amazon.it"):
+                product_links = await parse_pool.run(extract_category_links, response.content, response.encoding)
 
-                    if cleaned_url and cleaned_url not in seen_links:
-                        seen_links.add(cleaned_url)
-                        product_links.append(cleaned_url)
-
-            print(f"[DEBUG] Extracted {len(product_links)} unique product links from {category_url}")
+            logger.debug("Extracted %d unique product links from %s", len(product_links), category_url)
             return product_links
 
-        except requests.exceptions.SSLError:
-            print(f"[ERROR] SSL Error encountered for {category_url}. Retrying in 5 seconds...")
-            time.sleep(5)
-            continue  # Retry
-
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] Error fetching {category_url}: {e}")
-            return []
+        except HostUnavailable as e:
+            logger.info("Not fetching %s: %s", category_url, e, extra={"sample": "breaker_open"})
+            return None
 
-    return []  # Return empty list if all retries fail
-
-def load_existing_urls():
-    """Load existing URLs from product_urls.py and ensure it's a list."""
-    if not os.path.exists(PRODUCT_URLS_FILE):
-        return []
+        except (httpx.ConnectError, httpx.ReadError) as e:
+            logger.warning("Connection error for %s (%s), retrying...", category_url, e)
+            continue  # Retry
 
-    try:
-        with open(PRODUCT_URLS_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if content:
-                content = content.replace("product_urls =", "").strip()
-                existing_urls = eval(content)
-                return existing_urls if isinstance(existing_urls, list) else []
-    except (SyntaxError, ValueError, Exception) as e:
-        print(f"[ERROR] Failed to read existing URLs: {e}")
-
-    return []
-
-def update_urls():
-    """Fetch new product links and merge them with existing URLs while ensuring uniqueness."""
-    existing_urls = set(load_existing_urls())
-
-    # Fetch links from all sources
+        except httpx.HTTPError as e:
+            logger.error("Error fetching %s: %s", category_url, e)
+            return None
+
+    return None  # All retries failed
+
+def category_page_url(category_url, page):
+    """URL of a listing page; Amazon paginates categories and searches with ?page=N."""
+    if page <= 1:
+        return category_url
+    parsed = urlparse(category_url)
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k != "page"]
+    query.append(("page", str(page)))
+    return urlunparse(parsed._replace(query=urlencode(query)))
+
+async def _walk_pages(category_url, start_page, budget, seen, stop_when_seen):
+    """Fetch listing pages from start_page on, CRAWL_CONCURRENCY at a time, until the budget runs out.
+
+    With stop_when_seen the walk ends at the first page that shows no unseen product.
+    Returns (links, new_keys, next_page, reached_end, pages_fetched); seen is updated in place.
+    """
+    links, new_keys = [], []
+    page = start_page
+    fetched = 0
+    while fetched < budget:
+        # Probe page 1 alone first: in the steady state it is the only page that changed
+        width = 1 if stop_when_seen and fetched == 0 else CRAWL_CONCURRENCY
+        wave = list(range(page, page + min(width, budget - fetched)))
+        fetched += len(wave)
+        results = await asyncio.gather(*(fetch_amazon_product_links(category_page_url(category_url, p)) for p in wave))
+
+        # Pages are judged in order; a stop discards the rest of the wave
+        for page, page_links in zip(wave, results):
+            if page_links is None:
+                return links, new_keys, page, False, fetched  # Fetch failed; pick up here next time
+            if not page_links:
+                return links, new_keys, page, True, fetched  # Past the last page
+
+            unseen = 0
+            for link in page_links:
+                product_key = normalize_product_url(link)[0]
+                if product_key not in seen:
+                    seen.add(product_key)
+                    new_keys.append(product_key)
+                    links.append(link)
+                    unseen += 1
+            if stop_when_seen and not unseen:
+                return links, new_keys, page + 1, False, fetched
+        page = wave[-1] + 1
+    return links, new_keys, page, False, fetched
+
+async def crawl_category(category_url, max_pages=CRAWL_MAX_PAGES):
+    """Return links to products a category listing shows that it hasn't shown before.
+
+    The walk from page 1 stops at the first page with nothing unseen, since new listings
+    appear at the top. Leftover page budget continues the deep walk through older pages
+    from the stored cursor until the end of the listing is found, so a repeat crawl costs
+    only the pages that changed plus a slice of the backlog.
+
+    Seen products include those the keyword rules filter out, which keeps the early stop
+    working; when the rules change the category's crawl state starts over so they get
+    filtered again under the new rules.
+    """
+    rules_fingerprint = get_rules("amazon").fingerprint
+    seen, next_page, exhausted = fetch_crawl_state(category_url, rules_fingerprint)
+
+    links, new_keys, head_end, reached_end, fetched = await _walk_pages(category_url, 1, max_pages, seen, stop_when_seen=True)
+    if reached_end:
+        exhausted, next_page = True, head_end
+    elif head_end > next_page:
+        next_page = head_end  # The head walk already covered part of the backlog
+
+    if not exhausted and fetched < max_pages:
+        deep_links, deep_keys, next_page, exhausted, _ = await _walk_pages(category_url, next_page, max_pages - fetched,
+                                                                           seen, stop_when_seen=False)
+        links += deep_links
+        new_keys += deep_keys
+
+    save_crawl_state(category_url, new_keys, next_page, exhausted, rules_fingerprint)
+    logger.info("Crawled %s: %d unseen product(s), deep walk %s", category_url, len(links),
+                "complete" if exhausted else f"at page {next_page}")
+    return links
+
+async def update_urls():
+    """Fetch new product links and merge them with existing URLs while ensuring uniqueness.
+
+    Returns the list of URLs that were added to the registry.
+    """
+    # Crawl all categories concurrently (per-host limits live in http_client)
+    categories = [url for url in (AMAZON_CATEGORY_URL, AMAZON_NEWEST_URL, AMAZON_POKEMON_URL) if url]
     new_urls = set()
-    new_urls.update(fetch_amazon_product_links(AMAZON_CATEGORY_URL))
-    new_urls.update(fetch_amazon_product_links(AMAZON_NEWEST_URL))
-    new_urls.update(fetch_amazon_product_links(AMAZON_POKEMON_URL))
-
-    print(f"[DEBUG] Combined unique new URLs: {len(new_urls)}")
+    for links in await asyncio.gather(*(crawl_category(category_url) for category_url in categories)):
+        new_urls.update(links)
 
-    # Ensure URLs contain at least one keyword and exclude any unwanted ones
-    filtered_new_urls = {
-        url for url in new_urls
-        if any(keyword.lower() in url.lower() for keyword in KEYWORDS)
-        and not any(excluded_keyword.lower() in url.lower() for excluded_keyword in EXCLUDED_KEYWORDS)
-        and url not in EXCLUDED_URLS
-    }
+    logger.debug("Combined unique new URLs: %d", len(new_urls))
 
-    print(f"[DEBUG] Filtered URLs after applying keyword and exclusion checks: {len(filtered_new_urls)}")
+    # Ensure URLs contain at least one keyword and exclude any unwanted ones (rules.json / utils.py)
+    filtered_new_urls = get_rules("amazon").filter(new_urls)
 
-    # Clean and apply referral tag to URLs
-    cleaned_urls = {clean_amazon_url(url) for url in filtered_new_urls}
-    cleaned_urls = {url for url in cleaned_urls if url is not None}  # Remove None values
-    new_urls_with_referral = {add_referral(url) for url in cleaned_urls}
+    logger.debug("Filtered URLs after applying keyword and exclusion checks: %d", len(filtered_new_urls))
 
-    # Ensure only truly new URLs are added
-    urls_to_add = new_urls_with_referral - existing_urls
+    # The registry stores canonical /dp/<ASIN> URLs; the referral tag is added when notifying
+    urls_to_add = register_urls(sorted(filtered_new_urls), "amazon")
 
     if urls_to_add:
-        updated_urls = list(existing_urls.union(urls_to_add))
+        logger.debug("New URLs being added: %s", urls_to_add)
+        logger.info("Added %d new Amazon URLs to the registry.", len(urls_to_add))
+    else:
+        logger.info("No new Amazon URLs found.")
 
-        # Log the new URLs being added
-        print(f"[INFO] New URLs being added: {urls_to_add}")
+    return urls_to_add
 
-        with open(PRODUCT_URLS_FILE, "w", encoding="utf-8") as f:
-            f.write(f"product_urls = {json.dumps(updated_urls, indent=4)}")
-        
-        print(f"[INFO] Added {len(urls_to_add)} new URLs. Total URLs: {len(updated_urls)}")
-    else:
-        print(f"[INFO] No new Amazon URLs found. Keeping existing list.")
+async def _run_once():
+    initialize_database()
+    try:
+        await update_urls()
+    finally:
+        await http_client.close_client()
 
 if __name__ == "__main__":
     import sys
+    from logging_setup import setup_logging
 
+    setup_logging()
     if "--once" in sys.argv:
-        print("[INFO] Running am.py once for URL updates...")
-        update_urls()
+        logger.info("Running am.py once for URL updates...")
+        asyncio.run(_run_once())
     else:
-        print("[INFO] Running am.py once for URL updates...")
-        update_urls()
+        logger.info("Running am.py once for URL updates...")
+        asyncio.run(_run_once())
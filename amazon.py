@@ -1,142 +1,96 @@
-import requests
-from bs4 import BeautifulSoup
+import logging
+import httpx
 import random
 import sys
 import os
-import time
 import asyncio
-from urllib.parse import urljoin
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from utils import clean_amazon_url, KEYWORDS, EXCLUDED_KEYWORDS, EXCLUDED_URLS, USER_AGENTS  # ✅ Import USER_AGENTS from utils.py
-from product_urls import product_urls
+import http_client
+import metrics
+import page_archive
+import parse_pool
+from amazon_extract import parse_amazon_page, PAGE_UNCHANGED, PAGE_SKIPPED
+from throttle import CHALLENGES, HostUnavailable
+from scheduler import url_domain
+from utils import clean_amazon_url
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# ✅ Create a session to reuse connections (faster scraping)
-session = requests.Session()
+logger = logging.getLogger(__name__)
 
-def fetch(url, retries=5):
-    """Fetch page content with retries and delay to avoid CAPTCHAs."""
-    headers = {
-        "User-Agent": random.choice(USER_AGENTS),  # ✅ Uses imported USER_AGENTS
-        "Accept-Language": "it-IT,it;q=0.9"
-    }
+async def fetch(url, retries=5):
+    """Fetch page content as text (see fetch_response). Returns None on failure."""
+    response = await fetch_response(url, retries)
+    return response.text if response is not None else None
 
-    for attempt in range(retries):
-        try:
-            response = session.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            # Check for CAPTCHA or empty response
-            if "captcha" in response.text.lower() or "Type the characters you see below" in response.text:
-                print(f"[🚨] CAPTCHA detected. Retrying {attempt+1}/{retries}...")
-                time.sleep(random.uniform(5, 10))  # Longer delay
-                continue
+async def fetch_response(url, retries=5):
+    """Fetch a page, retrying CAPTCHAs, empty pages and errors.
 
-            if response.text.strip() == "":
-                print(f"[🚨] Empty response for {url}. Retrying {attempt+1}/{retries}...")
-                time.sleep(random.uniform(5, 10))  # Increase delay
-                continue
-
-            return response.text
-
-        except requests.RequestException as e:
-            print(f"[🚨] Request failed for {url}: {e}")
-            time.sleep(random.uniform(3, 7))  # Delay before retry
-
-    print(f"[ERROR] Failed to fetch {url} after {retries} retries.")
-    return None
+    Pacing between attempts, User-Agent rotation and backing off from a host that keeps
+    challenging us are handled by the shared per-host throttle in http_client. Returns None
+    after the last retry, or straight away while the host's circuit breaker is open.
+    """
+    headers = {"Accept-Language": "it-IT,it;q=0.9"}
+    domain = url_domain(url)
 
-def fetch_amazon_product_links(category_url, retries=5):
-    """Fetch and extract unique product links from an Amazon category page."""
     for attempt in range(retries):
+        if attempt:
+            metrics.increment("retries", domain)
         try:
-            headers = {
-                "User-Agent": random.choice(USER_AGENTS),  # ✅ Uses imported USER_AGENTS
-                "Accept-Language": "en-US,en;q=0.9",
-                "Accept-Encoding": "gzip, deflate, br",
-                "DNT": "1",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-            }
-
-            response = session.get(category_url, headers=headers, timeout=15, verify=False)
+            response = await http_client.get(url, headers=headers, timeout=10)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            seen_links = set()
-            product_links = []
+            outcome = response.extensions["throttle_outcome"]
+            if outcome in CHALLENGES:
+                logger.warning("%s response for %s. Retrying %d/%d...", outcome.capitalize(), url, attempt + 1, retries,
+                               extra={"sample": outcome})
+                continue
 
-            for link in soup.find_all("a", href=True):
-                url = link["href"]
-                if "/dp/" in url:
-                    full_url = urljoin("https://www.amazon.it", url.split("?")[0])
-                    cleaned_url = clean_amazon_url(full_url)
+            return response
 
-                    # Filtering
-                    if cleaned_url and cleaned_url not in seen_links:
-                        if any(keyword.lower() in cleaned_url.lower() for keyword in KEYWORDS) and \
-                           not any(excluded.lower() in cleaned_url.lower() for excluded in EXCLUDED_KEYWORDS):
-                            seen_links.add(cleaned_url)
-                            product_links.append(cleaned_url)
+        except HostUnavailable as e:
+            logger.info("Not fetching %s: %s", url, e, extra={"sample": "breaker_open"})
+            return None
+        except httpx.HTTPError as e:
+            logger.warning("Request failed for %s: %s", url, e)
 
-            return product_links
+    metrics.increment("fetch_failures", domain)
+    logger.error("Failed to fetch %s after %d retries.", url, retries)
+    return None
 
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] Error fetching {category_url}: {e}")
-            return []
+async def get_amazon_product_details(url, previous_fingerprint=None):
+    """Extract Amazon product details if fulfilled & shipped by Amazon.
 
-async def get_amazon_product_details(url):
-    """Extract Amazon product details if fulfilled & shipped by Amazon."""
+    Returns PAGE_UNCHANGED without parsing when the page fingerprint equals previous_fingerprint,
+    PAGE_SKIPPED for offers not fulfilled by Amazon and None if the page couldn't be fetched;
+    parsed product data carries the new fingerprint under "fingerprint".
+    """
     await asyncio.sleep(random.uniform(2, 6))  # Random delay to avoid detection
 
-    clean_url = clean_amazon_url(url)
-    print(f"[DEBUG] Fetching details for URL: {clean_url}")
-    html = fetch(clean_url)
-    if not html:
-        print(f"[WARNING] Skipping {clean_url} due to missing page content.")
-        return None
-
-    soup = BeautifulSoup(html, "html.parser")
-
-    # Extract merchant and fulfillment info
-    merchant_element = soup.select_one('[offer-display-feature-name="desktop-merchant-info"] .offer-display-feature-text-message')
-    fulfillment_element = soup.select_one('[offer-display-feature-name="desktop-fulfiller-info"] .offer-display-feature-text-message')
-
-    # Alternative selectors
-    if not merchant_element:
-        merchant_element = soup.select_one("#merchant-info")
-    if not fulfillment_element:
-        fulfillment_element = soup.select_one("#shipsFromSoldBy_feature_div")
-
-    merchant_text = merchant_element.get_text(strip=True) if merchant_element else "Unknown Merchant"
-    fulfillment_text = fulfillment_element.get_text(strip=True) if fulfillment_element else "Unknown Fulfillment"
-
-    print(f"[DEBUG] Merchant: '{merchant_text}', Fulfillment: '{fulfillment_text}'")
-
-    is_fulfilled_by_amazon = "amazon" in merchant_text.lower() and "amazon" in fulfillment_text.lower()
-
-    if not is_fulfilled_by_amazon:
-        print(f"[INFO] Skipping {clean_url} (Not fulfilled & shipped by Amazon)")
+    clean_url = clean_amazon_url(url) or url
+    logger.debug("Fetching details for URL: %s", clean_url)
+    response = await fetch_response(clean_url)
+    if response is None:
+        logger.warning("Skipping %s due to missing page content.", clean_url)
         return None
+    await page_archive.store(clean_url, response)  # Only with PAGE_ARCHIVE_DIR set; see reextract.py
 
-    # Extract product details
-    title_element = soup.select_one("#productTitle")
-    title_text = title_element.get_text(strip=True) if title_element else "Titolo non trovato"
+    # Only the buy box, title, price and image regions are parsed, in a worker process with PARSE_WORKERS
+    with metrics.timer("parse", "amazon.it"):
+        fingerprint, extracted = await parse_pool.run(parse_amazon_page, response.content, response.encoding,
+                                                      previous_fingerprint)
+    if extracted is None:
+        return PAGE_UNCHANGED
+    product_data, merchant_text, fulfillment_text = extracted
 
-    price_element = soup.select_one(".a-price .a-offscreen")
-    image_element = soup.select_one("#landingImage")
+    logger.debug("Merchant: '%s', Fulfillment: '%s'", merchant_text, fulfillment_text)
 
-    product_data = {
-        "title": title_text,
-        "price": price_element.get_text(strip=True) if price_element else "Prezzo non disponibile",
-        "availability": True,
-        "image_url": image_element["src"] if image_element else "Immagine non trovata"
-    }
+    if product_data is None:
+        logger.info("Skipping %s (Not fulfilled & shipped by Amazon)", clean_url, extra={"sample": "not_fulfilled_by_amazon"})
+        return PAGE_SKIPPED
 
-    print(f"[SUCCESS] Scraped: {product_data['title']}")
+    logger.debug("Scraped: %s", product_data['title'])
 
-    # Free memory
-    del soup
+    product_data["fingerprint"] = fingerprint
     return product_data
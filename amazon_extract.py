@@ -0,0 +1,306 @@
+import hashlib
+import re
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+from money import parse_price, UNAVAILABLE
+from utils import normalize_product_url
+
+# Selectors used on Amazon product pages, in lookup order
+MERCHANT_SELECTOR = '[offer-display-feature-name="desktop-merchant-info"] .offer-display-feature-text-message'
+FULFILLER_SELECTOR = '[offer-display-feature-name="desktop-fulfiller-info"] .offer-display-feature-text-message'
+MERCHANT_FALLBACK_SELECTOR = "#merchant-info"
+FULFILLER_FALLBACK_SELECTOR = "#shipsFromSoldBy_feature_div"
+TITLE_SELECTOR = "#productTitle"
+PRICE_SELECTOR = ".a-price .a-offscreen"
+IMAGE_SELECTOR = "#landingImage"
+
+# Literal text that must appear inside the start tag of the element each selector is rooted at
+SELECTOR_ANCHORS = {
+    MERCHANT_SELECTOR: "desktop-merchant-info",
+    FULFILLER_SELECTOR: "desktop-fulfiller-info",
+    MERCHANT_FALLBACK_SELECTOR: "merchant-info",
+    FULFILLER_FALLBACK_SELECTOR: "shipsFromSoldBy_feature_div",
+    TITLE_SELECTOR: "productTitle",
+    PRICE_SELECTOR: "a-price",
+    IMAGE_SELECTOR: "landingImage",
+}
+
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+RAW_TEXT_ELEMENTS = ("script", "style")
+TOKEN_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-")
+TAG_NAME_TERMINATORS = {" ", "\t", "\r", "\n", "/", ">"}
+
+# Regions whose raw bytes make up a page fingerprint: (anchor, literal the region must contain).
+# They mirror the selectors above, plus the availability block.
+FINGERPRINT_REGIONS = (
+    ("desktop-merchant-info", "offer-display-feature-text-message"),
+    ("desktop-fulfiller-info", "offer-display-feature-text-message"),
+    ("merchant-info", None),
+    ("shipsFromSoldBy_feature_div", None),
+    ("productTitle", None),
+    ("a-price", "a-offscreen"),
+    ("landingImage", None),
+    ("availability", None),
+)
+
+# Quoted attribute values are consumed whole so a '>' inside them doesn't end the tag
+START_TAG_SCAN_RE = re.compile(r'"[^"]*"|\'[^\']*\'|>')
+
+# Returned by scrapers instead of product data when the page fingerprint matches the stored one
+PAGE_UNCHANGED = object()
+
+# Returned by scrapers for a page that was fetched and parsed but isn't a product to track
+# (e.g. not fulfilled by Amazon); unlike None it is not a scrape failure
+PAGE_SKIPPED = object()
+
+class RegionNotFound(Exception):
+    """Raised when an element's extent can't be determined from the raw HTML."""
+
+def extract_amazon_product_soup(html):
+    """Reference extractor: parse the whole page with BeautifulSoup.
+
+    Returns (product_data or None, merchant_text, fulfillment_text).
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    return _extract(soup.select_one)
+
+def extract_amazon_product(html):
+    """Targeted extractor: locate the few regions the selectors need and parse only those.
+
+    Same result as extract_amazon_product_soup(); falls back to it when a region
+    can't be delimited reliably.
+    """
+    try:
+        return _extract(lambda selector: _select_region(html, selector))
+    except RegionNotFound:
+        return extract_amazon_product_soup(html)
+
+def amazon_fingerprint(html):
+    """Fingerprint of the buy box, title, price, image and availability regions (see page_fingerprint)."""
+    return page_fingerprint(html, FINGERPRINT_REGIONS)
+
+# Entry points for parse_pool workers: they take the raw response body and return only small,
+# picklable results, so a page crosses the process boundary once, as bytes
+
+def parse_amazon_page(content, encoding, previous_fingerprint=None):
+    """Decode and fingerprint a product page, extracting it only if the fingerprint changed.
+
+    Returns (fingerprint, extracted); extracted is None for an unchanged page, otherwise the
+    (product_data, merchant_text, fulfillment_text) result of extract_amazon_product().
+    """
+    html = content.decode(encoding or "utf-8", errors="replace")
+    fingerprint = amazon_fingerprint(html)
+    if fingerprint is not None and fingerprint == previous_fingerprint:
+        return fingerprint, None
+    return fingerprint, extract_amazon_product(html)
+
+def extract_category_links(content, encoding):
+    """Product links (slug path kept, tracking query removed) on a listing page, one per product."""
+    soup = BeautifulSoup(content.decode(encoding or "utf-8", errors="replace"), "html.parser")
+    seen_keys = set()
+    product_links = []
+    for link in soup.find_all("a", href=True):
+        url = link["href"]
+        if "/dp/" in url:
+            full_url = urljoin("https://www.amazon.it", url.split("?")[0])
+            product_key, _ = normalize_product_url(full_url)
+            if product_key and product_key not in seen_keys:
+                seen_keys.add(product_key)
+                product_links.append(full_url)
+    return product_links
+
+def _extract(select_one):
+    # Extract merchant and fulfillment info
+    merchant_element = select_one(MERCHANT_SELECTOR)
+    fulfillment_element = select_one(FULFILLER_SELECTOR)
+
+    # Alternative selectors
+    if not merchant_element:
+        merchant_element = select_one(MERCHANT_FALLBACK_SELECTOR)
+    if not fulfillment_element:
+        fulfillment_element = select_one(FULFILLER_FALLBACK_SELECTOR)
+
+    merchant_text = merchant_element.get_text(strip=True) if merchant_element else "Unknown Merchant"
+    fulfillment_text = fulfillment_element.get_text(strip=True) if fulfillment_element else "Unknown Fulfillment"
+
+    is_fulfilled_by_amazon = "amazon" in merchant_text.lower() and "amazon" in fulfillment_text.lower()
+    if not is_fulfilled_by_amazon:
+        return None, merchant_text, fulfillment_text
+
+    # Extract product details
+    title_element = select_one(TITLE_SELECTOR)
+    title_text = title_element.get_text(strip=True) if title_element else "Titolo non trovato"
+
+    price_element = select_one(PRICE_SELECTOR)
+    image_element = select_one(IMAGE_SELECTOR)
+
+    product_data = {
+        "title": title_text,
+        "price": parse_price(price_element.get_text(strip=True)) if price_element else UNAVAILABLE,  # Cents
+        "availability": True,
+        "image_url": image_element["src"] if image_element else "Immagine non trovata"
+    }
+    return product_data, merchant_text, fulfillment_text
+
+def _inside_raw_text(html, pos):
+    """True if pos lies inside a <script>, <style> or comment, which html.parser doesn't treat as markup."""
+    for opener, closer in (("<script", "</script"), ("<style", "</style"), ("<!--", "-->")):
+        start = html.rfind(opener, 0, pos)
+        if start != -1 and html.find(closer, start, pos) == -1:
+            return True
+    return False
+
+def _start_tag_end(html, lt):
+    """Return the index just past the '>' closing the tag that starts at lt, or -1."""
+    for match in START_TAG_SCAN_RE.finditer(html, lt):
+        if match.group() == ">":
+            return match.end()
+    return -1
+
+def _starts_tag(html, pos, token):
+    """True if a tag named by token (e.g. "<div" or "</div") starts at pos."""
+    if not html.startswith(token, pos):
+        return False
+    following = html[pos + len(token):pos + len(token) + 1]
+    return following in TAG_NAME_TERMINATORS
+
+def _element_end(html, tag_name, start_tag_end):
+    """Return the index just past the end tag matching the element whose start tag ends at start_tag_end.
+
+    Counts nested start/end tags of the same name, which mirrors how html.parser
+    closes elements; script/style bodies and comments are skipped whole.
+    """
+    if tag_name in VOID_ELEMENTS or html[start_tag_end - 2] == "/":
+        return start_tag_end
+
+    open_token = "<" + tag_name
+    close_token = "</" + tag_name
+    depth = 1
+    pos = start_tag_end
+    while True:
+        lt = html.find("<", pos)
+        if lt == -1:
+            raise RegionNotFound(tag_name)
+
+        if html.startswith("<!--", lt):
+            end = html.find("-->", lt + 4)
+            if end == -1:
+                raise RegionNotFound(tag_name)
+            pos = end + 3
+            continue
+
+        raw_text = next((name for name in RAW_TEXT_ELEMENTS if _starts_tag(html, lt, "<" + name)), None)
+        if raw_text and raw_text != tag_name:
+            end = html.find("</" + raw_text, lt + 1)
+            if end == -1:
+                raise RegionNotFound(tag_name)
+            pos = end
+            continue
+
+        # A '<' not followed by a name, '/' or '!' is plain text to html.parser
+        following = html[lt + 1:lt + 2]
+        if not (following.isalpha() or following in "/!?"):
+            pos = lt + 1
+            continue
+
+        end = _start_tag_end(html, lt)
+        if end == -1:
+            raise RegionNotFound(tag_name)
+        if _starts_tag(html, lt, close_token):
+            depth -= 1
+            if depth == 0:
+                return end
+        elif _starts_tag(html, lt, open_token) and html[end - 2] != "/":
+            depth += 1
+        pos = end
+
+def page_fingerprint(html, regions):
+    """Hash of the raw bytes of the given (anchor, required) regions, or None if one can't be delimited.
+
+    Equal fingerprints mean every region the extractor reads is byte-for-byte unchanged,
+    so the page doesn't need to be parsed again.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        for anchor, required in regions:
+            digest.update(raw_region(html, anchor, required).encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+    except RegionNotFound:
+        return None
+    return digest.hexdigest()
+
+def raw_region(html, anchor, required=None, start=0):
+    """Raw HTML of the first element whose start tag contains anchor as a whole token
+    (and whose body contains required, if given), or "" if there is none.
+
+    A byte scan only, nothing is parsed. Raises RegionNotFound if the element's end can't be found.
+    """
+    pos = html.find(anchor, start)
+    while pos != -1:
+        next_pos = html.find(anchor, pos + len(anchor))
+        before = html[pos - 1] if pos else ""
+        after = html[pos + len(anchor):pos + len(anchor) + 1]
+        tag_start = html.rfind("<", 0, pos)
+        if before in TOKEN_CHARS or after in TOKEN_CHARS or tag_start == -1 or _inside_raw_text(html, tag_start):
+            pos = next_pos
+            continue
+        start_tag_end = _start_tag_end(html, tag_start)
+        if start_tag_end == -1:
+            raise RegionNotFound(anchor)
+        name_end = tag_start + 1
+        while name_end < start_tag_end and html[name_end] not in " \t\r\n/>":
+            name_end += 1
+        tag_name = html[tag_start + 1:name_end].lower()
+        if start_tag_end <= pos or not tag_name or not tag_name[0].isalpha():
+            pos = next_pos
+            continue
+
+        region = html[tag_start:_element_end(html, tag_name, start_tag_end)]
+        if required is None or required in region:
+            return region
+        pos = html.find(anchor, tag_start + len(region))
+    return ""
+
+def _select_region(html, selector):
+    """Equivalent of soup.select_one(selector) that only parses candidate elements."""
+    anchor = SELECTOR_ANCHORS[selector]
+    pos = html.find(anchor)
+    while pos != -1:
+        next_pos = html.find(anchor, pos + len(anchor))
+
+        # The anchor must be a whole token inside a start tag outside script/comment text
+        before = html[pos - 1] if pos else ""
+        after = html[pos + len(anchor):pos + len(anchor) + 1]
+        if before in TOKEN_CHARS or after in TOKEN_CHARS:
+            pos = next_pos
+            continue
+        tag_start = html.rfind("<", 0, pos)
+        if tag_start == -1 or _inside_raw_text(html, tag_start):
+            pos = next_pos
+            continue
+        start_tag_end = _start_tag_end(html, tag_start)
+        if start_tag_end == -1:
+            raise RegionNotFound(selector)
+        if start_tag_end <= pos:
+            # Anchor is in text content, not inside this start tag
+            pos = next_pos
+            continue
+
+        name_end = tag_start + 1
+        while name_end < start_tag_end and html[name_end] not in " \t\r\n/>":
+            name_end += 1
+        tag_name = html[tag_start + 1:name_end].lower()
+        if not tag_name or not tag_name[0].isalpha():
+            pos = next_pos
+            continue
+
+        element_end = _element_end(html, tag_name, start_tag_end)
+        match = BeautifulSoup(html[tag_start:element_end], "html.parser").select_one(selector)
+        if match is not None:
+            return match
+
+        # Candidates nested inside this element were already covered by the fragment
+        while next_pos != -1 and next_pos < element_end:
+            next_pos = html.find(anchor, next_pos + len(anchor))
+        pos = next_pos
+    return None
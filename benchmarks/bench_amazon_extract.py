@@ -0,0 +1,89 @@
+"""Benchmark the targeted Amazon extractor against the full BeautifulSoup parse.
+
+Usage:
+    python benchmarks/bench_amazon_extract.py [--iterations N]
+    python benchmarks/bench_amazon_extract.py --capture https://www.amazon.it/dp/XXXXXXXXXX ...
+
+Every page in benchmarks/corpus/amazon (*.html or *.html.gz) is run through both
+extractors; the script fails if their outputs differ.
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from amazon_extract import extract_amazon_product, extract_amazon_product_soup, amazon_fingerprint
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus", "amazon")
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    """Return {name: html} for every stored page."""
+    pages = {}
+    for filename in sorted(os.listdir(corpus_dir)):
+        path = os.path.join(corpus_dir, filename)
+        if filename.endswith(".html.gz"):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                pages[filename[:-len(".html.gz")]] = f.read()
+        elif filename.endswith(".html"):
+            with open(path, "r", encoding="utf-8") as f:
+                pages[filename[:-len(".html")]] = f.read()
+    return pages
+
+def pages_per_second(extractor, pages, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for html in pages:
+            extractor(html)
+    return iterations * len(pages) / (time.perf_counter() - start)
+
+async def capture(urls, corpus_dir=CORPUS_DIR):
+    """Fetch live product pages into the corpus (gzip-compressed)."""
+    from amazon import fetch
+    from http_client import close_client
+
+    for url in urls:
+        html = await fetch(url)
+        if not html:
+            print(f"[ERROR] Could not capture {url}")
+            continue
+        match = re.search(r"/dp/([A-Z0-9]{10})", url)
+        name = match.group(1) if match else re.sub(r"\W+", "_", url)[-40:]
+        with gzip.open(os.path.join(corpus_dir, f"{name}.html.gz"), "wt", encoding="utf-8") as f:
+            f.write(html)
+        print(f"[INFO] Captured {url} -> {name}.html.gz")
+    await close_client()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--capture", nargs="+", metavar="URL", help="store live pages in the corpus instead of benchmarking")
+    args = parser.parse_args()
+
+    if args.capture:
+        asyncio.run(capture(args.capture))
+        return
+
+    corpus = load_corpus()
+    if not corpus:
+        sys.exit(f"[ERROR] No pages found in {CORPUS_DIR}")
+
+    mismatches = [name for name, html in corpus.items() if extract_amazon_product(html) != extract_amazon_product_soup(html)]
+    if mismatches:
+        sys.exit(f"[ERROR] Extractor output differs from BeautifulSoup for: {', '.join(mismatches)}")
+
+    pages = list(corpus.values())
+    baseline = pages_per_second(extract_amazon_product_soup, pages, args.iterations)
+    targeted = pages_per_second(extract_amazon_product, pages, args.iterations)
+    fingerprint = pages_per_second(amazon_fingerprint, pages, args.iterations)
+
+    print(f"Corpus: {len(pages)} pages, {sum(map(len, pages)) / len(pages) / 1024:.0f} KiB average")
+    print(f"BeautifulSoup full parse: {baseline:8.1f} pages/s")
+    print(f"Targeted extractor:       {targeted:8.1f} pages/s  ({targeted / baseline:.1f}x)")
+    print(f"Fingerprint (unchanged):  {fingerprint:8.1f} pages/s  ({fingerprint / baseline:.1f}x)")
+
+if __name__ == "__main__":
+    main()
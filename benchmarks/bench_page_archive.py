@@ -0,0 +1,109 @@
+"""Benchmark the raw page archive: storing fetched pages and re-extracting from them.
+
+Usage:
+    python benchmarks/bench_page_archive.py [--fetches N] [--unique-share 0.3]
+
+Archives N fetches of the corpus pages into a temporary archive and database.
+unique_share of the fetches get a per-fetch token appended (like Amazon's
+request ids), the rest are byte-identical repeats that deduplicate. Then
+reextract.py's pass runs over the newest page of each product. Reports write
+throughput, compression and deduplication, and re-extraction pages per second.
+Finally checks that an archived page older than a later live observation of its
+product is not re-applied over it.
+"""
+import argparse
+import asyncio
+import atexit
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_tmp_dir = tempfile.mkdtemp(prefix="bench-archive-")
+atexit.register(shutil.rmtree, _tmp_dir, ignore_errors=True)
+os.environ["DATABASE_PATH"] = os.path.join(_tmp_dir, "bench.db")
+os.environ["PAGE_ARCHIVE_DIR"] = os.path.join(_tmp_dir, "archive")
+os.environ["PAGE_ARCHIVE_MIN_INTERVAL"] = "0"
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import database
+import page_archive
+import reextract
+from bench_amazon_extract import load_corpus
+
+GAMESTOP_CORPUS_DIR = os.path.join(BENCH_DIR, "corpus", "gamestop")
+
+def load_pages():
+    """[(url, html bytes)] for every corpus page, Amazon and GameStop."""
+    pages = [(f"https://www.amazon.it/dp/B0ARCH{index:04d}", html.encode("utf-8"))
+             for index, html in enumerate(load_corpus().values())]
+    for index, filename in enumerate(sorted(os.listdir(GAMESTOP_CORPUS_DIR))):
+        if filename.endswith(".html.gz"):
+            with gzip.open(os.path.join(GAMESTOP_CORPUS_DIR, filename), "rb") as f:
+                pages.append((f"https://www.gamestop.it/Games/product/{100000 + index}", f.read()))
+    return pages
+
+def check_stale_page(pages):
+    """Archive a page, record a lower live price an hour later, re-extract: the live price must stay."""
+    fetched_at = 1_800_000_000
+    for index, (_, body) in enumerate(pages):
+        url = f"https://www.amazon.it/dp/B0STALE{index:03d}"
+        page_archive._store(url, body, "utf-8", fetched_at)
+        asyncio.run(reextract.reextract([url]))
+        state = database.ProductStateCache.load()
+        details = state.previous_details(url)
+        if details and details["price"]:
+            break
+    else:
+        raise SystemExit("no corpus page with a price")
+
+    live_price = details["price"] - 500
+    state.stage(url, details["title"], live_price, details["availability"], details["image_url"],
+                observed_at=fetched_at + 3600)
+    state.flush()
+    counts = asyncio.run(reextract.reextract([url]))
+    stored = database.ProductStateCache.load().previous_details(url)["price"]
+    assert counts["stale"] == 1 and stored == live_price, (counts, stored, live_price)
+    print(f"stale page   skipped (live {live_price} cents kept over archived {details['price']})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fetches", type=int, default=500)
+    parser.add_argument("--unique-share", type=float, default=0.3, help="share of fetches with a changed body")
+    args = parser.parse_args()
+
+    database.initialize_database()
+    pages = load_pages()
+    unique_every = max(1, round(1 / args.unique_share)) if args.unique_share > 0 else 0
+
+    raw_bytes = 0
+    start = time.perf_counter()
+    for fetch in range(args.fetches):
+        url, body = pages[fetch % len(pages)]
+        if unique_every and fetch % unique_every == 0:
+            body += f"<!-- request {fetch} -->".encode()
+        raw_bytes += len(body)
+        page_archive._store(url, body, "utf-8", 1_700_000_000 + fetch)
+    write_seconds = time.perf_counter() - start
+
+    stats = database.archive_stats()
+    on_disk = sum(os.path.getsize(page_archive.chunk_path(chunk)) for chunk in page_archive._chunks())
+    print(f"{args.fetches} fetches of {len(pages)} pages, {raw_bytes / 1e6:.1f} MB raw")
+    print(f"store        {args.fetches / write_seconds:10.1f} pages/s   {raw_bytes / 1e6 / write_seconds:8.1f} MB/s")
+    print(f"on disk      {on_disk / 1e6:10.2f} MB      {raw_bytes / on_disk:6.1f}x smaller "
+          f"({stats['bodies']} distinct bodies for {stats['pages']} fetches)")
+
+    start = time.perf_counter()
+    counts = asyncio.run(reextract.reextract())
+    elapsed = time.perf_counter() - start
+    print(f"reextract    {counts['pages'] / elapsed:10.1f} pages/s   "
+          f"({counts['extracted']} extracted, {counts['changed']} changed)")
+
+    check_stale_page(pages)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark Amazon page parsing inline vs in the parse worker pool.
+
+Usage:
+    python benchmarks/bench_parse_pool.py [--workers 1 2 4] [--pages N]
+
+Parses the stored corpus pages (as raw bytes, like http_client responses)
+concurrently through parse_pool.run() and reports pages per second for inline
+parsing and for each worker count. Event-loop stall is the longest gap a 10 ms
+ticker coroutine saw while the parsing ran.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import parse_pool
+from amazon_extract import parse_amazon_page
+from bench_amazon_extract import load_corpus
+
+async def _ticker(stop, gaps):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        gaps.append(now - last - 0.01)
+        last = now
+
+async def _parse_all(pages):
+    stop, gaps = asyncio.Event(), []
+    ticker = asyncio.create_task(_ticker(stop, gaps))
+    start = time.perf_counter()
+    await asyncio.gather(*(parse_pool.run(parse_amazon_page, page, "utf-8", None) for page in pages))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    return len(pages) / elapsed, max(gaps, default=0.0)
+
+def measure(workers, pages):
+    parse_pool.PARSE_WORKERS = workers
+    parse_pool.warm_up()
+    try:
+        return asyncio.run(_parse_all(pages))
+    finally:
+        parse_pool.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--pages", type=int, default=200, help="pages parsed per run (corpus pages repeated)")
+    args = parser.parse_args()
+
+    corpus = [html.encode("utf-8") for html in load_corpus().values()]
+    pages = [corpus[index % len(corpus)] for index in range(args.pages)]
+
+    print(f"{len(pages)} pages, {os.cpu_count()} CPU(s)")
+    for workers in [0] + sorted(set(args.workers)):
+        rate, stall = measure(workers, pages)
+        label = "inline" if workers == 0 else f"{workers} worker(s)"
+        print(f"{label:12s} {rate:10.1f} pages/s   max event-loop stall {stall * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
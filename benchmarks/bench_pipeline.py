@@ -0,0 +1,304 @@
+"""Offline micro-benchmarks for each stage of the tracking pipeline.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--iterations N] [--output results.json] [--compare old.json]
+
+Runs without network access or credentials: product pages come from
+benchmarks/corpus, the database is a temporary SQLite file, images are
+generated in memory and Telegram is replaced by a stub bot. Each stage is
+timed separately and the results are written as JSON (by default to
+benchmarks/results/<commit>.json) so runs on different commits can be
+compared with --compare.
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import gzip
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Point every stateful module at throwaway locations before importing it
+_tmp_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+atexit.register(shutil.rmtree, _tmp_dir, ignore_errors=True)
+os.environ["DATABASE_PATH"] = os.path.join(_tmp_dir, "bench.db")
+os.environ["IMAGE_CACHE_DIR"] = os.path.join(_tmp_dir, "image_cache")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+os.environ.setdefault("TELEGRAM_CHANNEL_ID", "-1001234567890")
+
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+import httpx
+import numpy as np
+from PIL import Image
+import amazon
+import change_detection
+import database
+import image_cache
+import notifications
+from gamestop import parse_gamestop_product_html
+import money
+from rules import get_rules
+from bench_amazon_extract import load_corpus
+from bench_rules import make_links
+
+GAMESTOP_CORPUS_DIR = os.path.join(BENCH_DIR, "corpus", "gamestop")
+PRICES = ["59,99 €", "1.299,00 €", "€ 24,90", "Prezzo non disponibile", 19.99, "7,5", "129,00"]
+
+def _load_gamestop_pages():
+    pages = []
+    for filename in sorted(os.listdir(GAMESTOP_CORPUS_DIR)):
+        if filename.endswith(".html.gz"):
+            with gzip.open(os.path.join(GAMESTOP_CORPUS_DIR, filename), "rt", encoding="utf-8") as f:
+                pages.append(f.read())
+    return pages
+
+def _fixture_image(width=800, height=600):
+    """A deterministic non-square PNG, like a typical product photo."""
+    image = Image.new("RGB", (width, height))
+    image.putdata([((x * 7) % 256, (y * 5) % 256, (x + y) % 256) for y in range(height) for x in range(width)])
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+class StubBot:
+    """Telegram Bot stand-in: records sends and answers like the Bot API would."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def _message(self, photo):
+        self.sent += 1
+        sizes = [types.SimpleNamespace(file_id=f"bench-file-{self.sent}")] if photo else []
+        return types.SimpleNamespace(message_id=self.sent, photo=sizes)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        if hasattr(photo, "read"):
+            photo.read()
+        return self._message(photo=True)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return self._message(photo=False)
+
+def _summary(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "ops": len(samples),
+        "total_s": round(total, 6),
+        "mean_us": round(total / len(samples) * 1e6, 2),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p95_us": round(samples[math.ceil(0.95 * len(samples)) - 1] * 1e6, 2),  # Nearest rank
+        "stdev_us": round(statistics.pstdev(samples) * 1e6, 2),
+        "ops_per_s": round(len(samples) / total, 1) if total else None,
+    }
+
+def time_calls(func, inputs, iterations):
+    """Time func(item) for every item, iterations times over; returns the summary."""
+    samples = []
+    for _ in range(iterations):
+        for item in inputs:
+            start = time.perf_counter()
+            func(item)
+            samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def time_async_calls(coro_func, inputs, iterations):
+    async def run():
+        samples = []
+        for _ in range(iterations):
+            for item in inputs:
+                start = time.perf_counter()
+                await coro_func(item)
+                samples.append(time.perf_counter() - start)
+        return samples
+    return _summary(asyncio.run(run()))
+
+def bench_amazon_parse(iterations):
+    pages = list(load_corpus().values())
+    response_for_url = {
+        f"https://www.amazon.it/dp/B0BENCH{index:04d}": httpx.Response(
+            200, content=html.encode("utf-8"), headers={"Content-Type": "text/html; charset=utf-8"})
+        for index, html in enumerate(pages)
+    }
+
+    async def fake_fetch_response(url, retries=5):
+        return response_for_url[url]
+
+    # No network and no anti-bot delay; everything after the fetch runs as in production
+    amazon.fetch_response = fake_fetch_response
+    amazon.random = types.SimpleNamespace(uniform=lambda a, b: 0, choice=random.choice)
+    return time_async_calls(amazon.get_amazon_product_details, list(response_for_url), iterations)
+
+def bench_gamestop_parse(iterations):
+    return time_calls(parse_gamestop_product_html, _load_gamestop_pages(), iterations)
+
+def bench_parse_price(iterations):
+    money._parse_text.cache_clear()
+    listing = [PRICES[index % len(PRICES)] for index in range(2000)]
+    return {
+        "single": time_calls(money._parse_text.__wrapped__, [price for price in PRICES if isinstance(price, str)],
+                             iterations * 200),
+        "batch_2k": time_calls(money.parse_prices, [listing], iterations),
+    }
+
+def bench_keyword_filter(iterations):
+    rules = get_rules("amazon")
+    links = make_links(2000, rules)
+    pages = [links[i:i + 200] for i in range(0, len(links), 200)]  # One call per category page
+    return time_calls(rules.filter, pages, iterations)
+
+def _products(count):
+    return [(f"https://www.amazon.it/dp/B0DB{index:06d}", f"Prodotto {index}", (10 + index % 90) * 100 + 99,
+             True, f"https://m.media-amazon.com/images/I/{index}.jpg") for index in range(count)]
+
+def bench_save_product_details(iterations):
+    database.initialize_database()
+    products = _products(200)
+    result = {"insert": time_calls(lambda row: database.save_product_details(*row), products, 1)}
+    changed = [(url, title, (index % 50) * 100 + 49, availability, image)
+               for index, (url, title, _, availability, image) in enumerate(products)]
+    result["update"] = time_calls(lambda row: database.save_product_details(*row), changed, max(1, iterations // 5))
+    return result
+
+def bench_fetch_previous_details(iterations):
+    urls = [row[0] for row in _products(200)]
+    return time_calls(database.fetch_previous_details, urls, iterations)
+
+def _observations(count):
+    """A batch mixing new products, price drops, new lows, restocks and unchanged products."""
+    observations = []
+    for index in range(count):
+        details = {"title": f"Prodotto {index}", "price": money.parse_price(PRICES[index % len(PRICES)]),
+                   "availability": index % 7 != 0, "image_url": None}
+        previous = None if index % 50 == 0 else change_detection.PreviousState(
+            5999 + (index % 11) * 100, index % 5 != 0, 2999 + (index % 13) * 500)
+        observations.append((f"https://www.amazon.it/dp/B0CD{index:06d}", details, previous))
+    return observations
+
+def bench_change_detection(iterations):
+    detector = change_detection.ChangeDetector(rules=change_detection.RULES)
+    observations = _observations(20000)
+    columns = [np.full(20000, value) for value in (5999, True, 6999, False, 5000, True)]  # Already columnar
+    return {
+        "detect_20k": time_calls(detector.detect, [observations], iterations),
+        "evaluate_20k": time_calls(lambda arrays: detector.evaluate(*arrays), [columns], iterations),
+    }
+
+def bench_process_image(iterations):
+    image_bytes = _fixture_image()
+    notifications.requests = types.SimpleNamespace(
+        get=lambda url, timeout=None: types.SimpleNamespace(content=image_bytes, raise_for_status=lambda: None))
+    return time_calls(notifications.process_image, ["https://bench.invalid/image.png"], iterations)
+
+def bench_deliver_to_telegram(iterations):
+    image_bytes = _fixture_image()
+
+    async def fake_get(url, headers=None, timeout=None):
+        return httpx.Response(200, content=image_bytes, request=httpx.Request("GET", url))
+
+    image_cache.http_client = types.SimpleNamespace(get=fake_get)
+    database.initialize_database()
+    bot = StubBot()
+
+    # The first send uploads the image; later ones reuse the cache and the Telegram file_id
+    async def send(index):
+        await notifications.deliver_to_telegram(bot, f"Prodotto {index}", "https://bench.invalid/image.png",
+                                                5999, "https://www.amazon.it/dp/B0BENCH0001", "Amazon")
+    return time_async_calls(send, range(10), iterations)
+
+STAGES = {
+    "amazon_parse": bench_amazon_parse,
+    "gamestop_parse": bench_gamestop_parse,
+    "parse_price": bench_parse_price,
+    "keyword_filter": bench_keyword_filter,
+    "save_product_details": bench_save_product_details,
+    "fetch_previous_details": bench_fetch_previous_details,
+    "change_detection": bench_change_detection,
+    "process_image": bench_process_image,
+    "deliver_to_telegram": bench_deliver_to_telegram,
+}
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _flatten(stages):
+    """{"stage" or "stage.sub": summary} for comparisons."""
+    flat = {}
+    for name, result in stages.items():
+        if "ops" in result:
+            flat[name] = result
+        else:
+            flat.update({f"{name}.{sub}": summary for sub, summary in result.items()})
+    return flat
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = _flatten(json.load(f)["stages"])
+    print(f"\nCompared with {baseline_path}:")
+    for name, summary in _flatten(results["stages"]).items():
+        if name in baseline:
+            change = summary["mean_us"] / baseline[name]["mean_us"] - 1 if baseline[name]["mean_us"] else 0.0
+            print(f"  {name:32s} {baseline[name]['mean_us']:12.1f} -> {summary['mean_us']:12.1f} us  ({change:+.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGES), help="run only these stages")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="print the change against an earlier results file")
+    args = parser.parse_args()
+
+    stages = {}
+    logging.disable(logging.CRITICAL)
+    for name in args.stages or STAGES:
+        # The pipeline prints heavily; keep it out of the report (formatting cost is still measured)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            stages[name] = STAGES[name](args.iterations)
+    logging.disable(logging.NOTSET)
+
+    commit = _git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "stages": stages,
+    }
+
+    for name, summary in _flatten(stages).items():
+        print(f"{name:34s} {summary['ops']:7d} ops  mean {summary['mean_us']:12.1f} us  "
+              f"p95 {summary['p95_us']:12.1f} us  {summary['ops_per_s'] or 0:12.1f} ops/s")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
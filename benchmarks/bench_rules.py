@@ -0,0 +1,76 @@
+"""Benchmark the compiled rules engine against the nested any(... in url.lower()) loops.
+
+Usage:
+    python benchmarks/bench_rules.py [--links N] [--iterations N] [--rules rules.json]
+
+Synthetic category-page links (product slugs mixing included, excluded and
+unrelated words) are filtered by both implementations; the script fails if
+they accept different links.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from rules import load_rules
+
+WORDS = ["Carte", "Collezionabili", "Box", "Mazzo", "Lotte", "Lego", "Puzzle", "Figure",
+         "Scatola", "Bustine", "Edizione", "Italiano", "Giocattolo", "Peluche", "Zaino"]
+
+def make_links(count, rules, seed=42):
+    """Amazon-style /<slug>/dp/<ASIN> links; about a third mention an include keyword."""
+    rng = random.Random(seed)
+    include = rules.include or ["pokemon"]
+    exclude = rules.exclude or ["random"]
+    links = []
+    for index in range(count):
+        words = rng.sample(WORDS, 4)
+        roll = rng.random()
+        if roll < 0.35:
+            words.insert(rng.randrange(5), rng.choice(include).replace(" ", "-"))
+        if roll < 0.08:
+            words.insert(rng.randrange(5), rng.choice(exclude).replace(" ", "-"))
+        links.append(f"https://www.amazon.it/{'-'.join(words)}/dp/B0{index:08d}")
+    return links
+
+def legacy_filter(urls, rules):
+    """The per-keyword loops previously used in AM.update_urls."""
+    return [
+        url for url in urls
+        if any(keyword.lower() in url.lower() for keyword in rules.include)
+        and not any(excluded_keyword.lower() in url.lower() for excluded_keyword in rules.exclude)
+        and url not in rules.blocklist
+    ]
+
+def links_per_second(filter_func, urls, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        filter_func(urls)
+    return iterations * len(urls) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=5000, help="links per simulated category page")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--rules", default=None, help="rules file (default: RULES_FILE / built-in defaults)")
+    args = parser.parse_args()
+
+    rules = (load_rules(args.rules) if args.rules else load_rules())["amazon"]
+    urls = make_links(args.links, rules)
+
+    expected = legacy_filter(urls, rules)
+    if rules.filter(urls) != expected:
+        sys.exit("[ERROR] Rules engine and legacy loops accept different links")
+
+    baseline = links_per_second(lambda batch: legacy_filter(batch, rules), urls, args.iterations)
+    compiled = links_per_second(rules.filter, urls, args.iterations)
+
+    print(f"Links: {len(urls)} per page, {len(expected)} accepted, "
+          f"{len(rules.include)} include / {len(rules.exclude)} exclude keywords")
+    print(f"Nested any() loops: {baseline:12.0f} links/s")
+    print(f"Compiled rules:     {compiled:12.0f} links/s  ({compiled / baseline:.1f}x)")
+
+if __name__ == "__main__":
+    main()
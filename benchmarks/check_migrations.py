@@ -0,0 +1,101 @@
+"""Check that initialize_database() upgrades older databases in place.
+
+Usage:
+    python benchmarks/check_migrations.py
+
+Builds a database with the original products table (REAL prices, no product_key,
+no price_history), including two spellings of one ASIN, runs the migrations twice
+and checks the result: one row per product at its canonical URL, prices in cents,
+every current table present and a starting price history row for every product
+(dated at its last update). A second pass starts from the same schema plus a
+price_history table, to check that the duplicate's history moves onto the kept row.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp(prefix="check-migrations-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp_dir, "products.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+
+# Schema of the first release
+BASELINE_SCHEMA = """
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT UNIQUE,
+    title TEXT,
+    price REAL,
+    availability BOOLEAN,
+    image_url TEXT,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+BASELINE_ROWS = [
+    ("https://www.amazon.it/dp/B0ABCDEFGH?tag=x", "Foo (old)", 24.9, 1, None, "2024-01-01 10:00:00"),
+    ("https://www.amazon.it/Foo/dp/B0ABCDEFGH", "Foo", 19.99, 1, None, "2024-02-01 10:00:00"),
+    ("https://www.gamestop.it/Games/product/123456", "Bar", 59.0, 0, None, "2024-02-01 10:00:00"),
+]
+
+EXPECTED_PRODUCTS = [
+    ("amazon:B0ABCDEFGH", "https://www.amazon.it/dp/B0ABCDEFGH", "Foo", 1999),
+    ("gamestop:123456", "https://www.gamestop.it/Games/product/123456", "Bar", 5900),
+]
+
+def build_baseline(with_history=False):
+    database.close_connection()
+    if os.path.exists(database.DB_PATH):
+        os.remove(database.DB_PATH)
+    connection = sqlite3.connect(database.DB_PATH)
+    connection.execute(BASELINE_SCHEMA)
+    connection.executemany("INSERT INTO products (url, title, price, availability, image_url, last_updated) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", BASELINE_ROWS)
+    if with_history:
+        connection.execute("CREATE TABLE price_history (product_id INTEGER NOT NULL, observed_at INTEGER NOT NULL, "
+                           "price_cents INTEGER, available INTEGER NOT NULL, PRIMARY KEY (product_id, observed_at)) "
+                           "WITHOUT ROWID")
+        connection.executemany("INSERT INTO price_history VALUES (?, ?, ?, 1)",
+                               [(1, 1704103200, 2490), (2, 1706781600, 1999)])
+    connection.commit()
+    connection.close()
+
+def check(with_history):
+    build_baseline(with_history)
+    database.initialize_database()
+    database.initialize_database()  # Migrations must be idempotent
+
+    connection = database.get_connection()
+    products = connection.execute("SELECT product_key, url, title, price_cents FROM products "
+                                  "ORDER BY product_key").fetchall()
+    assert products == EXPECTED_PRODUCTS, products
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    missing = {"price_history", "image_blobs", "image_sources", "tracked_urls", "crawl_seen", "crawl_cursors",
+               "work_leases", "archive_blobs", "archive_pages"} - tables
+    assert not missing, missing
+    seeded = connection.execute("SELECT h.observed_at, h.price_cents, h.available FROM products p "
+                                "JOIN price_history h ON h.product_id = p.id WHERE p.product_key = ?",
+                                ("gamestop:123456",)).fetchall()
+    assert seeded == [(1706781600, 5900, 0)], seeded
+    summary = database.fetch_price_summary("https://www.gamestop.it/Games/product/123456")
+    assert summary is not None and summary["all_time_low_cents"] == 5900, summary
+    if with_history:
+        history = connection.execute("SELECT h.observed_at, h.price_cents FROM price_history h "
+                                     "JOIN products p ON p.id = h.product_id WHERE p.product_key = ? "
+                                     "ORDER BY h.observed_at", ("amazon:B0ABCDEFGH",)).fetchall()
+        assert history == [(1704103200, 2490), (1706781600, 1999)], history
+    print(f"baseline{' + price_history' if with_history else ''}: ok")
+
+def main():
+    try:
+        check(with_history=False)
+        check(with_history=True)
+    finally:
+        database.close_connection()
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+from contextlib import contextmanager, asynccontextmanager
+import psutil
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from dotenv import load_dotenv
+from utils import USER_AGENTS
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 2))  # Max Chrome instances alive at once
+MAX_PAGES_PER_DRIVER = int(os.getenv("BROWSER_MAX_PAGES", 50))  # Recycle a driver after this many pages
+MAX_DRIVER_MEMORY_MB = int(os.getenv("BROWSER_MAX_MEMORY_MB", 800))  # Recycle a driver above this RSS
+ACQUIRE_TIMEOUT = 300  # Seconds to wait for a free driver
+
+BROWSER_PROCESS_NAMES = {"chromedriver", "chrome", "google-chrome", "chromium", "chromium-browser", "chrome-headless-shell"}
+
+def start_selenium():
+    """Initialize and return a headless Selenium WebDriver."""
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--log-level=3")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--enable-unsafe-swiftshader")
+    options.add_argument(f"user-agent={random.choice(USER_AGENTS)}")
+
+    driver = webdriver.Chrome(service=Service(), options=options)
+    return driver
+
+def _driver_process(driver):
+    """Return the psutil handle of the driver's chromedriver process, if still running."""
+    try:
+        return psutil.Process(driver.service.process.pid)
+    except (AttributeError, psutil.Error):
+        return None
+
+def _process_tree_memory_mb(process):
+    """Resident memory of a process and all its children, in MB."""
+    total = 0
+    for proc in [process] + process.children(recursive=True):
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+def _kill_process_tree(process):
+    """Kill a process and all its descendants, ignoring ones that already exited."""
+    try:
+        procs = process.children(recursive=True) + [process]
+    except psutil.Error:
+        return
+    for proc in procs:
+        try:
+            proc.kill()
+        except psutil.Error:
+            pass
+    psutil.wait_procs(procs, timeout=5)
+
+def reap_orphaned_browsers():
+    """Kill chromedriver/headless Chrome processes left behind by crashed or leaked drivers."""
+    username = psutil.Process().username()
+    reaped = 0
+
+    for proc in psutil.process_iter(["pid", "ppid", "name", "username", "cmdline"]):
+        info = proc.info
+        if info["username"] != username or (info["name"] or "").lower() not in BROWSER_PROCESS_NAMES:
+            continue
+
+        # Orphans are re-parented to init; only touch headless browsers and chromedriver itself
+        cmdline = " ".join(info["cmdline"] or [])
+        if info["ppid"] == 1 and ("chromedriver" in info["name"].lower() or "--headless" in cmdline):
+            _kill_process_tree(proc)
+            reaped += 1
+
+    if reaped:
+        logger.info("Reaped %d orphaned browser process(es)", reaped)
+    return reaped
+
+class WebDriverPool:
+    """Bounded pool of warm headless Chrome drivers.
+
+    Drivers are checked out for a single page, health-checked before reuse and
+    recycled after MAX_PAGES_PER_DRIVER pages or once their process tree grows
+    beyond MAX_DRIVER_MEMORY_MB. Thread-safe; use checkout() from sync code and
+    checkout_async() from coroutines.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_pages=MAX_PAGES_PER_DRIVER, max_memory_mb=MAX_DRIVER_MEMORY_MB):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self._idle = queue.LifoQueue()  # Most recently used first, keeps caches warm
+        self._slots = threading.BoundedSemaphore(size)
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _launch(self):
+        with metrics.timer("browser_launch"):
+            driver = start_selenium()
+        metrics.increment("browser_launches")
+        with self._lock:
+            self._pages[driver] = 0
+        return driver
+
+    def _dispose(self, driver):
+        with self._lock:
+            self._pages.pop(driver, None)
+        process = _driver_process(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning("driver.quit() failed, killing browser processes: %s", e)
+        if process is not None and process.is_running():
+            _kill_process_tree(process)
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _should_recycle(self, driver):
+        if self._closed or self._pages.get(driver, 0) >= self.max_pages:
+            return True
+        process = _driver_process(driver)
+        if process is None:
+            return True
+        return _process_tree_memory_mb(process) > self.max_memory_mb
+
+    def warm_up(self, count=None):
+        """Pre-launch drivers so the first pages don't pay the Chrome start-up cost."""
+        reap_orphaned_browsers()
+        for _ in range(min(count or self.size, self.size) - self._idle.qsize()):
+            self._idle.put(self._launch())
+
+    def _take_driver(self):
+        """Return a healthy idle driver or launch a new one. Caller must hold a slot."""
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._launch()
+                if self._is_healthy(driver):
+                    return driver
+                logger.warning("Discarding unhealthy WebDriver")
+                self._dispose(driver)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """Check out a healthy driver, launching one if none is idle."""
+        if self._closed:
+            raise RuntimeError("WebDriverPool is closed")
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Timed out waiting for a free WebDriver")
+        return self._take_driver()
+
+    async def acquire_async(self, timeout=ACQUIRE_TIMEOUT):
+        """Async acquire; waits for a slot on the event loop so no worker thread is parked."""
+        if self._closed:
+            raise RuntimeError("WebDriverPool is closed")
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not self._slots.acquire(blocking=False):
+            if asyncio.get_running_loop().time() >= deadline:
+                raise TimeoutError("Timed out waiting for a free WebDriver")
+            await asyncio.sleep(0.05)
+        return await asyncio.to_thread(self._take_driver)
+
+    def release(self, driver):
+        """Return a driver to the pool, recycling it if it is worn out."""
+        try:
+            with self._lock:
+                self._pages[driver] = self._pages.get(driver, 0) + 1
+            if self._should_recycle(driver):
+                self._dispose(driver)
+            else:
+                self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def checkout(self):
+        """Context manager yielding a driver for one page; always returned to the pool."""
+        with metrics.timer("browser_wait"):
+            driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    @asynccontextmanager
+    async def checkout_async(self):
+        """Async variant of checkout(); blocking pool work runs in a worker thread."""
+        with metrics.timer("browser_wait"):
+            driver = await self.acquire_async()
+        try:
+            yield driver
+        finally:
+            await asyncio.to_thread(self.release, driver)
+
+    def close(self):
+        """Quit every idle driver and reap anything left behind."""
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._dispose(driver)
+        reap_orphaned_browsers()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide WebDriver pool shared by tracking and discovery."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WebDriverPool()
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,122 @@
+import os
+from collections import namedtuple
+import numpy as np
+from dotenv import load_dotenv
+from money import parse_prices
+from utils import availability_flag
+
+load_dotenv()
+
+# Event kinds, in the priority used when a product triggers several rules at once
+NEW_PRODUCT = "new_product"
+ALL_TIME_LOW = "all_time_low"
+PRICE_DROP = "price_drop"
+BACK_IN_STOCK = "back_in_stock"
+OUT_OF_STOCK = "out_of_stock"
+RULES = (NEW_PRODUCT, ALL_TIME_LOW, PRICE_DROP, BACK_IN_STOCK, OUT_OF_STOCK)
+
+# Comma-separated subset of RULES to evaluate
+ENABLED_RULES = tuple(rule.strip() for rule in os.getenv("CHANGE_RULES", ",".join(RULES)).split(",") if rule.strip())
+PRICE_DROP_THRESHOLD = float(os.getenv("PRICE_DROP_THRESHOLD", 0.05))  # Fraction of the previous price
+
+NO_PRICE = -1  # Cents value for "no price shown" in the input arrays
+
+# One product that matched one rule; prices are integer cents (None when not shown)
+ChangeEvent = namedtuple("ChangeEvent", ["kind", "url", "details", "price_cents", "previous_cents", "lowest_cents"])
+
+# Stored state a check is compared with: (price_cents, available, lowest_cents), None for a new product
+PreviousState = namedtuple("PreviousState", ["price_cents", "available", "lowest_cents"])
+
+class ChangeDetector:
+    """Evaluates the change rules for a whole batch of observations at once.
+
+    Prices are compared as integer cents and every rule is a boolean mask over
+    the batch, so the cost per product is a few array operations rather than a
+    Python branch per rule. Price rules only fire for products that can be bought
+    now, and the all-time low is the lowest price in the product's history.
+    """
+
+    def __init__(self, rules=ENABLED_RULES, drop_threshold=PRICE_DROP_THRESHOLD):
+        unknown = set(rules) - set(RULES)
+        if unknown:
+            raise ValueError(f"Unknown change rule(s) {', '.join(sorted(unknown))} (available: {', '.join(RULES)})")
+        self.rules = tuple(rule for rule in RULES if rule in rules)
+        self.drop_threshold = drop_threshold
+
+    def evaluate(self, price, available, previous_price, previous_available, lowest, known):
+        """Return {rule: boolean mask} for equally long arrays.
+
+        Prices are int64 cents with NO_PRICE for missing values; availability is 0/1;
+        known is False for products seen for the first time (their previous values are ignored).
+        """
+        price, previous_price, lowest = (np.asarray(a, dtype=np.int64) for a in (price, previous_price, lowest))
+        available, previous_available, known = (np.asarray(a, dtype=bool) for a in (available, previous_available, known))
+        buyable_price = known & available & (price != NO_PRICE)
+
+        masks = {}
+        if NEW_PRODUCT in self.rules:
+            masks[NEW_PRODUCT] = ~known
+        if ALL_TIME_LOW in self.rules:
+            masks[ALL_TIME_LOW] = buyable_price & (lowest != NO_PRICE) & (price < lowest)
+        if PRICE_DROP in self.rules:
+            masks[PRICE_DROP] = (buyable_price & (previous_price != NO_PRICE) & (price < previous_price)
+                                 & (previous_price - price >= previous_price * self.drop_threshold))
+        if BACK_IN_STOCK in self.rules:
+            masks[BACK_IN_STOCK] = known & available & ~previous_available
+        if OUT_OF_STOCK in self.rules:
+            masks[OUT_OF_STOCK] = known & ~available & previous_available
+        return masks
+
+    def detect(self, observations):
+        """Return the ChangeEvents for (url, details, previous) observations, in batch order.
+
+        details is the scraped dict (price in cents, availability as bool or text);
+        previous is a PreviousState, or None if the product wasn't stored yet.
+        """
+        if not observations:
+            return []
+        count = len(observations)
+        cents = parse_prices(details["price"] for _, details, _ in observations)
+        price = np.fromiter((_cents(value) for value in cents), dtype=np.int64, count=count)
+        available = np.fromiter((availability_flag(details["availability"]) for _, details, _ in observations),
+                                dtype=bool, count=count)
+        known = np.fromiter((previous is not None for _, _, previous in observations), dtype=bool, count=count)
+        stored = [previous or PreviousState(None, 0, None) for _, _, previous in observations]
+        previous_price = np.fromiter((_cents(state.price_cents) for state in stored), dtype=np.int64, count=count)
+        previous_available = np.fromiter((state.available for state in stored), dtype=bool, count=count)
+        lowest = np.fromiter((_cents(state.lowest_cents) for state in stored), dtype=np.int64, count=count)
+
+        masks = self.evaluate(price, available, previous_price, previous_available, lowest, known)
+        hits = [(row, priority) for priority, rule in enumerate(self.rules) for row in np.flatnonzero(masks[rule])]
+        events = []
+        for row, priority in sorted(hits):
+            url, details, _ = observations[row]
+            state = stored[row]
+            events.append(ChangeEvent(self.rules[priority], url, details, _or_none(price[row]),
+                                      state.price_cents, state.lowest_cents))
+        return events
+
+def _cents(value):
+    return NO_PRICE if value is None else value
+
+def _or_none(value):
+    return None if value == NO_PRICE else int(value)
+
+_detector = None
+
+def get_detector():
+    """Return the detector for the configured CHANGE_RULES and PRICE_DROP_THRESHOLD."""
+    global _detector
+    if _detector is None:
+        _detector = ChangeDetector()
+    return _detector
+
+def first_per_product(events):
+    """Keep the highest-priority event of each product (the one worth a notification)."""
+    seen = set()
+    first = []
+    for event in events:
+        if event.url not in seen:
+            seen.add(event.url)
+            first.append(event)
+    return first
@@ -1,165 +1,949 @@
+import ast
+import logging
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils import availability_flag, normalize_product_url
+from money import parse_price
+from scheduler import url_domain
+import metrics
+from change_detection import PreviousState
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DATABASE_PATH", "products.db")
+BUSY_TIMEOUT = 5.0  # Seconds to wait for a competing writer before raising "database is locked"
+CACHE_SIZE_KB = 20000  # Page cache per connection (negative PRAGMA value = KiB)
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+
+_local = threading.local()
+
+def get_connection():
+    """Return this thread's long-lived connection, opening and tuning it on first use."""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        # Autocommit mode: reads never hold a transaction open, writes use transaction()
+        connection = sqlite3.connect(
+            DB_PATH,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer and vice versa
+        connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, fsync only at checkpoints
+        connection.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        _local.connection = connection
+    return connection
+
+@contextmanager
+def transaction():
+    """Run the enclosed statements in a single write transaction and yield a cursor."""
+    connection = get_connection()
+    if connection.in_transaction:
+        # Already inside an outer transaction; let it commit
+        yield connection.cursor()
+        return
+
+    connection.execute("BEGIN IMMEDIATE")  # Take the write lock up front to avoid upgrade deadlocks
+    try:
+        yield connection.cursor()
+    except BaseException:
+        connection.rollback()
+        raise
+    else:
+        connection.commit()
+
+def close_connection():
+    """Close this thread's connection (call on shutdown)."""
+    connection = getattr(_local, "connection", None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
 
 # Initialize database if it does not exist, and add missing columns
 def initialize_database():
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
-    
+    with transaction() as cursor:
+        _create_schema(cursor)
+
+def _create_schema(cursor):
+    """Create tables and apply lightweight column migrations."""
     # Create the table if it doesn't exist
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         url TEXT UNIQUE,
         title TEXT,
-        price REAL,  -- Ensure price is stored as a REAL number
+        price_cents INTEGER,  -- NULL when no price is shown (see money.py)
         availability BOOLEAN,
         image_url TEXT,
         last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
 
+    # Append-only price history: one compact row per price/availability change.
+    # The (product_id, observed_at) primary key is the clustered index of a WITHOUT ROWID table,
+    # so per-product range queries read only that product's rows.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS price_history (
+        product_id INTEGER NOT NULL,
+        observed_at INTEGER NOT NULL,  -- Unix seconds
+        price_cents INTEGER,  -- NULL when no price is shown
+        available INTEGER NOT NULL,
+        PRIMARY KEY (product_id, observed_at)
+    ) WITHOUT ROWID
+    """)
+
     # Check if 'is_invalid' column exists
     cursor.execute("PRAGMA table_info(products)")
     existing_columns = {row[1] for row in cursor.fetchall()}
     
     if "is_invalid" not in existing_columns:
-        print("[INFO] Adding missing 'is_invalid' column to the database.")
+        logger.info("Adding missing 'is_invalid' column to the database.")
         cursor.execute("ALTER TABLE products ADD COLUMN is_invalid BOOLEAN DEFAULT 0")
-        connection.commit()
 
-    connection.close()
+    # Canonical product identity ("amazon:<ASIN>", "gamestop:<id>"), one row per product
+    if "product_key" not in existing_columns:
+        logger.info("Adding 'product_key' column and merging duplicate products.")
+        cursor.execute("ALTER TABLE products ADD COLUMN product_key TEXT")
+        _merge_duplicate_products(cursor)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_key ON products (product_key)")
 
-def save_product_details(url, title, price, availability, image_url):
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    # Prices used to be stored as scraped text or REAL in "price"; that column is no longer written
+    if "price_cents" not in existing_columns:
+        logger.info("Converting stored prices to integer cents.")
+        cursor.execute("ALTER TABLE products ADD COLUMN price_cents INTEGER")
+        cursor.execute("SELECT id, price FROM products WHERE price IS NOT NULL")
+        cursor.executemany("UPDATE products SET price_cents = ?, price = NULL WHERE id = ?",
+                           [(parse_price(price), product_id) for product_id, price in cursor.fetchall()])
 
-    # Check if product already exists
-    cursor.execute("""SELECT title, price, availability FROM products WHERE url = ?""", (url,))
-    existing_data = cursor.fetchone()
+    # Hash of the raw page regions the stored values were parsed from (NULL: always re-parse)
+    if "fingerprint" not in existing_columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN fingerprint TEXT")
 
-    if existing_data:
-        existing_title, existing_price, existing_availability = existing_data
+    # Products stored before price_history existed start their history with their stored state
+    _seed_price_history(cursor)
 
-        # Skip update if nothing has changed
-        if (existing_title == title and existing_price == price and existing_availability == availability):
-            print(f"[DEBUG] No changes detected for {title}. Skipping update.")
-            connection.close()
-            return
+    # Processed notification images: blobs are addressed by the hash of the source bytes,
+    # sources map an image URL and its HTTP validators to a blob
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS image_blobs (
+        content_hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        telegram_file_id TEXT,
+        last_used INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_blobs_last_used ON image_blobs (last_used)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS image_sources (
+        source_url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT NOT NULL,
+        validated_at INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_sources_hash ON image_sources (content_hash)")
 
-        print(f"[INFO] 🔄 Updating product: {title}")
+    # Registry of URLs to track. version is bumped on every insert or change, so the tracker
+    # can poll for "changed since" with an index seek instead of reloading the whole table.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS tracked_urls (
+        url TEXT PRIMARY KEY,  -- Canonical URL (see utils.normalize_product_url)
+        source TEXT NOT NULL,  -- "amazon", "gamestop", ...
+        first_seen INTEGER NOT NULL,  -- Unix seconds
+        active INTEGER NOT NULL DEFAULT 1,
+        version INTEGER NOT NULL,
+        product_key TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tracked_urls_version ON tracked_urls (version)")
+    cursor.execute("PRAGMA table_info(tracked_urls)")
+    if "product_key" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE tracked_urls ADD COLUMN product_key TEXT")
+        _canonicalize_tracked_urls(cursor)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tracked_urls_key ON tracked_urls (product_key)")
 
-    else:
-        print(f"[INFO] 🆕 Adding new product: {title}")
+    # Category crawl state: every product key a category listing has shown (used for the
+    # early stop) and how far the deep walk through older pages has got
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS crawl_seen (
+        category_url TEXT NOT NULL,
+        product_key TEXT NOT NULL,
+        first_seen INTEGER NOT NULL,
+        PRIMARY KEY (category_url, product_key)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS crawl_cursors (
+        category_url TEXT PRIMARY KEY,
+        next_page INTEGER NOT NULL,  -- First page the deep walk hasn't reached yet
+        exhausted INTEGER NOT NULL DEFAULT 0,  -- 1 once the deep walk found the last page
+        crawled_at INTEGER NOT NULL,
+        rules_fingerprint TEXT  -- RuleSet.fingerprint the seen products were filtered with
+    )
+    """)
+    cursor.execute("PRAGMA table_info(crawl_cursors)")
+    if "rules_fingerprint" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE crawl_cursors ADD COLUMN rules_fingerprint TEXT")
+    # Shared work table for multi-node tracking (see work_queue.py); times are Unix seconds
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS work_leases (
+        url TEXT PRIMARY KEY,
+        next_due REAL NOT NULL,
+        lease_owner TEXT,  -- Node holding the URL, NULL when free
+        lease_expires REAL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_work_leases_due ON work_leases(next_due)")
 
-    # Insert or update product
+    # Raw page archive (see page_archive.py): compressed bodies are appended to chunk files and
+    # addressed by the hash of the raw bytes; archive_pages indexes every fetch by product and time
     cursor.execute("""
-    INSERT INTO products (url, title, price, availability, image_url, last_updated)
-    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    ON CONFLICT(url) DO UPDATE SET
-        title = excluded.title,
-        price = excluded.price,
-        availability = excluded.availability,
-        image_url = excluded.image_url,
-        last_updated = CURRENT_TIMESTAMP,
-        is_invalid = 0
-    """, (url, title, price, availability, image_url))
-
-    connection.commit()
-    connection.close()
-    print(f"[INFO] ✅ Saved product: {title} ({url})")
+    CREATE TABLE IF NOT EXISTS archive_blobs (
+        content_hash TEXT PRIMARY KEY,  -- sha256 of the raw body
+        chunk INTEGER NOT NULL,  -- Chunk file number
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,  -- Compressed bytes
+        size INTEGER NOT NULL  -- Raw bytes
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_archive_blobs_chunk ON archive_blobs (chunk)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS archive_pages (
+        url TEXT NOT NULL,  -- Canonical product URL
+        fetched_at INTEGER NOT NULL,  -- Unix seconds
+        content_hash TEXT NOT NULL,
+        encoding TEXT,
+        PRIMARY KEY (url, fetched_at)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_archive_pages_fetched ON archive_pages (fetched_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_archive_pages_hash ON archive_pages (content_hash)")
+
+def _merge_duplicate_products(cursor):
+    """Backfill product_key and keep one row per product: the most recently updated one,
+    with the history of its duplicates moved onto it and its URL made canonical."""
+    cursor.execute("SELECT id, url FROM products ORDER BY last_updated DESC, id DESC")
+    keepers = {}
+    for product_id, url in cursor.fetchall():
+        product_key, canonical_url = normalize_product_url(url)
+        if product_key is None:
+            continue
+        keeper = keepers.setdefault(product_key, (product_id, canonical_url))[0]
+        if keeper != product_id:
+            cursor.execute("UPDATE OR IGNORE price_history SET product_id = ? WHERE product_id = ?", (keeper, product_id))
+            cursor.execute("DELETE FROM price_history WHERE product_id = ?", (product_id,))
+            cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
+    cursor.executemany("UPDATE products SET url = ?, product_key = ? WHERE id = ?",
+                       [(canonical_url, product_key, product_id) for product_key, (product_id, canonical_url) in keepers.items()])
+
+def _seed_price_history(cursor):
+    """Give every product without history one row with its stored price and availability,
+    dated at last_updated, so summaries and the all-time low cover the existing catalog."""
+    cursor.execute("""
+    SELECT id, COALESCE(CAST(strftime('%s', last_updated) AS INTEGER), ?), price_cents, availability FROM products p
+    WHERE NOT EXISTS (SELECT 1 FROM price_history h WHERE h.product_id = p.id)
+    """, (int(time.time()),))
+    rows = [(product_id, observed_at, price, availability_flag(availability))
+            for product_id, observed_at, price, availability in cursor.fetchall()]
+    if rows:
+        logger.info("Starting price history for %d existing product(s).", len(rows))
+        cursor.executemany("INSERT OR IGNORE INTO price_history (product_id, observed_at, price_cents, available) "
+                           "VALUES (?, ?, ?, ?)", rows)
+
+def _canonicalize_tracked_urls(cursor):
+    """Rewrite registry rows to canonical URLs, keeping the earliest first_seen per product."""
+    cursor.execute("SELECT url, source, first_seen, active, version FROM tracked_urls ORDER BY first_seen")
+    rows = cursor.fetchall()
+    cursor.execute("DELETE FROM tracked_urls")
+    seen = set()
+    for url, source, first_seen, active, version in rows:
+        product_key, canonical_url = normalize_product_url(url)
+        if product_key is None or product_key in seen:
+            continue
+        seen.add(product_key)
+        cursor.execute("INSERT INTO tracked_urls (url, source, first_seen, active, version, product_key) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (canonical_url, source, first_seen, active, version, product_key))
+
+UPSERT_PRODUCT_SQL = """
+INSERT INTO products (url, title, price_cents, availability, image_url, product_key, fingerprint, last_updated)
+VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+ON CONFLICT(url) DO UPDATE SET
+    title = excluded.title,
+    price_cents = excluded.price_cents,
+    availability = excluded.availability,
+    image_url = excluded.image_url,
+    fingerprint = excluded.fingerprint,
+    last_updated = CURRENT_TIMESTAMP,
+    is_invalid = 0
+"""
+
+RECORD_HISTORY_SQL = """
+INSERT OR REPLACE INTO price_history (product_id, observed_at, price_cents, available)
+SELECT id, ?, ?, ? FROM products WHERE url = ?
+"""
+
+# Lowest recorded price per product URL; {where} may narrow it with "AND p.url IN (...)"
+LOWEST_PRICES_SQL = """
+SELECT p.url, MIN(h.price_cents) FROM price_history h JOIN products p ON p.id = h.product_id
+WHERE h.price_cents IS NOT NULL {where}
+GROUP BY h.product_id
+"""
+
+def canonical_product_url(url):
+    """The URL products are stored under: canonical for known shops, unchanged otherwise."""
+    return normalize_product_url(url)[1] or url
+
+def _product_row(url, title, price, availability, image_url, fingerprint=None):
+    """Build an UPSERT_PRODUCT_SQL parameter tuple (url must already be canonical, price in cents)."""
+    return (url, title, parse_price(price), availability, image_url, normalize_product_url(url)[0], fingerprint)
+
+def _history_row(url, price, availability, observed_at=None):
+    """Build a RECORD_HISTORY_SQL parameter tuple."""
+    return (int(observed_at or time.time()), price, availability_flag(availability), url)
+
+def _history_changed(existing_price, existing_availability, price, availability):
+    """True if the price in cents or the availability flag differ."""
+    return existing_price != price or availability_flag(existing_availability) != availability_flag(availability)
+
+def save_product_details(url, title, price, availability, image_url):
+    """Insert or update one product; price is in cents (text or euro floats are converted)."""
+    url = canonical_product_url(url)
+    price = parse_price(price)
+    with transaction() as cursor:
+        # Check if product already exists
+        cursor.execute("""SELECT title, price_cents, availability FROM products WHERE url = ?""", (url,))
+        existing_data = cursor.fetchone()
+
+        if existing_data:
+            existing_title, existing_price, existing_availability = existing_data
+
+            # Skip update if nothing has changed
+            if (existing_title == title and existing_price == price and existing_availability == availability):
+                logger.debug("No changes detected for %s. Skipping update.", title)
+                return
+
+            logger.debug("🔄 Updating product: %s", title)
+
+        else:
+            logger.debug("🆕 Adding new product: %s", title)
+
+        # Insert or update product
+        cursor.execute(UPSERT_PRODUCT_SQL, _product_row(url, title, price, availability, image_url))
+
+        if not existing_data or _history_changed(existing_price, existing_availability, price, availability):
+            cursor.execute(RECORD_HISTORY_SQL, _history_row(url, price, availability))
+
+    logger.debug("✅ Saved product: %s (%s)", title, url)
+
+def _row_to_details(row):
+    """Convert a (title, price_cents, availability, image_url, last_updated) row into a details dict."""
+    return {
+        "title": row[0],
+        "price": row[1],
+        "availability": row[2],
+        "image_url": row[3],
+        "last_updated": row[4]
+    }
 
 # Fetch previous product details from the database
 def fetch_previous_details(url):
     """Retrieve previous details of a product from the database."""
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
-    cursor.execute("SELECT title, price, availability, image_url, last_updated FROM products WHERE url = ?", (url,))
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT title, price_cents, availability, image_url, last_updated FROM products WHERE url = ?",
+                   (canonical_product_url(url),))
     row = cursor.fetchone()
-    connection.close()
 
-    print(f"[DEBUG] fetch_previous_details({url}) returned: {row}")  # ✅ Add Debugging
+    logger.debug("fetch_previous_details(%s) returned: %s", url, row)
 
     if row:
-        try:
-            price = float(row[1]) if row[1] is not None else 0.0
-        except ValueError:
-            price = 0.0
-
-        return {
-            "title": row[0],
-            "price": price,
-            "availability": row[2],
-            "image_url": row[3],
-            "last_updated": row[4]
-        }
+        return _row_to_details(row)
     return None  # ✅ Return `None` for new products
 
+def save_products_batch(rows, history_rows=(), fingerprint_rows=()):
+    """Upsert many (url, title, price_cents, availability, image_url[, fingerprint]) rows, append their
+    price history rows and apply (fingerprint, url) updates in one transaction."""
+    rows = [_product_row(*row) for row in rows]
+    fingerprint_rows = list(fingerprint_rows)
+    if not rows and not fingerprint_rows:
+        return 0
+    with transaction() as cursor:
+        cursor.executemany(UPSERT_PRODUCT_SQL, rows)
+        cursor.executemany(RECORD_HISTORY_SQL, history_rows)
+        cursor.executemany("UPDATE products SET fingerprint = ? WHERE url = ?", fingerprint_rows)
+    return len(rows)
+
+class ProductStateCache:
+    """Previous state of every stored product, loaded once per tracking cycle.
+
+    Lookups and change checks are served from memory; changed products are
+    staged and written back together by flush().
+    """
+
+    def __init__(self, rows, lowest=None):
+        # url -> (title, price_cents, availability, image_url, last_updated, fingerprint) as stored
+        self._rows = rows
+        self._lowest = lowest or {}  # url -> lowest price in the product's history, in cents
+        self._pending = {}
+        self._pending_history = {}
+        self._pending_fingerprints = {}
+
+    @classmethod
+    def load(cls):
+        """Load the stored state of all products with a single query."""
+        cursor = get_connection().cursor()
+        cursor.execute("SELECT url, title, price_cents, availability, image_url, last_updated, fingerprint FROM products")
+        rows = {row[0]: row[1:] for row in cursor.fetchall()}
+        cursor.execute(LOWEST_PRICES_SQL.format(where=""))
+        return cls(rows, dict(cursor.fetchall()))
+
+    def refresh(self, urls):
+        """Re-read the stored state of urls, e.g. after other tracker nodes may have updated them."""
+        urls = [canonical_product_url(url) for url in urls]
+        cursor = get_connection().cursor()
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            cursor.execute("SELECT url, title, price_cents, availability, image_url, last_updated, fingerprint FROM products "
+                           f"WHERE url IN ({','.join('?' * len(chunk))})", chunk)
+            self._rows.update((row[0], row[1:]) for row in cursor.fetchall())
+            cursor.execute(LOWEST_PRICES_SQL.format(where=f"AND p.url IN ({','.join('?' * len(chunk))})"), chunk)
+            self._lowest.update(cursor.fetchall())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def previous_details(self, url):
+        """Same result as fetch_previous_details(url), without touching the database."""
+        row = self._rows.get(canonical_product_url(url))
+        return _row_to_details(row) if row else None
+
+    def fingerprint(self, url):
+        """Page fingerprint the stored values were parsed from, or None."""
+        row = self._rows.get(canonical_product_url(url))
+        return row[5] if row else None
+
+    def previous_state(self, url):
+        """PreviousState (price in cents, availability flag, lowest price in cents) for change detection, or None."""
+        url = canonical_product_url(url)
+        row = self._rows.get(url)
+        if row is None:
+            return None
+        return PreviousState(row[1], availability_flag(row[2]), self._lowest.get(url))
+
+    def has_changed(self, url, title, price, availability):
+        """Return True if the product is new or its title, price (in cents) or availability differs."""
+        row = self._rows.get(canonical_product_url(url))
+        if row is None:
+            return True
+        existing_title, existing_price, existing_availability = row[0], row[1], row[2]
+        return not (existing_title == title and existing_price == price and existing_availability == availability)
+
+    def stage(self, url, title, price, availability, image_url, fingerprint=None, observed_at=None):
+        """Queue a product for the next flush if it changed. Returns True when staged.
+
+        A new page fingerprint is stored even when the values didn't change. observed_at
+        (Unix seconds, default now) dates the price history row.
+        """
+        url = canonical_product_url(url)
+        price = parse_price(price)
+        if not self.has_changed(url, title, price, availability):
+            logger.debug("No changes detected for %s. Skipping update.", title)
+            row = self._rows[url]
+            if row[5] != fingerprint:
+                self._pending_fingerprints[url] = (fingerprint, url)
+                self._rows[url] = row[:5] + (fingerprint,)
+            return False
+
+        if url in self._rows:
+            logger.debug("🔄 Updating product: %s", title)
+        else:
+            logger.debug("🆕 Adding new product: %s", title)
+
+        self._pending[url] = (url, title, price, availability, image_url, fingerprint)
+        self._pending_fingerprints.pop(url, None)
+        previous = self._rows.get(url)
+        if previous is None or _history_changed(previous[1], previous[2], price, availability):
+            self._pending_history[url] = _history_row(url, price, availability, observed_at)
+            if price is not None and (self._lowest.get(url) is None or price < self._lowest[url]):
+                self._lowest[url] = price
+
+        # Keep the in-memory view current; last_updated is refreshed on flush
+        self._rows[url] = (title, price, availability, image_url, previous[4] if previous else None, fingerprint)
+        return True
+
+    def flush(self):
+        """Write all staged products with one executemany upsert. Returns the number written."""
+        written = save_products_batch(self._pending.values(), self._pending_history.values(),
+                                      self._pending_fingerprints.values())
+        if written:
+            logger.info("✅ Saved %d changed product(s)", written, extra={"sample": "batch_saved"})
+        self._pending.clear()
+        self._pending_history.clear()
+        self._pending_fingerprints.clear()
+        return written
+
 # Check if a URL is already in the database
 def is_url_in_database(url):
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    url = canonical_product_url(url)
+    cursor = get_connection().cursor()
     cursor.execute("SELECT EXISTS(SELECT 1 FROM products WHERE url = ?)", (url,))
     exists = cursor.fetchone()[0]
-    connection.close()
     return bool(exists)
 
 # Mark a URL as invalid
 def mark_url_as_invalid(url):
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    url = canonical_product_url(url)
+    metrics.increment("invalid_urls", url_domain(url))
+    cursor = get_connection().cursor()
     cursor.execute("UPDATE products SET is_invalid = 1 WHERE url = ?", (url,))
-    connection.commit()
-    connection.close()
 
 # Fetch valid product URLs (excluding invalid ones)
 def fetch_valid_urls():
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    cursor = get_connection().cursor()
     cursor.execute("SELECT url FROM products WHERE is_invalid = 0")
     urls = [row[0] for row in cursor.fetchall()]
-    connection.close()
     return urls
 
 # Fetch invalid URLs that might need rechecking
 def fetch_invalid_urls():
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    cursor = get_connection().cursor()
     cursor.execute("SELECT url FROM products WHERE is_invalid = 1")
     urls = [row[0] for row in cursor.fetchall()]
-    connection.close()
     return urls
 
 # Restore a previously invalid URL if it is now valid again
 def restore_valid_url(url):
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    url = canonical_product_url(url)
+    cursor = get_connection().cursor()
     cursor.execute("UPDATE products SET is_invalid = 0 WHERE url = ?", (url,))
-    connection.commit()
-    connection.close()
 
 # 🔹 (NEW) Delete a product from the database
 def delete_product(url):
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
-    cursor.execute("DELETE FROM products WHERE url = ?", (url,))
-    connection.commit()
-    connection.close()
-    print(f"[INFO] Deleted product: {url}")
+    url = canonical_product_url(url)
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM price_history WHERE product_id = (SELECT id FROM products WHERE url = ?)", (url,))
+        cursor.execute("DELETE FROM products WHERE url = ?", (url,))
+    logger.info("Deleted product: %s", url)
 
 # 🔹 (NEW) Fetch all products (for debugging/exporting)
 def fetch_all_products():
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    cursor = get_connection().cursor()
     cursor.execute("SELECT * FROM products")
     products = cursor.fetchall()
-    connection.close()
     return products  # Returns a list of all rows
 
 # 🔹 (NEW) Update product availability
 def update_product_availability(url, availability):
-    connection = sqlite3.connect("products.db")
-    cursor = connection.cursor()
+    url = canonical_product_url(url)
+    cursor = get_connection().cursor()
     cursor.execute("UPDATE products SET availability = ?, last_updated = CURRENT_TIMESTAMP WHERE url = ?", (availability, url))
-    connection.commit()
-    connection.close()
-    print(f"[INFO] Updated availability for: {url}")
+    logger.info("Updated availability for: %s", url)
+
+def _product_id(cursor, url):
+    cursor.execute("SELECT id FROM products WHERE url = ?", (canonical_product_url(url),))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# Price history queries (all are range seeks on the (product_id, observed_at) key)
+def fetch_price_history(url, since=None):
+    """Return [(observed_at, price_cents, available), ...] for a product, oldest first."""
+    cursor = get_connection().cursor()
+    product_id = _product_id(cursor, url)
+    if product_id is None:
+        return []
+    cursor.execute(
+        "SELECT observed_at, price_cents, available FROM price_history "
+        "WHERE product_id = ? AND observed_at >= ? ORDER BY observed_at",
+        (product_id, int(since or 0)),
+    )
+    return cursor.fetchall()
+
+def fetch_price_summary(url, window_days=30, now=None):
+    """Current price, all-time low, min/max over the last window_days and last change for a product."""
+    cursor = get_connection().cursor()
+    product_id = _product_id(cursor, url)
+    if product_id is None:
+        return None
+
+    # The two most recent rows give the current state and the last change
+    cursor.execute(
+        "SELECT observed_at, price_cents, available FROM price_history "
+        "WHERE product_id = ? ORDER BY observed_at DESC LIMIT 2",
+        (product_id,),
+    )
+    latest = cursor.fetchall()
+    if not latest:
+        return None
+
+    cursor.execute("SELECT MIN(price_cents) FROM price_history WHERE product_id = ?", (product_id,))
+    all_time_low = cursor.fetchone()[0]
+
+    # Rows exist only at changes, so the price in effect at the window start counts too
+    window_start = int((now or time.time()) - window_days * 86400)
+    cursor.execute("""
+    SELECT MIN(price_cents), MAX(price_cents) FROM (
+        SELECT price_cents FROM price_history WHERE product_id = ? AND observed_at >= ?
+        UNION ALL
+        SELECT * FROM (
+            SELECT price_cents FROM price_history WHERE product_id = ? AND observed_at < ?
+            ORDER BY observed_at DESC LIMIT 1
+        )
+    )
+    """, (product_id, window_start, product_id, window_start))
+    window_min, window_max = cursor.fetchone()
+
+    observed_at, price_cents, available = latest[0]
+    return {
+        "current_cents": price_cents,
+        "available": bool(available),
+        "all_time_low_cents": all_time_low,
+        "window_days": window_days,
+        "window_min_cents": window_min,
+        "window_max_cents": window_max,
+        "last_change": {
+            "observed_at": observed_at,
+            "from_cents": latest[1][1] if len(latest) > 1 else None,
+            "to_cents": price_cents,
+            "from_available": bool(latest[1][2]) if len(latest) > 1 else None,
+            "to_available": bool(available),
+        },
+    }
+
+# Image cache index (files live in image_cache.CACHE_DIR)
+def fetch_image_source(source_url):
+    """Return (etag, last_modified, content_hash, validated_at, size, telegram_file_id) or None."""
+    cursor = get_connection().cursor()
+    cursor.execute("""
+    SELECT s.etag, s.last_modified, s.content_hash, s.validated_at, b.size, b.telegram_file_id
+    FROM image_sources s JOIN image_blobs b ON b.content_hash = s.content_hash
+    WHERE s.source_url = ?
+    """, (source_url,))
+    return cursor.fetchone()
+
+def save_image_source(source_url, etag, last_modified, content_hash, size):
+    """Point a source URL at a blob and mark both as just used."""
+    now = int(time.time())
+    with transaction() as cursor:
+        cursor.execute("""
+        INSERT INTO image_blobs (content_hash, size, last_used) VALUES (?, ?, ?)
+        ON CONFLICT(content_hash) DO UPDATE SET last_used = excluded.last_used
+        """, (content_hash, size, now))
+        cursor.execute("""
+        INSERT OR REPLACE INTO image_sources (source_url, etag, last_modified, content_hash, validated_at)
+        VALUES (?, ?, ?, ?, ?)
+        """, (source_url, etag, last_modified, content_hash, now))
+
+def touch_image_source(source_url, revalidated=False):
+    """Update the LRU timestamp of a source's blob (and its validation time if revalidated)."""
+    now = int(time.time())
+    with transaction() as cursor:
+        cursor.execute("UPDATE image_blobs SET last_used = ? WHERE content_hash = "
+                       "(SELECT content_hash FROM image_sources WHERE source_url = ?)", (now, source_url))
+        if revalidated:
+            cursor.execute("UPDATE image_sources SET validated_at = ? WHERE source_url = ?", (now, source_url))
+
+def set_image_file_id(content_hash, file_id):
+    """Remember (or clear, with None) the Telegram file_id for an uploaded image."""
+    cursor = get_connection().cursor()
+    cursor.execute("UPDATE image_blobs SET telegram_file_id = ? WHERE content_hash = ?", (file_id, content_hash))
+
+def evict_image_blobs(max_bytes):
+    """Drop least recently used blobs until the total size fits max_bytes. Returns evicted hashes."""
+    with transaction() as cursor:
+        cursor.execute("SELECT COALESCE(SUM(size), 0) FROM image_blobs")
+        total = cursor.fetchone()[0]
+        if total <= max_bytes:
+            return []
+
+        evicted = []
+        cursor.execute("SELECT content_hash, size FROM image_blobs ORDER BY last_used")
+        for content_hash, size in cursor.fetchall():
+            if total <= max_bytes:
+                break
+            evicted.append(content_hash)
+            total -= size
+
+        cursor.executemany("DELETE FROM image_sources WHERE content_hash = ?", [(h,) for h in evicted])
+        cursor.executemany("DELETE FROM image_blobs WHERE content_hash = ?", [(h,) for h in evicted])
+    return evicted
+
+# Raw page archive
+def fetch_archive_blob(content_hash):
+    """Return (chunk, offset, length) of an archived body, or None."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT chunk, offset, length FROM archive_blobs WHERE content_hash = ?", (content_hash,))
+    return cursor.fetchone()
+
+def save_archived_page(url, fetched_at, content_hash, encoding, blob=None):
+    """Index one fetch of url; blob is (chunk, offset, length, size) when the body was (re)written."""
+    with transaction() as cursor:
+        if blob is not None:
+            cursor.execute("INSERT OR REPLACE INTO archive_blobs (content_hash, chunk, offset, length, size) "
+                           "VALUES (?, ?, ?, ?, ?)", (content_hash, *blob))
+        cursor.execute("INSERT OR REPLACE INTO archive_pages (url, fetched_at, content_hash, encoding) "
+                       "VALUES (?, ?, ?, ?)", (canonical_product_url(url), int(fetched_at), content_hash, encoding))
+
+def last_archived_at(url):
+    """Unix time of the newest archived fetch of url, or None."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT MAX(fetched_at) FROM archive_pages WHERE url = ?", (canonical_product_url(url),))
+    return cursor.fetchone()[0]
+
+def drop_archive_chunk(chunk):
+    """Forget every body stored in a chunk file and the fetches that point at them. Returns pages dropped."""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM archive_pages WHERE content_hash IN "
+                       "(SELECT content_hash FROM archive_blobs WHERE chunk = ?)", (chunk,))
+        dropped = cursor.rowcount
+        cursor.execute("DELETE FROM archive_blobs WHERE chunk = ?", (chunk,))
+    return dropped
+
+def fetch_archived_pages(urls=None, since=None, latest_only=True):
+    """Return [(url, fetched_at, content_hash, encoding, chunk, offset, length, last_observed), ...]
+    ordered by url and time.
+
+    last_observed is the time of the product's newest price history row (None if it has none).
+    latest_only keeps the newest fetch of each product; since (Unix seconds) skips older fetches.
+    """
+    where, params = [], []
+    if urls:
+        urls = [canonical_product_url(url) for url in urls]
+        where.append(f"p.url IN ({','.join('?' * len(urls))})")
+        params.extend(urls)
+    if since is not None:
+        where.append("p.fetched_at >= ?")
+        params.append(int(since))
+    if latest_only:
+        where.append("p.fetched_at = (SELECT MAX(fetched_at) FROM archive_pages WHERE url = p.url)")
+    cursor = get_connection().cursor()
+    cursor.execute(f"""
+    SELECT p.url, p.fetched_at, p.content_hash, p.encoding, b.chunk, b.offset, b.length,
+           (SELECT MAX(h.observed_at) FROM products pr JOIN price_history h ON h.product_id = pr.id
+            WHERE pr.url = p.url)
+    FROM archive_pages p JOIN archive_blobs b ON b.content_hash = p.content_hash
+    {"WHERE " + " AND ".join(where) if where else ""}
+    ORDER BY p.url, p.fetched_at
+    """, params)
+    return cursor.fetchall()
+
+def archive_stats():
+    """Archived fetches, products, distinct bodies and their raw / compressed sizes."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT COUNT(*), COUNT(DISTINCT url) FROM archive_pages")
+    pages, products = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM archive_blobs")
+    blobs, raw_bytes, stored_bytes = cursor.fetchone()
+    return {"pages": pages, "products": products, "bodies": blobs, "raw_bytes": raw_bytes, "stored_bytes": stored_bytes}
+
+# URL registry
+LEGACY_URL_FILES = {"product_urls.py": "amazon", "gamestop_urls.py": "gamestop"}
+
+def _next_url_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM tracked_urls")
+    return cursor.fetchone()[0]
+
+def register_urls(urls, source, first_seen=None):
+    """Add product URLs to the registry under their canonical form, ignoring products already
+    known (and URLs that aren't product pages). Returns the canonical URLs that were new."""
+    first_seen = int(first_seen or time.time())
+    products = {}
+    for url in urls:
+        product_key, canonical_url = normalize_product_url(url)
+        if product_key is None:
+            logger.warning("Not a product page, not tracking: %s", url)
+            metrics.increment("invalid_urls", url_domain(url))
+            continue
+        products.setdefault(product_key, canonical_url)
+
+    added = []
+    with transaction() as cursor:
+        version = _next_url_version(cursor)
+        for product_key, canonical_url in products.items():
+            cursor.execute(
+                "INSERT INTO tracked_urls (url, source, first_seen, version, product_key) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT DO NOTHING",
+                (canonical_url, source, first_seen, version, product_key),
+            )
+            if cursor.rowcount:
+                added.append(canonical_url)
+    return added
+
+def set_url_active(url, active):
+    """Pause (False) or resume (True) tracking of a registered URL."""
+    url = canonical_product_url(url)
+    with transaction() as cursor:
+        cursor.execute("UPDATE tracked_urls SET active = ?, version = ? WHERE url = ? AND active != ?",
+                       (int(active), _next_url_version(cursor), url, int(active)))
+
+def fetch_tracked_urls(source=None):
+    """Return the active registered URLs (optionally for one source), oldest first."""
+    cursor = get_connection().cursor()
+    if source is None:
+        cursor.execute("SELECT url FROM tracked_urls WHERE active = 1 ORDER BY first_seen")
+    else:
+        cursor.execute("SELECT url FROM tracked_urls WHERE active = 1 AND source = ? ORDER BY first_seen", (source,))
+    return [row[0] for row in cursor.fetchall()]
+
+def fetch_url_changes(since_version=0):
+    """Return ([(url, source, first_seen, active), ...], latest_version) for rows changed after since_version."""
+    cursor = get_connection().cursor()
+    cursor.execute(
+        "SELECT url, source, first_seen, active, version FROM tracked_urls WHERE version > ? ORDER BY version",
+        (since_version,),
+    )
+    rows = cursor.fetchall()
+    latest = rows[-1][4] if rows else since_version
+    return [row[:4] for row in rows], latest
+
+# Category crawl cursors (see AM.crawl_category)
+def fetch_crawl_state(category_url, rules_fingerprint):
+    """Return (seen product keys, next_page, exhausted) for a category.
+
+    A new category, or one last crawled under different rules, starts again from page 1
+    with nothing seen, so products the old rules filtered out are offered again.
+    """
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT next_page, exhausted, rules_fingerprint FROM crawl_cursors WHERE category_url = ?",
+                   (category_url,))
+    row = cursor.fetchone()
+    if row is None or row[2] != rules_fingerprint:
+        return set(), 1, False
+    cursor.execute("SELECT product_key FROM crawl_seen WHERE category_url = ?", (category_url,))
+    return {row[0] for row in cursor.fetchall()}, row[0], bool(row[1])
+
+def save_crawl_state(category_url, new_keys, next_page, exhausted, rules_fingerprint):
+    """Record newly seen product keys and the deep-walk cursor of a category in one transaction.
+
+    Seen keys recorded under other rules are dropped first (fetch_crawl_state ignored them).
+    """
+    now = int(time.time())
+    with transaction() as cursor:
+        cursor.execute("""
+        DELETE FROM crawl_seen WHERE category_url = ? AND NOT EXISTS (
+            SELECT 1 FROM crawl_cursors WHERE category_url = ? AND rules_fingerprint IS ?)
+        """, (category_url, category_url, rules_fingerprint))
+        cursor.executemany("INSERT OR IGNORE INTO crawl_seen (category_url, product_key, first_seen) VALUES (?, ?, ?)",
+                           [(category_url, key, now) for key in new_keys])
+        cursor.execute("""
+        INSERT INTO crawl_cursors (category_url, next_page, exhausted, crawled_at, rules_fingerprint)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(category_url) DO UPDATE SET
+            next_page = excluded.next_page, exhausted = excluded.exhausted, crawled_at = excluded.crawled_at,
+            rules_fingerprint = excluded.rules_fingerprint
+        """, (category_url, next_page, int(exhausted), now, rules_fingerprint))
+
+def add_work_items(entries):
+    """Add (url, next_due) rows to the work table; URLs already there keep their schedule."""
+    with transaction() as cursor:
+        cursor.executemany("INSERT OR IGNORE INTO work_leases (url, next_due) VALUES (?, ?)", entries)
+
+def remove_work_items(urls):
+    with transaction() as cursor:
+        cursor.executemany("DELETE FROM work_leases WHERE url = ?", [(url,) for url in urls])
+
+def claim_work(node_id, limit, lease_seconds):
+    """Lease up to limit due URLs that are free (or whose lease expired) to node_id, most overdue first.
+
+    BEGIN IMMEDIATE serializes claims across processes, so a URL is never handed to two nodes.
+    """
+    now = time.time()
+    with transaction() as cursor:
+        cursor.execute("""
+        SELECT url FROM work_leases
+        WHERE next_due <= ? AND (lease_owner IS NULL OR lease_expires <= ?)
+        ORDER BY next_due LIMIT ?
+        """, (now, now, limit))
+        urls = [row[0] for row in cursor.fetchall()]
+        cursor.executemany("UPDATE work_leases SET lease_owner = ?, lease_expires = ? WHERE url = ?",
+                           [(node_id, now + lease_seconds, url) for url in urls])
+    return urls
+
+def renew_leases(node_id, urls, lease_seconds):
+    """Extend node_id's leases on urls. Returns the URLs it still holds (others were reclaimed)."""
+    expires = time.time() + lease_seconds
+    renewed = []
+    with transaction() as cursor:
+        for url in urls:
+            cursor.execute("UPDATE work_leases SET lease_expires = ? WHERE url = ? AND lease_owner = ?",
+                           (expires, url, node_id))
+            if cursor.rowcount:
+                renewed.append(url)
+    return renewed
+
+def complete_work(node_id, entries):
+    """Release node_id's leases on the (url, next_due) entries and schedule their next check."""
+    with transaction() as cursor:
+        cursor.executemany("""
+        UPDATE work_leases SET next_due = ?, lease_owner = NULL, lease_expires = NULL
+        WHERE url = ? AND lease_owner = ?
+        """, [(next_due, url, node_id) for url, next_due in entries])
+
+def release_leases(node_id, urls):
+    """Give URLs back without checking them; they stay due for any node."""
+    with transaction() as cursor:
+        cursor.executemany("UPDATE work_leases SET lease_owner = NULL, lease_expires = NULL "
+                           "WHERE url = ? AND lease_owner = ?", [(url, node_id) for url in urls])
+
+def next_work_due():
+    """Unix time at which the next free URL falls due, or None if the table is empty."""
+    cursor = get_connection().cursor()
+    cursor.execute("""
+    SELECT next_due FROM work_leases
+    WHERE lease_owner IS NULL OR lease_expires <= ?
+    ORDER BY next_due LIMIT 1
+    """, (time.time(),))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def work_queue_stats():
+    """Total URLs, claimable due URLs and how overdue the oldest is, expired leases and live leases per node."""
+    now = time.time()
+    cursor = get_connection().cursor()
+    cursor.execute("""
+    SELECT COUNT(*), COALESCE(SUM(claimable), 0), MIN(CASE WHEN claimable THEN next_due END),
+           COALESCE(SUM(lease_owner IS NOT NULL AND lease_expires <= ?), 0)
+    FROM (SELECT next_due, lease_owner, lease_expires,
+                 next_due <= ? AND (lease_owner IS NULL OR lease_expires <= ?) AS claimable FROM work_leases)
+    """, (now, now, now))
+    total, due, oldest_due, expired = cursor.fetchone()
+    cursor.execute("SELECT lease_owner, COUNT(*) FROM work_leases WHERE lease_expires > ? GROUP BY lease_owner", (now,))
+    return {"urls": total, "due": due,
+            "oldest_overdue_seconds": round(max(0.0, now - oldest_due), 1) if oldest_due is not None else 0.0,
+            "expired_leases": expired, "leases_by_node": dict(cursor.fetchall())}
+
+def import_legacy_url_files(paths=None):
+    """Register the URLs of the old product_urls.py / gamestop_urls.py lists. Returns the number added.
+
+    The files are parsed as literals (never executed) and left in place; importing twice is a no-op.
+    """
+    added = 0
+    for path, source in (paths or LEGACY_URL_FILES).items():
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            # Either "name = [...]" or a bare JSON list
+            if not content.startswith("["):
+                content = content.split("=", 1)[1]
+            urls = ast.literal_eval(content.strip()) if content.strip() else []
+        except (SyntaxError, ValueError, IndexError) as e:
+            logger.error("Failed to read legacy URL file %s: %s", path, e)
+            continue
+        if not isinstance(urls, list):
+            continue
+
+        # The file's last write is the best available "first seen" for its entries
+        new_urls = register_urls([url for url in urls if isinstance(url, str)], source, first_seen=os.path.getmtime(path))
+        if new_urls:
+            logger.info("Imported %d URL(s) from %s", len(new_urls), path)
+        added += len(new_urls)
+    return added
@@ -1,83 +1,191 @@
 import asyncio
-import json
+import logging
 import os
 import random
-import time
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
+from collections import Counter
+import httpx
+from bs4 import BeautifulSoup
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 from dotenv import load_dotenv
-from utils import USER_AGENTS
+import http_client
+import metrics
+import page_archive
+from amazon_extract import page_fingerprint, PAGE_UNCHANGED
+from money import parse_price, UNAVAILABLE
+from browser_pool import get_pool
+from database import fetch_tracked_urls
+from throttle import CHALLENGES, HostUnavailable
 
 load_dotenv()
 
-PRODUCT_URLS_FILE = "gamestop_urls.py"
+logger = logging.getLogger(__name__)
 
-def start_selenium():
-    """Initialize and return a headless Selenium WebDriver."""
-    options = Options()
-    options.add_argument("--headless=new")
-    options.add_argument("--log-level=3")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--enable-unsafe-swiftshader")
-    options.add_argument(f"user-agent={random.choice(USER_AGENTS)}")
+# Try plain HTTP + HTML parsing first and only render in Chrome when a field is missing
+HTTP_FAST_PATH = os.getenv("GAMESTOP_HTTP_FAST_PATH", "1") != "0"
+REQUIRED_FIELDS = ("title", "price", "availability", "image_url")
 
-    driver = webdriver.Chrome(service=Service(), options=options)
-    return driver
+# Raw regions behind the fields parse_gamestop_product_html reads (see amazon_extract.page_fingerprint)
+FINGERPRINT_REGIONS = (
+    ("og:title", None),
+    ("prodPriceCont", None),
+    ("productAvailability", None),
+    ("packshotImage", None),
+)
 
-async def get_gamestop_product_data(driver, url):
-    """Extract product details from GameStop."""
-    try:
-        driver.get(url)
-        await asyncio.sleep(random.uniform(3, 6))  # Allow time for JavaScript to load
+# Returned by the HTTP fast path when gamestop.it is refusing us (breaker open, 429/503,
+# challenge page): rendering the page in Chrome would hit the same host, so the check is skipped
+_HOST_REFUSED = object()
+
+# How each page was extracted, and which fields forced a Selenium fallback
+extraction_stats = Counter()
+fallback_missing_fields = Counter()
 
-        title_element = driver.find_element(By.CSS_SELECTOR, 'meta[property="og:title"]')
-        title = title_element.get_attribute("content") if title_element else "Unknown Product"
+def _read_product_fields(driver):
+    """Read the product fields from the page currently loaded in the driver."""
+    title_element = driver.find_element(By.CSS_SELECTOR, 'meta[property="og:title"]')
+    title = title_element.get_attribute("content") if title_element else "Unknown Product"
 
-        price_element = driver.find_element(By.CLASS_NAME, "prodPriceCont")
-        price = price_element.text.strip() if price_element else "Price not found"
+    price_element = driver.find_element(By.CLASS_NAME, "prodPriceCont")
+    price = parse_price(price_element.text) if price_element else UNAVAILABLE
 
-        availability_element = driver.find_element(By.CLASS_NAME, "productAvailability")
-        availability = availability_element.text.strip() if availability_element else "Unknown Availability"
+    availability_element = driver.find_element(By.CLASS_NAME, "productAvailability")
+    availability = availability_element.text.strip() if availability_element else "Unknown Availability"
 
-        image_element = driver.find_element(By.CSS_SELECTOR, 'img#packshotImage')
-        image_url = image_element.get_attribute("src") if image_element else "Image not found"
+    image_element = driver.find_element(By.CSS_SELECTOR, 'img#packshotImage')
+    image_url = image_element.get_attribute("src") if image_element else "Image not found"
 
-        product_data = {
-            "title": title,
-            "price": price,
-            "availability": availability,
-            "image_url": image_url,
-        }
+    return {
+        "title": title,
+        "price": price,
+        "availability": availability,
+        "image_url": image_url,
+    }
 
-        print(f"[INFO] Scraped product: {title}")
+async def get_gamestop_product_data(driver, url):
+    """Extract product details from GameStop."""
+    try:
+        # Selenium calls block, so run them off the event loop
+        with metrics.timer("browser", "gamestop.it"):
+            await asyncio.to_thread(driver.get, url)
+        await asyncio.sleep(random.uniform(3, 6))  # Allow time for JavaScript to load
+
+        with metrics.timer("parse", "gamestop.it"):
+            product_data = await asyncio.to_thread(_read_product_fields, driver)
+
+        logger.debug("Scraped product: %s", product_data['title'])
         return product_data
     except Exception as e:
-        print(f"[ERROR] Failed to scrape {url}: {e}")
+        logger.error("Failed to scrape %s: %s", url, e)
         return None
 
-async def scrape_all_products():
-    """Scrape all GameStop products from the stored URLs."""
-    if not os.path.exists(PRODUCT_URLS_FILE):
-        print(f"[ERROR] {PRODUCT_URLS_FILE} not found!")
-        return
-
-    with open(PRODUCT_URLS_FILE, "r", encoding="utf-8") as f:
-        urls = json.load(f)
+def parse_gamestop_product_html(html):
+    """Extract product fields from server-rendered GameStop HTML. Missing fields are None."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    title_element = soup.select_one('meta[property="og:title"]')
+    price_element = soup.select_one(".prodPriceCont")
+    availability_element = soup.select_one(".productAvailability")
+    image_element = soup.select_one("img#packshotImage")
+
+    return {
+        "title": title_element.get("content") if title_element else None,
+        "price": (price_element.get_text(" ", strip=True) or None) if price_element else None,
+        "availability": (availability_element.get_text(" ", strip=True) or None) if availability_element else None,
+        "image_url": image_element.get("src") if image_element else None,
+    }
+
+async def fetch_gamestop_product_http(url, previous_fingerprint=None):
+    """Fetch a GameStop product page without a browser and parse the static HTML.
+
+    Returns PAGE_UNCHANGED without parsing when the page fingerprint equals previous_fingerprint,
+    and _HOST_REFUSED while the host's circuit breaker is open or it answers with a challenge.
+    """
+    headers = {"Accept-Language": "it-IT,it;q=0.9"}  # The User-Agent comes from the host's throttle
+    try:
+        response = await http_client.get(url, headers=headers)
+        outcome = response.extensions["throttle_outcome"]
+        if outcome in CHALLENGES:
+            logger.warning("%s response for %s, skipping until the next check", outcome, url,
+                           extra={"sample": "gamestop_challenge"})
+            return _HOST_REFUSED
+        response.raise_for_status()
+    except HostUnavailable as e:
+        logger.info("Not fetching %s: %s", url, e, extra={"sample": "gamestop_host_unavailable"})
+        return _HOST_REFUSED
+    except httpx.HTTPError as e:
+        logger.warning("GameStop HTTP fetch failed for %s: %s", url, e)
+        return None
+    await page_archive.store(url, response)  # Only with PAGE_ARCHIVE_DIR set; see reextract.py
+
+    with metrics.timer("parse", "gamestop.it"):
+        fingerprint = page_fingerprint(response.text, FINGERPRINT_REGIONS)
+        if fingerprint is not None and fingerprint == previous_fingerprint:
+            return PAGE_UNCHANGED
+        product_data = parse_gamestop_product_html(response.text)
+    product_data["fingerprint"] = fingerprint
+    return product_data
+
+async def get_gamestop_product(url, previous_fingerprint=None):
+    """Scrape a GameStop product page, using Selenium only when the HTTP fast path is incomplete.
+
+    Returns PAGE_UNCHANGED when the static page matches previous_fingerprint. Only data taken
+    from the static HTML carries a fingerprint; Selenium results never do, since the rendered
+    fields may change without the static HTML changing.
+    """
+    if HTTP_FAST_PATH:
+        product_data = await fetch_gamestop_product_http(url, previous_fingerprint)
+        if product_data is PAGE_UNCHANGED:
+            extraction_stats["unchanged"] += 1
+            return product_data
+        if product_data is _HOST_REFUSED:
+            extraction_stats["host_refused"] += 1
+            return None
+        missing = [field for field in REQUIRED_FIELDS if not product_data or not product_data[field]]
+
+        if not missing:
+            extraction_stats["http"] += 1
+            logger.debug("Scraped product: %s", product_data['title'])
+            product_data["price"] = parse_price(product_data["price"])  # Text until here so "missing" means missing
+            return product_data
+
+        extraction_stats["selenium_fallback"] += 1
+        fallback_missing_fields.update(missing)
+        logger.debug("HTTP fast path missing %s for %s, falling back to Selenium", missing, url)
+    else:
+        extraction_stats["selenium"] += 1
+
+    async with get_pool().checkout_async() as driver:
+        return await get_gamestop_product_data(driver, url)
+
+def get_extraction_stats():
+    """Return how often the HTTP fast path succeeded versus fell back to Selenium (or was refused by the host)."""
+    http_count = extraction_stats["http"]
+    fallback_count = extraction_stats["selenium_fallback"]
+    attempts = http_count + fallback_count
+    return {
+        "http": http_count,
+        "selenium_fallback": fallback_count,
+        "selenium_only": extraction_stats["selenium"],
+        "unchanged": extraction_stats["unchanged"],
+        "host_refused": extraction_stats["host_refused"],
+        "fallback_rate": fallback_count / attempts if attempts else 0.0,
+        "missing_fields": dict(fallback_missing_fields),
+    }
 
-    driver = start_selenium()
+async def scrape_all_products():
+    """Scrape all GameStop products in the URL registry."""
+    urls = fetch_tracked_urls("gamestop")
     results = []
 
     for url in urls:
-        product_data = await get_gamestop_product_data(driver, url)
+        product_data = await get_gamestop_product(url)
         if product_data:
             results.append(product_data)
 
-    driver.quit()
     return results
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+
+    setup_logging()
     asyncio.run(scrape_all_products())
@@ -0,0 +1,3 @@
+gamestop_urls = [
+    
+]
\ No newline at end of file
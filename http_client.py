@@ -0,0 +1,69 @@
+import os
+import httpx
+from dotenv import load_dotenv
+import metrics
+import throttle
+
+load_dotenv()
+
+# Connection pool sizing (shared by every coroutine in the process)
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10))
+REQUEST_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+
+_client = None
+
+def get_client():
+    """Return the shared async HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+        )
+    return _client
+
+def _clear_cookies(domain):
+    """Forget the session cookies set by domain (and its subdomains)."""
+    jar = get_client().cookies.jar
+    for cookie in list(jar):
+        if cookie.domain.lstrip(".") == domain or cookie.domain.endswith("." + domain):
+            jar.clear(cookie.domain, cookie.path, cookie.name)
+
+async def get(url, headers=None, timeout=None):
+    """Perform a GET through the shared pool under the host's adaptive throttle (see throttle.py).
+
+    The host's current User-Agent is sent unless headers set one. The response's throttle
+    outcome (throttle.OK, CAPTCHA, ...) is in response.extensions["throttle_outcome"].
+    Raises throttle.HostUnavailable, without sending anything, while the host's breaker is open.
+    """
+    controller = throttle.get_controller(url)
+    await controller.acquire()
+    generation = controller.session_generation
+    outcome = None
+    try:
+        # Timed after acquire() so the histogram shows network time, not queueing
+        with metrics.timer("fetch", controller.domain):
+            response = await get_client().get(url, headers={"User-Agent": controller.user_agent, **(headers or {})},
+                                              timeout=timeout or REQUEST_TIMEOUT)
+        outcome = throttle.classify_response(controller.domain, response)
+        response.extensions["throttle_outcome"] = outcome
+        return response
+    except httpx.HTTPError:
+        outcome = throttle.ERROR
+        raise
+    finally:
+        controller.release(outcome)
+        if controller.session_generation != generation:
+            _clear_cookies(controller.domain)
+
+async def close_client():
+    """Close the shared HTTP client and release pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
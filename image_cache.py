@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import namedtuple
+from io import BytesIO
+import httpx
+from PIL import Image
+from dotenv import load_dotenv
+import http_client
+from database import (fetch_image_source, save_image_source, touch_image_source,
+                      set_image_file_id, evict_image_blobs)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+MAX_CACHE_BYTES = int(float(os.getenv("IMAGE_CACHE_MAX_MB", 200)) * 1024 * 1024)
+REVALIDATE_AFTER = int(os.getenv("IMAGE_CACHE_REVALIDATE_AFTER", 86400))  # Seconds before a conditional re-check
+DOWNLOAD_TIMEOUT = 10
+
+CachedImage = namedtuple("CachedImage", ["content_hash", "path", "telegram_file_id"])
+
+def render_square_jpeg(data):
+    """Center an image on a white square canvas and return it as JPEG bytes."""
+    image = Image.open(BytesIO(data))
+    if image.mode != "RGB":
+        image = image.convert("RGBA") if "A" in image.getbands() or image.mode == "P" else image.convert("RGB")
+
+    # Create a white square background
+    size = max(image.size)
+    background = Image.new("RGB", (size, size), (255, 255, 255))
+
+    # Center the image on the background
+    offset = ((size - image.size[0]) // 2, (size - image.size[1]) // 2)
+    background.paste(image, offset, image if image.mode == "RGBA" else None)
+
+    output = BytesIO()
+    background.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+def blob_path(content_hash):
+    """Path of the processed image for a content hash (two-level fan-out)."""
+    return os.path.join(CACHE_DIR, content_hash[:2], f"{content_hash}.jpg")
+
+def _write_blob(content_hash, data):
+    path = blob_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)  # Atomic, so readers never see a partial file
+    return path
+
+def _evict():
+    for content_hash in evict_image_blobs(MAX_CACHE_BYTES):
+        try:
+            os.remove(blob_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+async def get_image(image_url):
+    """Return a CachedImage for image_url, downloading and processing it only when needed.
+
+    Fresh entries are served without any request; stale ones are revalidated with
+    If-None-Match/If-Modified-Since. Returns None if the image can't be fetched.
+    """
+    row = fetch_image_source(image_url)
+    if row:
+        etag, last_modified, content_hash, validated_at, _, file_id = row
+        path = blob_path(content_hash)
+        if os.path.exists(path):
+            if time.time() - validated_at < REVALIDATE_AFTER:
+                touch_image_source(image_url)
+                return CachedImage(content_hash, path, file_id)
+        else:
+            row = None  # Index points at a file that was removed; refetch
+
+    headers = {}
+    if row:
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    try:
+        response = await http_client.get(image_url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+        if row and response.status_code == 304:
+            touch_image_source(image_url, revalidated=True)
+            return CachedImage(content_hash, path, file_id)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error("Failed to download image %s: %s", image_url, e)
+        return None
+
+    # Identical source bytes map to the same blob (and the same Telegram file_id)
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    path = blob_path(content_hash)
+    if not os.path.exists(path):
+        try:
+            processed = await asyncio.to_thread(render_square_jpeg, response.content)
+        except Exception as e:
+            logger.error("Failed to process image: %s", e)
+            return None
+        await asyncio.to_thread(_write_blob, content_hash, processed)
+
+    save_image_source(image_url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                      content_hash, os.path.getsize(path))
+    _evict()
+
+    row = fetch_image_source(image_url)
+    return CachedImage(content_hash, path, row[5] if row else None)
+
+def remember_file_id(content_hash, file_id):
+    """Store the Telegram file_id of an uploaded image so later sends can reuse it."""
+    set_image_file_id(content_hash, file_id)
+
+def forget_file_id(content_hash):
+    """Drop a file_id Telegram no longer accepts (e.g. after a bot token change)."""
+    set_image_file_id(content_hash, None)
@@ -0,0 +1,139 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG records cost nothing unless this is DEBUG
+LOG_CONSOLE_LEVEL = os.getenv("LOG_CONSOLE_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "logs/tracker.jsonl")  # JSON lines; empty disables the file sink
+LOG_MAX_BYTES = int(float(os.getenv("LOG_MAX_MB", 20)) * 1024 * 1024)  # Rotate the file at this size
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 100))  # Keep 1 in N records of each sampled event
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer thread; beyond this they are dropped
+
+# Attributes every LogRecord has; anything else came from extra= and goes into the JSON line
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, plus any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Let through 1 in `every` records per sampled event; errors are never sampled.
+
+    Log a high-volume event with extra={"sample": "<event name>"}; the records that pass
+    carry sampled_1_in so totals can be scaled back up. Other records are untouched.
+    """
+
+    def __init__(self, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, "sample", None)
+        if event is None or record.levelno >= logging.ERROR or self.every == 1:
+            return True
+        with self._lock:
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+        if count % self.every:
+            return False
+        record.sampled_1_in = self.every
+        return True
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: records are dropped when the writer falls behind."""
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Merge the args now (they may be mutated after the call) but keep the traceback
+        # separate from the message so the JSON sink can put it in its own field
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped")
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, console_level=LOG_CONSOLE_LEVEL, log_file=LOG_FILE,
+                  max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, sample_every=LOG_SAMPLE_EVERY):
+    """Route all logging through a queue to a background writer thread.
+
+    The calling thread only checks the level, samples and enqueues; formatting for the
+    console and the rotating JSON-lines file happens in the writer thread. Safe to call
+    twice (the second call is a no-op).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(console_level)
+    console.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s", "%H:%M:%S"))
+    handlers = [console]
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(sample_every))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # Third-party clients log every request at INFO/DEBUG
+    for noisy in ("httpx", "httpcore", "telegram", "selenium", "urllib3"):
+        logging.getLogger(noisy).setLevel(max(logging.WARNING, root.level))
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)  # Scripts that never call stop_logging() still flush the queue
+    return _listener
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,150 +1,275 @@
 import asyncio
 import logging
-import subprocess
-from database import initialize_database, save_product_details, fetch_previous_details
-from notifications import send_heartbeat, should_send, send_to_telegram_with_image
-from product_urls import product_urls
-from gamestop_urls import gamestop_urls
-from gamestop import get_gamestop_product_data, start_selenium
+import time
+from database import (initialize_database, close_connection, ProductStateCache, import_legacy_url_files,
+                      fetch_url_changes)
+from notifications import send_heartbeat, event_headline
+from notify_queue import get_queue
+from gamestop import get_gamestop_product, get_extraction_stats
+from browser_pool import get_pool
 from amazon import get_amazon_product_details
+from amazon_extract import PAGE_UNCHANGED, PAGE_SKIPPED
+from http_client import close_client
+from scheduler import AdaptiveScheduler, url_domain
+from utils import availability_flag
+from collections import Counter
+from change_detection import get_detector, first_per_product
+import AM
+import GS
+import metrics
+import parse_pool
+import throttle
+import work_queue
 import os
+from logging_setup import setup_logging, stop_logging
 
 # Constants
-CHECK_INTERVAL = 60  # Time in seconds before checking for new updates
-BATCH_SIZE = 5       # Number of URLs processed in each batch
+CHECK_INTERVAL = 60  # Seconds between state reloads and scheduler reports; per-URL timing is adaptive
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 20))  # Number of URLs processed concurrently in each batch
 HEARTBEAT_INTERVAL = 21600  # Send heartbeat every 6 hours
-GAMESTOP_UPDATE_INTERVAL = 3600  # Run GameStop scraping once per hour
+AMAZON_DISCOVERY_INTERVAL = int(os.getenv("AMAZON_DISCOVERY_INTERVAL", 3600))  # Seconds between Amazon category sweeps
+GAMESTOP_DISCOVERY_INTERVAL = int(os.getenv("GAMESTOP_DISCOVERY_INTERVAL", 3600))  # Seconds between GameStop listing sweeps
+DISCOVERY_ENABLED = os.getenv("TRACKER_DISCOVERY", "1") != "0"  # With several nodes, one is enough
+
+logger = logging.getLogger(__name__)
+
+# Pages checked since the last report: "parsed" vs "unchanged" (fingerprint matched, nothing else done)
+page_stats = Counter()
 
 async def run_am():
-    """Run Amazon scraper (AM.py) asynchronously."""
-    logging.info("[INFO] Running AM.py asynchronously...")
-    process = await asyncio.create_subprocess_exec("python", "AM.py")
-    await process.communicate()
+    """Discover new Amazon products in-process every AMAZON_DISCOVERY_INTERVAL seconds."""
+    while True:
+        logger.info("Running Amazon URL discovery...")
+        try:
+            # Shares the tracker's HTTP client; new URLs land in the registry and are picked up by track_products
+            await AM.update_urls()
+        except Exception as e:
+            logger.error("Amazon URL discovery failed: %s", e)
+        await asyncio.sleep(AMAZON_DISCOVERY_INTERVAL)
 
 async def run_gs():
-    """Run GameStop scraper (GS.py) asynchronously once per hour."""
+    """Discover new GameStop products in-process every GAMESTOP_DISCOVERY_INTERVAL seconds."""
     while True:
-        logging.info("[INFO] Running GS.py asynchronously...")
-        process = await asyncio.create_subprocess_exec("python", "GS.py")
-        await process.communicate()
-        await asyncio.sleep(GAMESTOP_UPDATE_INTERVAL)  # Runs every hour
+        logger.info("Running GameStop URL discovery...")
+        try:
+            # Selenium is blocking; the sweep checks out a driver from the shared pool in a worker thread
+            await asyncio.to_thread(GS.update_urls)
+        except Exception as e:
+            logger.error("GameStop URL discovery failed: %s", e)
+        await asyncio.sleep(GAMESTOP_DISCOVERY_INTERVAL)
 
-async def process_gamestop():
-    """Processes GameStop URLs once per hour to avoid redundant scraping."""
-    while True:
-        logging.info("[INFO] Running GameStop scraper...")
+def report_cycle(scheduler, busy_seconds, pages):
+    """Publish the last CHECK_INTERVAL window to the metrics gauges.
 
-        driver = start_selenium()
-        seen_urls = set()
+    busy_seconds is the time spent processing batches; a utilization near (or above) 1.0
+    means the tracker cannot keep up with CHECK_INTERVAL.
+    """
+    metrics.observe("cycle", None, busy_seconds)
+    metrics.set_gauge("check_interval_seconds", CHECK_INTERVAL)
+    metrics.set_gauge("cycle_busy_seconds", round(busy_seconds, 3))
+    metrics.set_gauge("cycle_utilization", round(busy_seconds / CHECK_INTERVAL, 3))
+    metrics.set_gauge("cycle_pages_parsed", pages["parsed"])
+    metrics.set_gauge("cycle_pages_unchanged", pages["unchanged"])
+    metrics.set_gauge("cycle_pages_skipped", pages["skipped"])
+    metrics.set_gauge("scheduler", scheduler.stats())
+    metrics.set_gauge("notifications", get_queue().stats())
+    metrics.set_gauge("gamestop_extraction", get_extraction_stats())
 
-        try:
-            results = []
-            for url in gamestop_urls:
-                if url not in seen_urls:
-                    seen_urls.add(url)
-                    product_data = await get_gamestop_product_data(driver, url)
-                    if product_data:
-                        results.append(product_data)
+def apply_url_changes(scheduler, since_version):
+    """Add registry URLs changed after since_version to the scheduler (or drop paused ones).
+
+    Returns the registry version to poll from next time.
+    """
+    changes, latest_version = fetch_url_changes(since_version)
+    now = time.time()
+    added = 0
+    for url, source, first_seen, active in changes:
+        if active:
+            # Spread a large batch (e.g. the initial load) over a minute so it doesn't arrive as one burst
+            scheduler.add(url, delay=(added % 60) if len(changes) > 60 else 0.0, age=max(0.0, now - first_seen))
+            added += 1
+        else:
+            scheduler.remove(url)
+    if changes:
+        logger.info("URL registry: %d URL(s) added, %d paused, %d tracked", added, len(changes) - added, len(scheduler))
+    return latest_version
+
+async def process_tracked_url(url, state, observations):
+    """Scrape a single tracked URL, stage changes in the cycle state and collect it for change detection.
+
+    Appends (url, details, previous state) to observations and returns (changed, available 1/0)
+    for the scheduler; (False, None) if the page couldn't be scraped.
+    """
+    try:
+        # Detect source and call appropriate scraper; an unchanged page fingerprint skips parsing
+        previous_fingerprint = state.fingerprint(url)
+        if "gamestop.it" in url:
+            product_data = await get_gamestop_product(url, previous_fingerprint)
+        else:
+            product_data = await get_amazon_product_details(url, previous_fingerprint)
+
+        if product_data is PAGE_UNCHANGED:
+            # Nothing the extractor reads has changed: no persistence, no notification checks
+            page_stats["unchanged"] += 1
+            return False, availability_flag(state.previous_details(url)["availability"])
+
+        if product_data is PAGE_SKIPPED:
+            # Fetched and parsed, but not an offer we track (e.g. not fulfilled by Amazon)
+            page_stats["skipped"] += 1
+            return False, None
 
-            # Print only unique extracted product data
-            for product in results:
-                print(product)
+        if not product_data:
+            metrics.increment("scrape_failures", url_domain(url))
 
-        finally:
-            driver.quit()
+        if product_data:
+            page_stats["parsed"] += 1
+            # Previous state comes from the cycle-level cache, not the database
+            previous = state.previous_state(url)
+            logger.debug("Previous state for %s: %s", url, previous)
+            observations.append((url, product_data, previous))
 
-        logging.info("[INFO] GameStop scraping complete. Sleeping for 1 hour.")
-        await asyncio.sleep(GAMESTOP_UPDATE_INTERVAL)
+            # Stage the data; changed products are written once per batch
+            changed = state.stage(url, product_data['title'], product_data['price'],
+                        product_data['availability'], product_data['image_url'], product_data.get('fingerprint'))
+            logger.debug("Scraped product_data: %s", product_data)
 
-print("[DEBUG] Initial product_urls:", product_urls)
-print("[DEBUG] Initial gamestop_urls:", gamestop_urls)
+            return changed, availability_flag(product_data['availability'])
+
+    except Exception as e:
+        metrics.increment("errors", url_domain(url))
+        logger.error("Error processing URL %s: %s", url, e)
+
+    return False, None
+
+def notify_changes(observations):
+    """Run change detection over a batch's observations and queue one notification per changed product."""
+    events = get_detector().detect(observations)
+    for event in events:
+        metrics.increment(f"{event.kind}_events", url_domain(event.url))
+    for event in first_per_product(events):
+        details = event.details
+        logger.info("✅ Queueing %s notification for %s...", event.kind, details['title'])
+        # Delivery happens in the notification workers; scraping never waits on Telegram
+        get_queue().enqueue(details['title'], details['image_url'], details['price'], event.url,
+                            "GameStop" if "gamestop.it" in event.url else "Amazon", event_headline(event))
 
 async def track_products():
-    """Main tracking function that processes Amazon and GameStop URLs."""
-    last_heartbeat = asyncio.get_running_loop().time()
+    """Main tracking loop: check Amazon and GameStop URLs as the adaptive scheduler makes them due."""
+    loop = asyncio.get_running_loop()
+    last_heartbeat = loop.time()
+    scheduler = AdaptiveScheduler(hold=throttle.retry_after)  # Hosts with an open circuit breaker wait
+    backend = work_queue.get_backend()
+    lease_heartbeat = None
+    if backend is not None:
+        # Multi-node mode: due URLs are leased from the shared work table
+        scheduler = work_queue.LeaseScheduler(scheduler, backend)
+        lease_heartbeat = asyncio.create_task(scheduler.heartbeat())
+        logger.info("Sharing work as node %s (%s backend)", scheduler.node_id, work_queue.WORK_QUEUE_BACKEND)
+    url_version = apply_url_changes(scheduler, 0)
+    state = ProductStateCache.load()
+    last_refresh = loop.time()
+    busy_seconds = 0.0  # Time spent on batches since the last report
 
     while True:
-        start_time = asyncio.get_running_loop().time()
-        logging.debug("Fetching valid URLs...")
+        try:
+            # Pick up URLs discovered (or paused) since the last pass; an index seek when nothing changed
+            url_version = apply_url_changes(scheduler, url_version)
 
-        all_urls = product_urls + gamestop_urls 
-        logging.debug(f"Total URLs to check: {len(all_urls)}")
+            # Once per CHECK_INTERVAL: reload product state and report the queue
+            if loop.time() - last_refresh >= CHECK_INTERVAL:
+                with metrics.timer("db", "state_load"):
+                    state = ProductStateCache.load()
+                last_refresh = loop.time()
+                report_cycle(scheduler, busy_seconds, page_stats)
+                busy_seconds = 0.0
+                logger.info("Scheduler: %s", scheduler.stats())
+                logger.info("Notifications: %s", get_queue().stats())
+                logger.info("Hosts: %s", throttle.controller_stats())
+                logger.info("GameStop extraction stats: %s", get_extraction_stats())
+                logger.info("Pages since last report: %d parsed, %d unchanged (same fingerprint), "
+                            "%d skipped (not tracked offers)",
+                            page_stats['parsed'], page_stats['unchanged'], page_stats['skipped'])
+                page_stats.clear()
 
-        try:
-            for batch_start in range(0, len(all_urls), BATCH_SIZE):
-                batch = all_urls[batch_start:batch_start + BATCH_SIZE]
-                logging.info(f"Processing batch {batch_start // BATCH_SIZE + 1}/{(len(all_urls) + BATCH_SIZE - 1) // BATCH_SIZE}")
-
-                # Process all URLs (Amazon and GameStop)
-                for url in batch:
-                    try:
-                        # Detect source and call appropriate scraper
-                        if "gamestop.it" in url:
-                            driver = start_selenium()
-                            product_data = await get_gamestop_product_data(driver, url)
-                            driver.quit()
-                        else:
-                            product_data = await get_amazon_product_details(url)
-
-                        if product_data:
-                            # Fetch previous details before saving
-                            previous_details = fetch_previous_details(url)
-                            print(f"[DEBUG] Previous details for {url}: {previous_details}")
-
-                            # Save the data in the database
-                            save_product_details(url, product_data['title'], product_data['price'],
-                                                 product_data['availability'], product_data['image_url'])
-
-                            # Verify saved data
-                            print(f"[DEBUG] Saved product_data: {product_data}")
-                            retrieved_data = fetch_previous_details(url)
-                            print(f"[DEBUG] Retrieved data from database: {retrieved_data}")
-
-                            # Evaluate whether to send a notification
-                            should_notify, reason = should_send(product_data, previous_details)
-                            print(f"[DEBUG] Should send notification? {should_notify} (Reason: {reason})")
-
-                            if should_notify:
-                                source = "GameStop" if "gamestop.it" in url else "Amazon"
-                                print(f"[INFO] ✅ Sending notification for {product_data['title']}...")
-
-                                await send_to_telegram_with_image(
-                                    product_data['title'], product_data['image_url'],
-                                    product_data['price'], url, source
-                                )
-                            else:
-                                print(f"[DEBUG] ❌ Notification NOT sent for {product_data['title']} (Reason: {reason})")
-
-                    except Exception as e:
-                        print(f"[ERROR] Error processing URL {url}: {e}")
-
-            elapsed = asyncio.get_running_loop().time() - start_time
-            logging.debug(f"Sleeping for {max(0, CHECK_INTERVAL - elapsed)} seconds before next check...")
-            await asyncio.sleep(max(0, CHECK_INTERVAL - elapsed))
+            batch = scheduler.pop_due(BATCH_SIZE)
+            if not batch:
+                await asyncio.sleep(min(scheduler.seconds_until_next(), CHECK_INTERVAL))
+                continue
+
+            logger.info("Checking %d due URL(s), %d tracked", len(batch), len(scheduler), extra={"sample": "batch"})
+            batch_start = loop.time()
+            if backend is not None:
+                state.refresh(batch)  # Another node may have checked these since our last reload
+
+            # Process the whole batch concurrently; per-host limits live in http_client
+            observations = []
+            results = await asyncio.gather(*(process_tracked_url(url, state, observations) for url in batch))
+            for url, (changed, availability) in zip(batch, results):
+                scheduler.record(url, changed, availability)
+
+            # Every rule is evaluated once for the whole batch
+            try:
+                with metrics.timer("detect"):
+                    notify_changes(observations)
+            except Exception as e:
+                logger.error("Change detection failed for this batch: %s", e)
+
+            # Persist everything that changed in this batch in one transaction
+            try:
+                with metrics.timer("db", "flush"):
+                    state.flush()
+            except Exception as e:
+                logger.error("Failed to save batch, will retry with the next one: %s", e)
+
+            batch_seconds = loop.time() - batch_start
+            busy_seconds += batch_seconds
+            metrics.observe("batch", None, batch_seconds)
+            metrics.increment("pages_checked", amount=len(batch))
 
             # Send heartbeat if needed
-            if asyncio.get_running_loop().time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+            if loop.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
                 send_heartbeat()
-                last_heartbeat = asyncio.get_running_loop().time()
+                last_heartbeat = loop.time()
 
         except asyncio.CancelledError:
-            logging.info("Shutting down gracefully...")
+            logger.info("Shutting down gracefully...")
             break
 
+    if lease_heartbeat is not None:
+        lease_heartbeat.cancel()
+        scheduler.close()
+
 async def main():
     """Initialize database, start tracking products, and run periodic scripts."""
-    logging.debug("Initializing database...")
+    setup_logging()
+    logger.debug("Initializing database...")
     initialize_database()
+    import_legacy_url_files()  # One-time migration of product_urls.py / gamestop_urls.py
+
+    # Launch the Chrome drivers up front (off the event loop) and clear leftovers
+    await asyncio.to_thread(get_pool().warm_up)
+    await asyncio.to_thread(parse_pool.warm_up)
+    await get_queue().start()
+    metrics_server = metrics.start_server()
 
     try:
-        await asyncio.gather(track_products(), run_am(), run_gs(), process_gamestop())
+        discovery = (run_am(), run_gs()) if DISCOVERY_ENABLED else ()
+        await asyncio.gather(track_products(), *discovery, metrics.write_snapshots())
     except asyncio.CancelledError:
-        logging.info("Main process interrupted. Cleaning up...")
+        logger.info("Main process interrupted. Cleaning up...")
     finally:
-        logging.info("Shutdown complete.")
+        await get_queue().stop()
+        await close_client()
+        close_connection()
+        get_pool().close()
+        parse_pool.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        logger.info("Shutdown complete.")
+        stop_logging()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        logging.info("Process terminated by user.")
+        print("Process terminated by user.")
@@ -0,0 +1,198 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))  # 0 disables the endpoint
+SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH", "metrics.json")  # Empty disables snapshots
+SNAPSHOT_INTERVAL = int(os.getenv("METRICS_SNAPSHOT_INTERVAL", 60))
+
+# Upper bounds in seconds; spans SQLite writes (ms) to Chrome start-up and Telegram retries (tens of s)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style)."""
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the max for the +Inf bucket)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_seconds": round(self.sum, 6),
+            "avg_seconds": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50_seconds": round(self.quantile(0.5), 6),
+            "p95_seconds": round(self.quantile(0.95), 6),
+            "max_seconds": round(self.max, 6),
+        }
+
+class Metrics:
+    """Process-wide histograms, event counters and gauges, each optionally per domain. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self.started_at = time.time()
+
+    def observe(self, stage, domain, seconds):
+        key = (stage, domain or "")
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, domain=None):
+        """Time the body of a with-block (works around awaits too) into the stage histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, domain, time.perf_counter() - start)
+
+    def increment(self, event, domain=None, amount=1):
+        key = (event, domain or "")
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, domain=None):
+        key = (name, domain or "")
+        with self._lock:
+            self._gauges[key] = value
+
+    def snapshot(self):
+        """All metrics as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "timestamp": int(time.time()),
+                "uptime_seconds": int(time.time() - self.started_at),
+                "histograms": {f"{stage}|{domain}" if domain else stage: histogram.to_dict()
+                               for (stage, domain), histogram in sorted(self._histograms.items())},
+                "counters": {f"{event}|{domain}" if domain else event: value
+                             for (event, domain), value in sorted(self._counters.items())},
+                "gauges": {f"{name}|{domain}" if domain else name: value
+                           for (name, domain), value in sorted(self._gauges.items())},
+            }
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = ["# TYPE scraper_stage_seconds histogram"]
+        with self._lock:
+            for (stage, domain), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",domain="{domain}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'scraper_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'scraper_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"scraper_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"scraper_stage_seconds_count{{{labels}}} {histogram.count}")
+
+            lines.append("# TYPE scraper_events_total counter")
+            for (event, domain), value in sorted(self._counters.items()):
+                lines.append(f'scraper_events_total{{event="{event}",domain="{domain}"}} {value}')
+
+            typed = set()
+            for (name, domain), value in sorted(self._gauges.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE scraper_{name} gauge")
+                    labels = f'{{domain="{domain}"}}' if domain else ""
+                    lines.append(f"scraper_{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Module-level shortcuts so call sites read metrics.timer("fetch", domain)
+observe = metrics.observe
+timer = metrics.timer
+increment = metrics.increment
+set_gauge = metrics.set_gauge
+snapshot = metrics.snapshot
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/metrics"):
+            body, content_type = metrics.prometheus_text().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(metrics.snapshot(), indent=2).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread. Returns the server or None."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics on http://%s:%s/metrics (JSON: /metrics.json)", host, port)
+    return server
+
+def write_snapshot(path=SNAPSHOT_PATH):
+    """Atomically write the current snapshot as JSON."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metrics.snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
+
+async def write_snapshots(path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL):
+    """Write a JSON snapshot every interval seconds (and once more when cancelled)."""
+    if not path:
+        return
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(write_snapshot, path)
+    finally:
+        write_snapshot(path)
@@ -0,0 +1,50 @@
+import re
+from functools import lru_cache
+
+# Prices are integer euro cents everywhere: scrapers, the database, change detection and
+# notifications. UNAVAILABLE means the page shows no price; it is stored as NULL.
+UNAVAILABLE = None
+UNAVAILABLE_TEXT = "Prezzo non disponibile"
+
+# The first amount in the text: digits with optional thousands groups ("1.299", "1 299") and up
+# to two decimals after "," or "." ("29,99", "7,5", "1299.99")
+_AMOUNT = re.compile(r"""
+    (?P<whole>\d{1,3}(?P<sep>[.,\u00a0\u202f ])\d{3}(?:(?P=sep)\d{3})* | \d+)
+    (?:[.,](?P<fraction>\d{1,2})(?!\d))?
+""", re.VERBOSE)
+
+@lru_cache(maxsize=4096)
+def _parse_text(text):
+    match = _AMOUNT.search(text)
+    if match is None:
+        return UNAVAILABLE
+    whole = match.group("whole")
+    if match.group("sep"):
+        whole = whole.replace(match.group("sep"), "")
+    fraction = (match.group("fraction") or "").ljust(2, "0")
+    return int(whole) * 100 + int(fraction)
+
+def parse_price(value):
+    """Return the price in integer cents, or UNAVAILABLE.
+
+    Text is read Italian/EU style ("1.299,99 €", "€ 24,90", "Prezzo non disponibile").
+    An int is taken as cents already; a float is euros (old REAL database values).
+    """
+    if value is None or isinstance(value, bool):
+        return UNAVAILABLE
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(round(value * 100))
+    return _parse_text(str(value))
+
+def parse_prices(values):
+    """parse_price() for a batch; repeated strings (common across a listing) are parsed once."""
+    return [parse_price(value) for value in values]
+
+def format_price(cents):
+    """Italian display form: "1.299,99 €", or UNAVAILABLE_TEXT."""
+    if cents is UNAVAILABLE:
+        return UNAVAILABLE_TEXT
+    euros, remainder = divmod(cents, 100)
+    return f"{euros:,}".replace(",", ".") + f",{remainder:02d} €"
@@ -1,9 +1,9 @@
+import logging
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import TelegramError
+from telegram.error import TelegramError, BadRequest
 from urllib.parse import urlparse, quote
 import asyncio
 from datetime import datetime
-from PIL import Image, ImageOps
 import requests
 from io import BytesIO
 from dotenv import load_dotenv
@@ -12,8 +12,14 @@ import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import traceback
+import image_cache
+from utils import affiliate_url
+from money import format_price
+import change_detection
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID")
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
@@ -28,7 +34,7 @@ def is_valid_url(url):
         parsed = urlparse(url)
         return bool(parsed.scheme) and bool(parsed.netloc)
     except Exception as e:
-        print(f"[DEBUG] Invalid URL: {url}, Error: {e}")
+        logger.debug("Invalid URL: %s, Error: %s", url, e)
         return False
 
 def clean_url(url):
@@ -36,58 +42,80 @@ def clean_url(url):
     try:
         return quote(url, safe=":/?&=")
     except Exception as e:
-        print(f"[ERROR] Failed to clean URL: {e}")
+        logger.error("Failed to clean URL: %s", e)
         return url
 
-def should_send(current_details, previous_details, price_change_threshold=0.05):
-    """Determine whether a notification should be sent based on price or availability changes."""
-    print(f"[DEBUG] should_send called with:\n - current_details: {current_details}\n - previous_details: {previous_details}")
-
-    if not previous_details:
-        print("[DEBUG] No previous details found. This is a new product.")
-        return True, "New product detected."
-
-    print("[DEBUG] No notification triggered. Check logic for issues.")
-    return False, "No significant changes detected."
+def event_headline(event):
+    """First line of the notification for a change_detection.ChangeEvent."""
+    if event.kind == change_detection.PRICE_DROP:
+        return f"📉 Prezzo in calo del {1 - event.price_cents / event.previous_cents:.0%}"
+    if event.kind == change_detection.ALL_TIME_LOW:
+        return "🏆 Prezzo minimo storico"
+    if event.kind == change_detection.BACK_IN_STOCK:
+        return "✅ Di nuovo disponibile"
+    if event.kind == change_detection.OUT_OF_STOCK:
+        return "❌ Non più disponibile"
+    return "🆕 Nuovo prodotto"
 
 def process_image(image_url):
     """Download and process the image to fit within a square."""
     try:
-        response = requests.get(image_url)
+        response = requests.get(image_url, timeout=image_cache.DOWNLOAD_TIMEOUT)
         response.raise_for_status()
-        image = Image.open(BytesIO(response.content))
-
-        # Create a white square background
-        size = max(image.size)
-        background = Image.new('RGB', (size, size), (255, 255, 255))
-
-        # Center the image on the background
-        offset = ((size - image.size) // 2, (size - image.size) // 2)
-        background.paste(image, offset)
 
         # Save the processed image to a BytesIO object
-        output = BytesIO()
-        background.save(output, format='JPEG')
+        output = BytesIO(image_cache.render_square_jpeg(response.content))
         output.seek(0)
 
         return output
 
     except Exception as e:
-        print(f"[ERROR] Failed to process image: {e}")
+        logger.error("Failed to process image: %s", e)
         return None
 
-async def send_to_telegram_with_image(title, image_url, price, url, site):
-    print(f"[DEBUG] Entering send_to_telegram_with_image with title: {title}, image_url: {image_url}, price: {price}, url: {url}, site: {site}")
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-
+async def _send_cached_photo(bot, cached, message, reply_markup):
+    """Send a cached image, reusing its Telegram file_id when we have one."""
+    if cached.telegram_file_id:
+        try:
+            return await bot.send_photo(
+                chat_id=TELEGRAM_CHANNEL_ID,
+                photo=cached.telegram_file_id,
+                caption=message,
+                parse_mode="HTML",
+                reply_markup=reply_markup,
+            )
+        except BadRequest as e:
+            logger.debug("Cached file_id rejected (%s), uploading the image again", e)
+            image_cache.forget_file_id(cached.content_hash)
+
+    with open(cached.path, "rb") as photo:
+        response = await bot.send_photo(
+            chat_id=TELEGRAM_CHANNEL_ID,
+            photo=photo,
+            caption=message,
+            parse_mode="HTML",
+            reply_markup=reply_markup,
+        )
+    if response.photo:
+        image_cache.remember_file_id(cached.content_hash, response.photo[-1].file_id)
+    return response
+
+async def deliver_to_telegram(bot, title, image_url, price, url, site, headline=None):
+    """Send one product notification with the given bot. Telegram errors are raised to the caller.
+
+    price is in cents (money.UNAVAILABLE when no price is shown); headline (see event_headline)
+    is shown above the title.
+    """
     # Validate and clean the main product URL
-    url = clean_url(url)
+    url = clean_url(affiliate_url(url))  # Stored URLs are canonical; the referral tag is added only here
     if not is_valid_url(url):
-        print(f"[ERROR] Invalid product URL: {url}. Skipping notification.")
-        return
+        logger.error("Invalid product URL: %s. Skipping notification.", url)
+        return None
 
     # Construct the message text
-    message = f"<b>{title}</b>\n\n👉🏼 {price}€ da <b>{site}</b>\n\n"
+    message = f"<b>{title}</b>\n\n👉🏼 {format_price(price)} da <b>{site}</b>\n\n"
+    if headline:
+        message = f"{headline}\n\n{message}"
 
     # Create buttons
     buttons = [[InlineKeyboardButton("🛒 Apri Amazon 🛒", url=url)]]
@@ -97,47 +125,42 @@ async def send_to_telegram_with_image(title, image_url, price, url, site):
     if is_valid_url(share_url):
         buttons.append([InlineKeyboardButton("📤 Condividi 📤", url=share_url)])
     else:
-        print(f"[ERROR] Invalid share URL skipped: {share_url}")
+        logger.error("Invalid share URL skipped: %s", share_url)
 
     reply_markup = InlineKeyboardMarkup(buttons)
 
-    try:
-        if image_url and is_valid_url(image_url):
-            print(f"[DEBUG] Attempting to send image message to {TELEGRAM_CHANNEL_ID}")
-            processed_image = process_image(image_url)
-            if processed_image:
-                print(f"[DEBUG] Processed image successfully")
-                response = await bot.send_photo(
-                    chat_id=TELEGRAM_CHANNEL_ID,
-                    photo=processed_image,
-                    caption=message,
-                    parse_mode="HTML",
-                    reply_markup=reply_markup,
-                )
-                print(f"[DEBUG] Sent: {title}")
-            else:
-                print(f"[DEBUG] Failed to process image")
-                response = await bot.send_message(
-                    chat_id=TELEGRAM_CHANNEL_ID,
-                    text=message,
-                    parse_mode="HTML",
-                    reply_markup=reply_markup,
-                )
-                print(f"[DEBUG] Sent: {title}")
-        else:
-            print(f"[DEBUG] No image URL provided or invalid image URL")
-            response = await bot.send_message(
-                chat_id=TELEGRAM_CHANNEL_ID,
-                text=message,
-                parse_mode="HTML",
-                reply_markup=reply_markup,
-            )
-            print(f"[DEBUG] Sent: {title}")
+    if image_url and is_valid_url(image_url):
+        logger.debug("Attempting to send image message to %s", TELEGRAM_CHANNEL_ID)
+        cached_image = await image_cache.get_image(image_url)
+        if cached_image:
+            logger.debug("Using cached image %s", cached_image.content_hash[:12])
+            response = await _send_cached_photo(bot, cached_image, message, reply_markup)
+            logger.debug("Sent: %s", title)
+            return response
+        logger.debug("Failed to process image")
+    else:
+        logger.debug("No image URL provided or invalid image URL")
+
+    response = await bot.send_message(
+        chat_id=TELEGRAM_CHANNEL_ID,
+        text=message,
+        parse_mode="HTML",
+        reply_markup=reply_markup,
+    )
+    logger.debug("Sent: %s", title)
+    return response
+
+async def send_to_telegram_with_image(title, image_url, price, url, site, headline=None):
+    """Send a single notification immediately with a one-off Bot (see notify_queue for the tracker path)."""
+    logger.debug("Entering send_to_telegram_with_image with title: %s, image_url: %s, price: %s, url: %s, site: %s", title, image_url, price, url, site)
+    bot = Bot(token=TELEGRAM_BOT_TOKEN)
 
+    try:
+        await deliver_to_telegram(bot, title, image_url, price, url, site, headline)
     except TelegramError as e:
-        print(f"[ERROR] Telegram API Error: {e}")
+        logger.error("Telegram API Error: %s", e)
     except Exception as e:
-        print(f"[ERROR] Unexpected error while sending Telegram message: {e}")
+        logger.error("Unexpected error while sending Telegram message: %s", e)
 
 def send_email(subject, body):
     """Sends an email notification."""
@@ -154,9 +177,9 @@ def send_email(subject, body):
         server.sendmail(EMAIL_USERNAME, TO_EMAIL, msg.as_string())
         server.quit()
 
-        print(f"[INFO] Email sent: {subject}")
+        logger.info("Email sent: %s", subject)
     except Exception as e:
-        print(f"[ERROR] Failed to send email: {e}")
+        logger.error("Failed to send email: %s", e)
 
 def send_heartbeat():
     """Sends a periodic heartbeat email to confirm the script is running."""
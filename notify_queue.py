@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from collections import deque, namedtuple
+from telegram import Bot
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest, Forbidden, TelegramError
+from telegram.request import HTTPXRequest
+from dotenv import load_dotenv
+from notifications import TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID, deliver_to_telegram
+from scheduler import TokenBucket
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Point at a local stand-in (see telegram_stub_server.py), e.g. "http://127.0.0.1:8081/bot"
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", 2))
+NOTIFY_QUEUE_MAX = int(os.getenv("NOTIFY_QUEUE_MAX", 1000))
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0  # Seconds; doubles per attempt with jitter
+
+# Telegram limits: ~30 messages/s per bot, ~20 messages/min into one group or channel
+GLOBAL_PER_MINUTE = 30 * 60
+CHAT_PER_MINUTE = 20
+
+Notification = namedtuple("Notification", ["title", "image_url", "price", "url", "site", "enqueued_at", "headline"])
+
+async def _take(bucket):
+    """Wait (without blocking the loop) until the bucket grants a token."""
+    while not bucket.try_take():
+        await asyncio.sleep(bucket.seconds_until_token())
+
+class NotificationQueue:
+    """Outbound Telegram queue drained by a small worker pool sharing one Bot.
+
+    Scrapers call enqueue() and return immediately. Workers respect the global
+    and per-chat rate limits, wait out RetryAfter and retry transient failures
+    with exponential backoff.
+    """
+
+    def __init__(self, workers=NOTIFY_WORKERS, maxsize=NOTIFY_QUEUE_MAX, base_url=TELEGRAM_API_BASE_URL):
+        self.workers = workers
+        self.base_url = base_url
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks = []
+        self._bot = None
+        self._global_bucket = TokenBucket(GLOBAL_PER_MINUTE, burst=30)
+        self._chat_buckets = {}
+        self._latencies = deque(maxlen=500)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+
+    async def start(self):
+        """Create the shared Bot and spawn the workers."""
+        if self._tasks:
+            return
+        self._bot = Bot(
+            token=TELEGRAM_BOT_TOKEN,
+            base_url=self.base_url,
+            request=HTTPXRequest(connection_pool_size=self.workers + 2),
+        )
+        await self._bot.initialize()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+
+    def enqueue(self, title, image_url, price, url, site, headline=None):
+        """Queue a notification without waiting for delivery. Returns False if it was dropped."""
+        try:
+            self._queue.put_nowait(Notification(title, image_url, price, url, site, time.monotonic(), headline))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.increment("notifications_dropped")
+            logger.warning("Notification queue full, dropping: %s", title)
+            return False
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(CHAT_PER_MINUTE, burst=1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _deliver(self, notification):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await _take(self._global_bucket)
+            await _take(self._chat_bucket(TELEGRAM_CHANNEL_ID))
+            try:
+                with metrics.timer("notify", "telegram"):
+                    await deliver_to_telegram(self._bot, notification.title, notification.image_url,
+                                              notification.price, notification.url, notification.site,
+                                              notification.headline)
+                return True
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                logger.warning("Telegram asked to retry after %ss", delay)
+                await asyncio.sleep(delay)
+            except (BadRequest, Forbidden) as e:
+                # Permanent (e.g. bad caption or image, bot removed from the channel); BadRequest
+                # subclasses NetworkError, so it must be caught before the retry branch
+                logger.error("Telegram API Error: %s", e)
+                return False
+            except (TimedOut, NetworkError) as e:
+                delay = BACKOFF_BASE * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+                logger.warning("Telegram send failed (%s), retry %s/%s in %.1fs", e, attempt, MAX_ATTEMPTS, delay)
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                logger.error("Telegram API Error: %s", e)
+                return False
+            self.retries += 1
+            metrics.increment("retries", "telegram")
+        return False
+
+    async def _worker(self, index):
+        while True:
+            notification = await self._queue.get()
+            try:
+                delivered = await self._deliver(notification)
+                metrics.increment("notifications_sent" if delivered else "notifications_failed")
+                if delivered:
+                    self.sent += 1
+                    self._latencies.append(time.monotonic() - notification.enqueued_at)
+                else:
+                    self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                metrics.increment("notifications_failed")
+                logger.error("Unexpected error while sending Telegram message: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        """Queue depth, delivery counters and enqueue-to-delivery latency."""
+        latencies = sorted(self._latencies)
+        return {
+            "depth": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "latency_avg_seconds": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "latency_p95_seconds": round(latencies[math.ceil(0.95 * len(latencies)) - 1], 2) if latencies else 0.0,
+        }
+
+    async def stop(self, drain_timeout=30):
+        """Give queued notifications a chance to go out, then stop the workers and the Bot."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d notification(s) not sent before shutdown", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._bot.shutdown()
+
+_queue = None
+
+def get_queue():
+    """Return the process-wide notification queue."""
+    global _queue
+    if _queue is None:
+        _queue = NotificationQueue()
+    return _queue
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+import metrics
+from database import (initialize_database, fetch_archive_blob, save_archived_page, last_archived_at,
+                      drop_archive_chunk, archive_stats)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("PAGE_ARCHIVE_DIR", "")  # Empty: don't archive fetched pages
+MAX_ARCHIVE_BYTES = int(float(os.getenv("PAGE_ARCHIVE_MAX_MB", 2048)) * 1024 * 1024)
+CHUNK_BYTES = int(float(os.getenv("PAGE_ARCHIVE_CHUNK_MB", 64)) * 1024 * 1024)
+MIN_INTERVAL = int(os.getenv("PAGE_ARCHIVE_MIN_INTERVAL", 3600))  # Seconds between archived copies of one product
+COMPRESSION_LEVEL = 6
+
+_lock = threading.Lock()  # One writer appends to the current chunk at a time
+_current_chunk = None
+_last_archived = {}  # url -> fetched_at of its newest archived copy
+
+def chunk_path(chunk):
+    return os.path.join(ARCHIVE_DIR, f"{chunk:08d}.zchunk")
+
+def _chunks():
+    """Chunk numbers on disk, oldest first."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(int(name.split(".")[0]) for name in os.listdir(ARCHIVE_DIR) if name.endswith(".zchunk"))
+
+def _open_chunk():
+    """Number of the chunk new bodies go to (the newest on disk). Called with _lock held."""
+    global _current_chunk
+    if _current_chunk is None:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        _current_chunk = (_chunks() or [1])[-1]
+    return _current_chunk
+
+def _append(compressed):
+    """Append a compressed body to the current chunk, starting a new one when it is full.
+    Returns (chunk, offset, length). Called with _lock held."""
+    global _current_chunk
+    path = chunk_path(_open_chunk())
+    if os.path.exists(path) and os.path.getsize(path) >= CHUNK_BYTES:
+        _current_chunk += 1
+        path = chunk_path(_current_chunk)
+        _enforce_cap()
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(compressed)
+    return _current_chunk, offset, len(compressed)
+
+def _enforce_cap():
+    """Drop the oldest chunk files (and the fetches stored in them) while the archive exceeds the cap."""
+    chunks = _chunks()
+    total = sum(os.path.getsize(chunk_path(chunk)) for chunk in chunks)
+    while total > MAX_ARCHIVE_BYTES and len(chunks) > 1:
+        oldest = chunks.pop(0)
+        size = os.path.getsize(chunk_path(oldest))
+        dropped = drop_archive_chunk(oldest)
+        os.remove(chunk_path(oldest))
+        total -= size
+        _last_archived.clear()  # Dropped fetches may have been the newest of some products
+        logger.info("Page archive over %d MB: dropped chunk %d (%d fetches)", MAX_ARCHIVE_BYTES // (1024 * 1024),
+                    oldest, dropped)
+
+def _read(chunk, offset, length):
+    with open(chunk_path(chunk), "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+def _store(url, body, encoding, fetched_at):
+    content_hash = hashlib.sha256(body).hexdigest()
+    with _lock:
+        location = fetch_archive_blob(content_hash)
+        if location is None:
+            blob = _append(zlib.compress(body, COMPRESSION_LEVEL)) + (len(body),)
+        elif location[0] != _open_chunk():
+            # Identical body stored in an older chunk: copy it forward (still compressed) so the
+            # retention cap, which drops whole chunks, never takes a recent fetch with it
+            metrics.increment("archive_dedup_hits")
+            blob = _append(_read(*location)) + (len(body),)
+        else:
+            metrics.increment("archive_dedup_hits")
+            blob = None
+        save_archived_page(url, fetched_at, content_hash, encoding, blob)
+    metrics.increment("pages_archived")
+
+def _due(url, now):
+    last = _last_archived.get(url)
+    if last is None:
+        last = _last_archived[url] = last_archived_at(url) or 0
+    return now - last >= MIN_INTERVAL
+
+async def store(url, response):
+    """Archive a fetched product page (at most once per MIN_INTERVAL per product). No-op when disabled.
+
+    Compression and file writes run in a thread; failures are logged, never raised.
+    """
+    if not ARCHIVE_DIR or response.status_code != 200 or not response.content:
+        return
+    now = time.time()
+    if not _due(url, now):
+        return
+    _last_archived[url] = now
+    try:
+        with metrics.timer("archive"):
+            await asyncio.to_thread(_store, url, response.content, response.encoding, now)
+    except Exception as e:
+        logger.error("Failed to archive %s: %s", url, e)
+
+def load_body(chunk, offset, length):
+    """Raw page bytes of an archived body."""
+    return zlib.decompress(_read(chunk, offset, length))
+
+def chunk_count():
+    return len(_chunks())
+
+if __name__ == "__main__":
+    from logging_setup import setup_logging
+
+    setup_logging()
+    initialize_database()
+    print(dict(archive_stats(), chunks=chunk_count()))
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for HTML parsing; 0 parses on the event-loop thread as before
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 0))
+
+_executor = None
+
+def get_executor():
+    """Return the shared parse process pool, or None when PARSE_WORKERS is 0."""
+    global _executor
+    if PARSE_WORKERS <= 0:
+        return None
+    if _executor is None:
+        # Spawned workers import only the parser modules; forking would copy the tracker's
+        # threads, sockets and SQLite connections
+        _executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+async def run(func, *args):
+    """Run a module-level parse function in the worker pool (inline without one) and return its result.
+
+    Arguments and results are pickled: pass the raw response bytes and return small records.
+    """
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool and parse this page inline
+        logger.error("Parse worker pool broke, restarting it")
+        shutdown()
+        return func(*args)
+
+def warm_up():
+    """Start every worker now so the first pages don't pay the process start-up cost."""
+    executor = get_executor()
+    if executor is not None:
+        for future in [executor.submit(os.getpid) for _ in range(PARSE_WORKERS)]:
+            future.result()
+
+def shutdown():
+    """Stop the worker processes."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,3 @@
+product_urls = [
+
+]
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Refresh stored products from the raw page archive, without fetching anything.
+
+Usage:
+    python reextract.py [URL ...] [--since HOURS] [--dry-run]
+
+Runs the current Amazon and GameStop extractors over the newest archived page of
+each product (see page_archive.py) and saves what changed, e.g. after fixing an
+extractor for new markup. Price history rows are dated at the archived fetch.
+Pages older than the product's newest live observation are left alone: the archive
+keeps one copy per PAGE_ARCHIVE_MIN_INTERVAL, so the tracker may have seen a newer
+state since. No notifications are sent. Set PARSE_WORKERS to parse in several processes.
+"""
+import argparse
+import asyncio
+import logging
+import time
+import page_archive
+import parse_pool
+from amazon_extract import parse_amazon_page
+from database import initialize_database, fetch_archived_pages, ProductStateCache
+from gamestop import parse_gamestop_product_html, REQUIRED_FIELDS
+from logging_setup import setup_logging
+from money import parse_price
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200  # Archived pages decompressed and parsed together
+SAME_CHECK_SECONDS = 30  # A history row this soon after a fetch was recorded by the check that made it
+
+def is_stale(fetched_at, last_observed):
+    """True if a live check observed the product after this archived fetch."""
+    return last_observed is not None and fetched_at < last_observed - SAME_CHECK_SECONDS
+
+def _extract_gamestop(body, encoding):
+    product_data = parse_gamestop_product_html(body.decode(encoding or "utf-8", errors="replace"))
+    if any(not product_data[field] for field in REQUIRED_FIELDS):
+        return None  # The live tracker would have needed Selenium for this page
+    product_data["price"] = parse_price(product_data["price"])
+    return product_data
+
+async def extract(url, body, encoding):
+    """Run the current extractor for the URL's shop over a page body; None if it yields no product."""
+    if "gamestop.it" in url:
+        return _extract_gamestop(body, encoding)
+    fingerprint, extracted = await parse_pool.run(parse_amazon_page, body, encoding, None)
+    product_data = extracted[0]
+    if product_data is not None:
+        product_data["fingerprint"] = fingerprint
+    return product_data
+
+async def reextract(urls=None, since=None, dry_run=False):
+    """Re-extract the newest archived page of each product (optionally only urls, or pages newer than since).
+
+    Returns {"pages": n, "stale": n, "extracted": n, "changed": n}; stale pages are older than
+    the product's newest live observation and are not re-extracted.
+    """
+    archived = fetch_archived_pages(urls, since)
+    rows = [row for row in archived if not is_stale(row[1], row[7])]
+    state = ProductStateCache.load()
+    counts = {"pages": len(archived), "stale": len(archived) - len(rows), "extracted": 0, "changed": 0}
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        bodies = [page_archive.load_body(*row[4:7]) for row in batch]
+        results = await asyncio.gather(*(extract(row[0], body, row[3]) for row, body in zip(batch, bodies)))
+        for (url, fetched_at, *_), product_data in zip(batch, results):
+            if product_data is None:
+                continue
+            counts["extracted"] += 1
+            if state.stage(url, product_data["title"], product_data["price"], product_data["availability"],
+                           product_data["image_url"], product_data.get("fingerprint"), observed_at=fetched_at):
+                counts["changed"] += 1
+                logger.debug("Re-extracted %s: %s", url, product_data)
+        if not dry_run:
+            state.flush()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="*", help="only these product URLs (default: every archived product)")
+    parser.add_argument("--since", type=float, help="ignore pages archived more than this many hours ago")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without saving")
+    args = parser.parse_args()
+
+    setup_logging()
+    initialize_database()
+    since = time.time() - args.since * 3600 if args.since is not None else None
+    parse_pool.warm_up()
+    try:
+        start = time.perf_counter()
+        counts = asyncio.run(reextract(args.urls or None, since, args.dry_run))
+        elapsed = time.perf_counter() - start
+    finally:
+        parse_pool.shutdown()
+    print(f"{counts['pages']} archived page(s), {counts['stale']} older than the last check, "
+          f"{counts['extracted']} extracted, {counts['changed']} changed"
+          f"{' (dry run, nothing saved)' if args.dry_run else ''} in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import re
+from dotenv import load_dotenv
+from utils import KEYWORDS, EXCLUDED_KEYWORDS, EXCLUDED_URLS
+
+load_dotenv()
+
+# Per-site include/exclude/blocklist rules; see rules_example.json. Without the file the
+# Amazon rules fall back to the lists in utils.py and other sites accept every product link.
+RULES_FILE = os.getenv("RULES_FILE", "rules.json")
+
+DEFAULT_RULES = {
+    "amazon": {"include": KEYWORDS, "exclude": EXCLUDED_KEYWORDS, "blocklist": EXCLUDED_URLS},
+}
+
+def _compile_any(patterns, prefix=""):
+    """One alternation of the lowercased literal patterns, or None if empty.
+
+    Matched against lowercased URLs: lowering once per URL and matching case-sensitively
+    is faster in CPython than an IGNORECASE pattern.
+    """
+    patterns = sorted({p.lower() for p in patterns if p}, key=len, reverse=True)
+    if not patterns:
+        return None
+    return re.compile(prefix + "(?:" + "|".join(map(re.escape, patterns)) + ")")
+
+class RuleSet:
+    """Include/exclude keywords and blocked URL prefixes for one site, compiled once.
+
+    A URL is accepted when it contains at least one include keyword (or there are
+    none), no exclude keyword, and does not start with a blocklisted URL. Matching
+    is case-insensitive; each URL is lowercased once and scanned once per pattern group.
+    """
+
+    def __init__(self, include=(), exclude=(), blocklist=()):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.blocklist = list(blocklist)
+        self._include_re = _compile_any(self.include)
+        self._exclude_re = _compile_any(self.exclude)
+        self._blocklist_re = _compile_any(self.blocklist, prefix="^")
+        # Changes whenever the accepted set of URLs may change (see AM.crawl_category)
+        groups = [sorted({p.lower() for p in group if p}) for group in (self.include, self.exclude, self.blocklist)]
+        self.fingerprint = hashlib.sha1(json.dumps(groups).encode("utf-8")).hexdigest()[:16]
+
+    def accepts(self, url):
+        """True if url passes the rules."""
+        url = url.lower()
+        if self._include_re is not None and self._include_re.search(url) is None:
+            return False
+        if self._exclude_re is not None and self._exclude_re.search(url) is not None:
+            return False
+        return self._blocklist_re is None or self._blocklist_re.match(url) is None
+
+    def filter(self, urls):
+        """Return the accepted URLs, in order."""
+        urls = list(urls)
+        include = self._include_re.search if self._include_re is not None else None
+        exclude = self._exclude_re.search if self._exclude_re is not None else None
+        blocked = self._blocklist_re.match if self._blocklist_re is not None else None
+        return [
+            url for url, lowered in zip(urls, map(str.lower, urls))
+            if (include is None or include(lowered))
+            and (exclude is None or not exclude(lowered))
+            and (blocked is None or not blocked(lowered))
+        ]
+
+def load_rules(path=RULES_FILE):
+    """Return {site: RuleSet} from a JSON rules file, falling back to DEFAULT_RULES."""
+    config = {site: dict(rules) for site, rules in DEFAULT_RULES.items()}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for site, rules in json.load(f).items():
+                config[site] = rules
+    return {
+        site: RuleSet(rules.get("include", ()), rules.get("exclude", ()), rules.get("blocklist", ()))
+        for site, rules in config.items()
+    }
+
+_rules = None
+
+def get_rules(site):
+    """Return the compiled RuleSet for a site ("amazon", "gamestop"); unknown sites accept everything."""
+    global _rules
+    if _rules is None:
+        _rules = load_rules()
+    return _rules.get(site) or RuleSet()
+
+def reload_rules():
+    """Re-read the rules file (e.g. after editing it) on the next get_rules() call."""
+    global _rules
+    _rules = None
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import os
+import time
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIN_CHECK_INTERVAL = int(os.getenv("SCHEDULER_MIN_INTERVAL", 60))  # Hot products: at most once a minute
+MAX_CHECK_INTERVAL = int(os.getenv("SCHEDULER_MAX_INTERVAL", 1800))  # Quiet products: at least every 30 minutes
+NEW_PRODUCT_AGE = 86400  # Products discovered in the last day are treated as hot
+VOLATILITY_ALPHA = 0.3  # Weight of the latest check in the volatility average
+INITIAL_VOLATILITY = 0.5
+
+# Requests per minute allowed per domain (CAPTCHA-safe budget)
+DOMAIN_BUDGETS = {
+    "amazon.it": int(os.getenv("AMAZON_REQUESTS_PER_MINUTE", 30)),
+    "gamestop.it": int(os.getenv("GAMESTOP_REQUESTS_PER_MINUTE", 10)),
+}
+
+def url_domain(url):
+    """Return the budget domain ("amazon.it", "gamestop.it") for a URL, or its host."""
+    host = urlparse(url).netloc.lower()
+    for domain in DOMAIN_BUDGETS:
+        if host == domain or host.endswith("." + domain):
+            return domain
+    return host
+
+class TokenBucket:
+    """Requests-per-minute budget with a small burst allowance."""
+
+    def __init__(self, per_minute, burst=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 6)
+        self.tokens = float(self.capacity)
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self):
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class _UrlStats:
+    __slots__ = ("first_seen", "volatility", "available", "checks", "last_change")
+
+    def __init__(self, now):
+        self.first_seen = now
+        self.volatility = INITIAL_VOLATILITY
+        self.available = None
+        self.checks = 0
+        self.last_change = None
+
+class AdaptiveScheduler:
+    """Priority queue of URLs ordered by their next check time.
+
+    Each URL's interval shrinks with its recent volatility (how often checks
+    found a change), is shorter for newly discovered and out-of-stock products,
+    and grows toward MAX_CHECK_INTERVAL for products that never change. Due URLs
+    are released only while their domain still has request budget; URLs of a
+    domain on hold are pushed back until the hold ends.
+    """
+
+    def __init__(self, budgets=None, min_interval=MIN_CHECK_INTERVAL, max_interval=MAX_CHECK_INTERVAL, clock=time.monotonic,
+                 hold=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._clock = clock
+        self._heap = []
+        self._due = {}  # url -> scheduled time; heap entries that disagree are stale
+        self._stats = {}
+        self._seq = itertools.count()
+        self._in_flight = set()
+        self._buckets = {domain: TokenBucket(rate, clock=clock) for domain, rate in (budgets or DOMAIN_BUDGETS).items()}
+        self._hold = hold  # hold(domain) -> seconds the domain must not be contacted (e.g. throttle.retry_after)
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+    def __len__(self):
+        return len(self._due) + len(self._in_flight)
+
+    def _push(self, url, due):
+        self._due[url] = due
+        heapq.heappush(self._heap, (due, next(self._seq), url))
+
+    def add(self, url, delay=0.0, age=0.0):
+        """Start tracking a URL, due after delay seconds. age is how long the product has been known."""
+        if url in self._stats:
+            return
+        now = self._clock()
+        self._stats[url] = _UrlStats(now - age)
+        self._push(url, now + delay)
+
+    def remove(self, url):
+        """Stop tracking a URL (its heap entry is dropped lazily)."""
+        self._stats.pop(url, None)
+        self._due.pop(url, None)
+        self._in_flight.discard(url)
+
+    def sync(self, urls, initial=False):
+        """Make the tracked set match urls. Returns (added, removed) counts.
+
+        With initial=True the URLs are existing catalog entries rather than new discoveries.
+        """
+        wanted = set(urls)
+        removed = [url for url in self._stats if url not in wanted]
+        for url in removed:
+            self.remove(url)
+        added = [url for url in wanted if url not in self._stats]
+        # Spread newly added URLs over a minute so a large import doesn't arrive as one burst
+        for index, url in enumerate(added):
+            self.add(url, delay=(index % 60) if len(added) > 60 else 0.0, age=NEW_PRODUCT_AGE if initial else 0.0)
+        return len(added), len(removed)
+
+    def interval_for(self, url):
+        """Seconds until the URL should be checked again, from its recent history."""
+        stats = self._stats[url]
+        span = self.max_interval - self.min_interval
+        interval = self.min_interval + span * (1.0 - stats.volatility) ** 2
+
+        if stats.available == 0:
+            interval *= 0.5  # Restocks sell out quickly
+        if self._clock() - stats.first_seen < NEW_PRODUCT_AGE:
+            interval = min(interval, 4 * self.min_interval)  # Fresh listings and preorders change often
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def pop_due(self, limit):
+        """Return up to limit due URLs, skipping (but keeping) those whose domain is out of budget."""
+        now = self._clock()
+        ready, deferred = [], []
+        while self._heap and len(ready) < limit:
+            due, seq, url = self._heap[0]
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            if self._due.get(url) != due:
+                continue  # Stale entry (rescheduled or removed)
+
+            domain = url_domain(url)
+            hold = self._hold(domain) if self._hold is not None else 0.0
+            if hold > 0:
+                self._push(url, now + hold)  # Due again once the domain accepts requests
+                continue
+            bucket = self._buckets.get(domain)
+            if bucket is not None and not bucket.try_take():
+                deferred.append((due, seq, url))
+                continue
+
+            del self._due[url]
+            self._in_flight.add(url)
+            self._last_lag = now - due
+            self._max_lag = max(self._max_lag, self._last_lag)
+            ready.append(url)
+
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return ready
+
+    def admit(self, url):
+        """Take one request of the URL's domain budget; False if it is spent or the domain is on hold."""
+        domain = url_domain(url)
+        if self._hold is not None and self._hold(domain) > 0:
+            return False
+        bucket = self._buckets.get(domain)
+        return bucket is None or bucket.try_take()
+
+    def observe(self, url, changed, available=None):
+        """Update a URL's change statistics without scheduling it. Returns its next interval (None if untracked)."""
+        stats = self._stats.get(url)
+        if stats is None:
+            return None
+        stats.checks += 1
+        stats.volatility = (1 - VOLATILITY_ALPHA) * stats.volatility + VOLATILITY_ALPHA * (1.0 if changed else 0.0)
+        if changed:
+            stats.last_change = self._clock()
+        if available is not None:
+            stats.available = 1 if available else 0
+        return self.interval_for(url)
+
+    def record(self, url, changed, available=None):
+        """Record a check result and schedule the URL's next check."""
+        self._in_flight.discard(url)
+        interval = self.observe(url, changed, available)
+        if interval is not None:  # None: removed while in flight
+            self._push(url, self._clock() + interval)
+
+    def budget_wait(self):
+        """Seconds until any domain has request budget again."""
+        return min((bucket.seconds_until_token() for bucket in self._buckets.values()), default=0.0)
+
+    def seconds_until_next(self):
+        """How long the caller can sleep before pop_due() may return something."""
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return float(self.min_interval)
+
+        wait = self._heap[0][0] - self._clock()
+        if wait > 0:
+            return wait
+
+        # Something is due but its domain is out of budget
+        return max(0.1, self.budget_wait())
+
+    def stats(self):
+        """Queue depth, backlog and lag (max lag since the previous call), plus remaining budget per domain."""
+        now = self._clock()
+        overdue = [now - due for due in self._due.values() if due <= now]
+        stats = {
+            "queue_depth": len(self._due),
+            "in_flight": len(self._in_flight),
+            "overdue": len(overdue),
+            "oldest_overdue_seconds": round(max(overdue), 1) if overdue else 0.0,
+            "last_dispatch_lag_seconds": round(self._last_lag, 1),
+            "max_dispatch_lag_seconds": round(self._max_lag, 1),
+            "budget_tokens": {domain: round(bucket.tokens, 1) for domain, bucket in self._buckets.items()},
+        }
+        self._max_lag = 0.0
+        return stats
@@ -1,10 +1,10 @@
 from amazon import get_amazon_product_details
-from gamestop import get_gamestop_product_data
+from gamestop import get_gamestop_product
 
 
 SCRAPER_MAP = {
     "amazon.it": get_amazon_product_details,
-    "gamestop.it": get_gamestop_product_data,
+    "gamestop.it": get_gamestop_product,
 }
 
 async def get_product_details(url):
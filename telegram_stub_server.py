@@ -0,0 +1,88 @@
+"""Local stand-in for the Telegram Bot API, for testing notifications offline.
+
+Run it, then point the tracker at it:
+    python telegram_stub_server.py --port 8081 [--retry-after-every 5]
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot python main.py
+
+Every Bot API call is answered with a plausible success payload and logged.
+With --retry-after-every N, every Nth send is rejected with HTTP 429 and a
+retry_after hint, which exercises the notification queue's backoff.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_counter = itertools.count(1)
+_lock = threading.Lock()
+
+def _message(message_id, method):
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": -1001234567890, "type": "channel", "title": "Stub channel"},
+    }
+    if method == "sendPhoto":
+        message["photo"] = [{"file_id": f"stub-file-{message_id}", "file_unique_id": f"stub-{message_id}", "width": 500, "height": 500}]
+    else:
+        message["text"] = "stub"
+    return message
+
+class StubBotAPIHandler(BaseHTTPRequestHandler):
+    retry_after_every = 0
+    retry_after_seconds = 1
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+
+        if method == "getMe":
+            self._reply(200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}})
+            return
+
+        with _lock:
+            call_number = next(_counter)
+        if self.retry_after_every and call_number % self.retry_after_every == 0:
+            print(f"[STUB] {method} #{call_number} -> 429")
+            self._reply(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after_seconds}",
+                "parameters": {"retry_after": self.retry_after_seconds},
+            })
+            return
+
+        print(f"[STUB] {method} #{call_number} -> ok")
+        self._reply(200, {"ok": True, "result": _message(call_number, method)})
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--retry-after-every", type=int, default=0, help="reject every Nth send with 429")
+    parser.add_argument("--retry-after-seconds", type=int, default=1)
+    args = parser.parse_args()
+
+    StubBotAPIHandler.retry_after_every = args.retry_after_every
+    StubBotAPIHandler.retry_after_seconds = args.retry_after_seconds
+    server = ThreadingHTTPServer((args.host, args.port), StubBotAPIHandler)
+    print(f"[INFO] Stub Bot API listening on http://{args.host}:{args.port}/bot<token>/")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
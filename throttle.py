@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+import httpx
+from dotenv import load_dotenv
+import metrics
+from scheduler import url_domain
+from utils import USER_AGENTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# AIMD bounds per host: clean responses raise concurrency and rate additively, challenges halve them
+MAX_CONCURRENCY = int(os.getenv("HTTP_PER_HOST_CONCURRENCY", 4))  # Ceiling for in-flight requests per host
+MAX_PER_MINUTE = float(os.getenv("THROTTLE_MAX_PER_MINUTE", 60))
+MIN_PER_MINUTE = float(os.getenv("THROTTLE_MIN_PER_MINUTE", 2))
+RATE_STEP = 1.0  # Requests per minute added after each clean response
+DECREASE_FACTOR = 0.5
+
+# Circuit breaker: opens when the share of bad outcomes in the recent window spikes
+BREAKER_WINDOW = 20  # Most recent outcomes considered
+BREAKER_MIN_SAMPLES = 5
+BREAKER_THRESHOLD = float(os.getenv("THROTTLE_BREAKER_THRESHOLD", 0.5))
+BREAKER_COOLDOWN = float(os.getenv("THROTTLE_BREAKER_COOLDOWN", 300))  # Seconds; doubles while probes keep failing
+MAX_BREAKER_COOLDOWN = 3600
+
+# Outcomes reported for every request
+OK = "ok"
+CAPTCHA = "captcha"
+EMPTY = "empty"
+THROTTLED = "throttled"  # HTTP 429 / 503
+ERROR = "error"  # Transport errors and other 5xx
+CHALLENGES = frozenset((CAPTCHA, EMPTY, THROTTLED))
+
+# Hosts that answer bots with a challenge page instead of an error status
+CHALLENGE_PATTERNS = {
+    "amazon.it": re.compile(r"captcha|type the characters you see below", re.IGNORECASE),
+}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class HostUnavailable(httpx.HTTPError):
+    """Raised instead of sending a request while the host's circuit breaker is open."""
+
+def classify_response(domain, response):
+    """Return the outcome (OK, CAPTCHA, EMPTY, THROTTLED or ERROR) of a response from domain."""
+    status = response.status_code
+    if status in (429, 503):
+        return THROTTLED
+    if status >= 500:
+        return ERROR
+    if status >= 400:
+        return OK  # A missing product is not a sign of trouble with the host
+    if status == 200 and not response.content.strip():
+        return EMPTY
+    pattern = CHALLENGE_PATTERNS.get(domain)
+    if pattern is not None and pattern.search(response.text):
+        return CAPTCHA
+    return OK
+
+class HostController:
+    """Adaptive concurrency, request pacing and a circuit breaker for one host.
+
+    Requests are spaced 60 / per_minute seconds apart with at most `concurrency`
+    in flight. Each clean response raises both additively; each CAPTCHA, empty
+    page or 429/503 halves them and rotates the User-Agent and session cookies.
+    When bad outcomes make up BREAKER_THRESHOLD of the recent window, the breaker
+    opens and requests fail fast with HostUnavailable for the cooldown; then a
+    single probe request decides whether it closes again.
+    """
+
+    def __init__(self, domain, max_concurrency=MAX_CONCURRENCY, max_per_minute=MAX_PER_MINUTE,
+                 min_per_minute=MIN_PER_MINUTE, clock=time.monotonic):
+        self.domain = domain
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_minute = max_per_minute
+        self.min_per_minute = min(min_per_minute, max_per_minute)
+        self.concurrency = float(self.max_concurrency)
+        self.per_minute = max_per_minute
+        self.state = CLOSED
+        self.in_flight = 0
+        self.user_agent = random.choice(USER_AGENTS)
+        self.session_generation = 0  # Bumped on every identity rotation; http_client drops the cookies
+        self._clock = clock
+        self._next_send = 0.0
+        self._outcomes = deque(maxlen=BREAKER_WINDOW)
+        self._cooldown = BREAKER_COOLDOWN
+        self._open_until = 0.0
+
+    def _limit(self):
+        return 1 if self.state == HALF_OPEN else int(self.concurrency)
+
+    def retry_after(self):
+        """Seconds until the breaker lets a request through (0 unless open)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._open_until - self._clock())
+
+    async def acquire(self):
+        """Wait for a concurrency slot and the next send time; raises HostUnavailable while open."""
+        while True:
+            now = self._clock()
+            if self.state == OPEN:
+                if now < self._open_until:
+                    raise HostUnavailable(f"{self.domain} circuit breaker open for {self._open_until - now:.0f}s")
+                self._set_state(HALF_OPEN)
+            if self.in_flight < self._limit() and now >= self._next_send:
+                break
+            # Polling keeps the controller independent of any one event loop
+            await asyncio.sleep(max(self._next_send - now, 0.05))
+
+        self.in_flight += 1
+        self._next_send = now + 60.0 / self.per_minute
+
+    def release(self, outcome):
+        """Record the outcome of an acquired request (None if it was cancelled)."""
+        self.in_flight -= 1
+        if outcome is None:
+            return
+        self._outcomes.append(outcome)
+
+        if outcome == OK:
+            if self.state == HALF_OPEN:
+                self._close()
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self.per_minute = min(self.max_per_minute, self.per_minute + RATE_STEP)
+        elif outcome in CHALLENGES:
+            metrics.increment(f"{outcome}_responses", self.domain)
+            self.concurrency = max(1.0, self.concurrency * DECREASE_FACTOR)
+            self.per_minute = max(self.min_per_minute, self.per_minute * DECREASE_FACTOR)
+            self._next_send = max(self._next_send, self._clock() + 60.0 / self.per_minute)
+            self.rotate_identity()
+
+        if self.state == HALF_OPEN and outcome != OK:
+            self._open()
+        elif self.state == CLOSED and len(self._outcomes) >= BREAKER_MIN_SAMPLES \
+                and self.bad_share() >= BREAKER_THRESHOLD:
+            self._open()
+        self._publish()
+
+    def bad_share(self):
+        """Share of non-OK outcomes in the recent window."""
+        if not self._outcomes:
+            return 0.0
+        return sum(outcome != OK for outcome in self._outcomes) / len(self._outcomes)
+
+    def rotate_identity(self):
+        """Switch to another User-Agent and start a fresh cookie session."""
+        choices = [agent for agent in USER_AGENTS if agent != self.user_agent] or USER_AGENTS
+        self.user_agent = random.choice(choices)
+        self.session_generation += 1
+        metrics.increment("identity_rotations", self.domain)
+
+    def _open(self):
+        if self.state == HALF_OPEN:
+            self._cooldown = min(MAX_BREAKER_COOLDOWN, self._cooldown * 2)  # The probe failed
+        self._open_until = self._clock() + self._cooldown * random.uniform(0.9, 1.1)
+        self._outcomes.clear()
+        self._set_state(OPEN)
+        metrics.increment("breaker_opens", self.domain)
+        logger.warning("Circuit breaker for %s open for %.0fs (CAPTCHA / error rate too high)",
+                       self.domain, self._cooldown)
+        self.rotate_identity()
+
+    def _close(self):
+        self._cooldown = BREAKER_COOLDOWN
+        self._outcomes.clear()
+        self._set_state(CLOSED)
+        logger.info("Circuit breaker for %s closed", self.domain)
+
+    def _set_state(self, state):
+        self.state = state
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("throttle_state", _STATE_VALUES[self.state], self.domain)
+        metrics.set_gauge("throttle_concurrency", round(self.concurrency, 2), self.domain)
+        metrics.set_gauge("throttle_per_minute", round(self.per_minute, 1), self.domain)
+        metrics.set_gauge("throttle_bad_share", round(self.bad_share(), 3), self.domain)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "concurrency": round(self.concurrency, 2),
+            "per_minute": round(self.per_minute, 1),
+            "in_flight": self.in_flight,
+            "bad_share": round(self.bad_share(), 3),
+            "retry_after_seconds": round(self.retry_after(), 1),
+        }
+
+_controllers = {}
+
+def get_controller(url):
+    """Return the controller for the URL's domain (all amazon.it hosts share one), creating it on first use."""
+    domain = url_domain(url)
+    controller = _controllers.get(domain)
+    if controller is None:
+        controller = _controllers[domain] = HostController(domain)
+    return controller
+
+def retry_after(domain):
+    """Seconds until domain accepts requests again (0 if it isn't blocked)."""
+    controller = _controllers.get(domain)
+    return controller.retry_after() if controller is not None else 0.0
+
+def controller_stats():
+    """State of every host controller, by domain."""
+    return {domain: controller.stats() for domain, controller in sorted(_controllers.items())}
@@ -1,7 +1,12 @@
-from urllib.parse import urlparse, parse_qs, urlencode
+import os
+import re
+from urllib.parse import urlparse, urlencode
 from dotenv import load_dotenv
 load_dotenv()
 
+# Affiliate tag added to Amazon links when a notification is sent ("?tag=yourtag" or "yourtag")
+REFERRAL_TAG = (os.getenv("REFERRAL_TAG") or "").replace("?tag=", "").strip()
+
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36",
@@ -23,18 +28,51 @@ EXCLUDED_KEYWORDS = [
 
 EXCLUDED_URLS = ["https://www.amazon.it/gp/gc"]
 
+AMAZON_ASIN_RE = re.compile(r"/(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})(?=[/?#]|$)", re.IGNORECASE)
+GAMESTOP_ID_RE = re.compile(r"/(\d{4,})(?=/|$)")
+
+def normalize_product_url(url):
+    """Return (product_key, canonical_url) for a product page URL, or (None, None) if it isn't one.
+
+    This is the single place product identity is decided: every spelling of an Amazon
+    product (slug, /gp/product/, tracking parameters, affiliate tag) maps to
+    "amazon:<ASIN>" and https://www.amazon.it/dp/<ASIN>; GameStop pages map to
+    "gamestop:<product id>" and their path up to the id.
+    """
+    if not url:
+        return None, None
+    parsed_url = urlparse(url.strip())
+    host = parsed_url.netloc.lower()
+
+    if host == "amazon.it" or host.endswith(".amazon.it"):
+        match = AMAZON_ASIN_RE.search(parsed_url.path)
+        if match:
+            asin = match.group(1).upper()
+            return f"amazon:{asin}", f"https://www.amazon.it/dp/{asin}"
+
+    elif host == "gamestop.it" or host.endswith(".gamestop.it"):
+        match = GAMESTOP_ID_RE.search(parsed_url.path)
+        if match:
+            return f"gamestop:{match.group(1)}", f"https://www.gamestop.it{parsed_url.path[:match.end(1)]}"
+
+    return None, None
+
 def clean_amazon_url(url):
-    """Keep only the Amazon product page and the affiliate tag while removing unnecessary parameters."""
-    parsed_url = urlparse(url)
-    query_params = parse_qs(parsed_url.query)
+    """Return the canonical https://www.amazon.it/dp/<ASIN> URL, or None if url is not a product page."""
+    return normalize_product_url(url)[1]
 
-    # Preserve only the affiliate tag
-    filtered_params = {k: v for k, v in query_params.items() if k == "tag"}
-    clean_query = urlencode(filtered_params, doseq=True)
+def affiliate_url(url):
+    """Add the referral tag to an Amazon product URL (done only when a link is shown to users)."""
+    product_key, canonical_url = normalize_product_url(url)
+    if not REFERRAL_TAG or not product_key or not product_key.startswith("amazon:"):
+        return url
+    return f"{canonical_url}?{urlencode({'tag': REFERRAL_TAG})}"
 
-    # Reconstruct the cleaned URL
-    clean_url = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
-    if clean_query:
-        clean_url += f"?{clean_query}"
+UNAVAILABLE_MARKERS = ("non disponibile", "esaurito", "non più disponibile", "unavailable", "out of stock", "sold out")
 
-    return clean_url
+def availability_flag(availability):
+    """Normalize scraped availability (bool for Amazon, text for GameStop) to 1/0."""
+    if isinstance(availability, str):
+        text = availability.strip().lower()
+        return 0 if not text or any(marker in text for marker in UNAVAILABLE_MARKERS) else 1
+    return 1 if availability else 0
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+import database
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "" runs a single tracker; "sqlite" shares the work table in DATABASE_PATH with every node using that file
+WORK_QUEUE_BACKEND = os.getenv("WORK_QUEUE", "").lower()
+NODE_ID = os.getenv("TRACKER_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv("WORK_LEASE_SECONDS", 300))  # A dead node's URLs are reclaimed after this
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 3  # Held leases are renewed this often
+
+class WorkQueueBackend(ABC):
+    """Storage for the shared work table: one row per URL with its next due time and lease.
+
+    Times are Unix seconds, so nodes need roughly synchronised clocks. claim() must be
+    atomic across nodes: a free, due URL may be leased to exactly one of them.
+    """
+
+    @abstractmethod
+    def add(self, entries):
+        """Add (url, next_due) entries; URLs already present keep their schedule."""
+
+    @abstractmethod
+    def remove(self, urls):
+        """Drop URLs from the table, leased or not."""
+
+    @abstractmethod
+    def claim(self, node_id, limit, lease_seconds):
+        """Lease up to limit due URLs that are free or whose lease expired; return them."""
+
+    @abstractmethod
+    def renew(self, node_id, urls, lease_seconds):
+        """Extend node_id's leases; return the URLs it still holds."""
+
+    @abstractmethod
+    def complete(self, node_id, entries):
+        """Release the leases on (url, next_due) entries, scheduling their next check."""
+
+    @abstractmethod
+    def release(self, node_id, urls):
+        """Release leases without changing when the URLs are due."""
+
+    @abstractmethod
+    def next_due(self):
+        """Unix time the next free URL falls due, or None."""
+
+    @abstractmethod
+    def stats(self):
+        """{"urls", "due", "oldest_overdue_seconds", "expired_leases", "leases_by_node"} for the whole table;
+        due and oldest_overdue_seconds count only URLs a node could claim now."""
+
+class SQLiteWorkQueue(WorkQueueBackend):
+    """The work_leases table in the tracker database; nodes on one host (or a shared disk) share the file."""
+
+    def add(self, entries):
+        database.add_work_items(entries)
+
+    def remove(self, urls):
+        database.remove_work_items(urls)
+
+    def claim(self, node_id, limit, lease_seconds):
+        return database.claim_work(node_id, limit, lease_seconds)
+
+    def renew(self, node_id, urls, lease_seconds):
+        return database.renew_leases(node_id, urls, lease_seconds)
+
+    def complete(self, node_id, entries):
+        database.complete_work(node_id, entries)
+
+    def release(self, node_id, urls):
+        database.release_leases(node_id, urls)
+
+    def next_due(self):
+        return database.next_work_due()
+
+    def stats(self):
+        return database.work_queue_stats()
+
+BACKENDS = {
+    "sqlite": SQLiteWorkQueue,
+}
+
+def get_backend(name=WORK_QUEUE_BACKEND):
+    """Return a backend instance for name, or None for single-node mode."""
+    if not name:
+        return None
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown WORK_QUEUE backend {name!r} (available: {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+class LeaseScheduler:
+    """Stands in for AdaptiveScheduler in track_products when several nodes share a work table.
+
+    Due URLs are claimed from the backend instead of the local heap. The local
+    scheduler still supplies the per-domain budget, circuit-breaker holds and the
+    per-URL interval; the next due time is written back to the shared table when
+    the check completes. Leases are renewed by heartbeat() while checks run, and
+    a node that dies stops renewing, so its URLs become claimable again.
+    """
+
+    def __init__(self, scheduler, backend, node_id=NODE_ID, lease_seconds=LEASE_SECONDS):
+        self.scheduler = scheduler
+        self.backend = backend
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self._held = set()
+        self._new = {}  # url -> due, written with the next claim
+        self._completed = {}  # url -> next due, written with the next claim
+        self._retry_at = 0.0  # Don't re-claim right after handing URLs back for lack of budget
+
+    def __len__(self):
+        return len(self.scheduler)
+
+    def add(self, url, delay=0.0, age=0.0):
+        self.scheduler.add(url, delay, age)
+        self._new[url] = time.time() + delay
+
+    def remove(self, url):
+        self.scheduler.remove(url)
+        self._new.pop(url, None)
+        self.backend.remove([url])
+
+    def _flush(self):
+        if self._new:
+            self.backend.add(list(self._new.items()))
+            self._new.clear()
+        if self._completed:
+            self.backend.complete(self.node_id, list(self._completed.items()))
+            self._completed.clear()
+
+    def pop_due(self, limit):
+        """Claim up to limit due URLs; those this node has no budget for are handed back at once."""
+        self._flush()
+        if time.time() < self._retry_at:
+            return []
+        ready, returned = [], []
+        for url in self.backend.claim(self.node_id, limit, self.lease_seconds):
+            self.scheduler.add(url)  # Registered by another node's discovery before ours saw it
+            (ready if self.scheduler.admit(url) else returned).append(url)
+        if returned:
+            self.backend.release(self.node_id, returned)
+            self._retry_at = time.time() + max(1.0, self.scheduler.budget_wait())
+        self._held.update(ready)
+        return ready
+
+    def record(self, url, changed, available=None):
+        """Note the result; the lease is released with the URL's next due time on the next claim."""
+        self._held.discard(url)
+        interval = self.scheduler.observe(url, changed, available)
+        self._completed[url] = time.time() + (interval if interval is not None else self.scheduler.min_interval)
+
+    def seconds_until_next(self):
+        self._flush()  # Completions must be visible to other nodes before this one sleeps
+        now = time.time()
+        next_due = self.backend.next_due()
+        wait = next_due - now if next_due is not None else self.scheduler.min_interval
+        return max(0.1, wait, self._retry_at - now)
+
+    async def heartbeat(self):
+        """Renew this node's leases every HEARTBEAT_INTERVAL seconds while checks are running."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            held = list(self._held)
+            if not held:
+                continue
+            lost = set(held) - set(self.backend.renew(self.node_id, held, self.lease_seconds))
+            if lost:
+                logger.warning("Lost %d lease(s) to other nodes (checks took over %ds)", len(lost), self.lease_seconds)
+
+    def close(self):
+        """Write pending results and hand back unfinished URLs (on shutdown)."""
+        self._flush()
+        if self._held:
+            self.backend.release(self.node_id, list(self._held))
+            self._held.clear()
+
+    def stats(self):
+        """Backlog from the shared work table (the local heap is never popped here), this node's
+        leases and its remaining budget per domain."""
+        table = self.backend.stats()
+        return {
+            "node": self.node_id,
+            "queue_depth": table["urls"],
+            "in_flight": len(self._held),
+            "overdue": table["due"],
+            "oldest_overdue_seconds": table["oldest_overdue_seconds"],
+            "budget_tokens": self.scheduler.stats()["budget_tokens"],
+            "work_table": table,
+        }